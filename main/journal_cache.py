@@ -0,0 +1,164 @@
+import json
+import os
+import sqlite3
+from contextlib import closing
+from journal_catalog import NameCatalog, collect_names
+from journal_workbook import StreamingSheetReader, collect_entry_rows, compute_file_hash, read_file_stat
+
+
+class JournalSnapshot:
+    """Данные журнала, достаточные для просмотра без разбора xlsx
+
+    entries: месячный лист -> записи (строка, число, дисциплина, группа, нагрузка, часы L-Y...)
+    season_rows: семестровый лист -> строки "план" (строка, дисциплина, группа, нагрузка, плановые часы...)
+    disciplines, groups: каталоги имен из семестровых и месячных листов
+    """
+
+    def __init__(self, filename, file_stat, content_hash, sheetnames, entries, season_rows, disciplines, groups):
+        self.filename = filename
+        self.file_stat = file_stat
+        self.content_hash = content_hash
+        self.sheetnames = sheetnames
+        self.entries = entries
+        self.season_rows = season_rows
+        self.disciplines = disciplines
+        self.groups = groups
+
+
+def collect_catalogs(season_rows, entries):
+    """Собирает каталоги дисциплин и групп из строк "план" семестровых листов и записей месячных листов"""
+    disciplines = set()
+    groups = set()
+    for rows in season_rows:
+        disciplines |= collect_names(rows, 1)
+        groups |= collect_names(rows, 2)
+    for rows in entries:
+        disciplines |= collect_names(rows, 2)
+        groups |= collect_names(rows, 3)
+    return NameCatalog(disciplines).names, NameCatalog(groups).names
+
+
+def build_snapshot(filename, select_monthly_sheets, entry_range, entry_columns, season_sheets, season_columns, season_range):
+    """Потоково читает журнал и собирает его снимок
+
+    Если файл изменился во время чтения, снимок не собирается и возвращается None.
+    """
+    file_stat = read_file_stat(filename)
+    content_hash = compute_file_hash(filename)
+    reader = StreamingSheetReader(filename)
+    sheetnames = reader.sheetnames
+
+    entries = {}
+    first_row, last_row = entry_range
+    for sheet_name in select_monthly_sheets(sheetnames):
+        entries[sheet_name] = collect_entry_rows(
+            reader.read_rows(sheet_name, first_row, last_row, entry_columns), first_row)
+
+    # Строки "план" идут через одну, начиная с первой строки диапазона
+    season_rows = {}
+    first_row, last_row = season_range
+    for sheet_name in season_sheets:
+        if sheet_name in sheetnames:
+            season_rows[sheet_name] = [row for row in reader.read_rows(sheet_name, first_row, last_row, season_columns)
+                                       if (row[0] - first_row) % 2 == 0]
+
+    if read_file_stat(filename) != file_stat:
+        return None
+
+    return JournalSnapshot(filename, file_stat, content_hash, sheetnames, entries, season_rows,
+                           *collect_catalogs(season_rows.values(), entries.values()))
+
+
+class SidecarCache:
+    """Хранит снимок журнала в SQLite рядом с файлом, чтобы открывать неизмененный журнал без разбора xlsx
+
+    Снимок действителен, пока совпадают размер и время изменения файла, а если время
+    изменилось - пока совпадает хеш содержимого.
+    """
+
+    SCHEMA_VERSION = 5
+
+    def __init__(self, filename):
+        self.filename = filename
+        directory, basename = os.path.split(os.path.abspath(filename))
+        self.path = os.path.join(directory, f".{basename}.cache.sqlite")
+
+    def load(self):
+        """Возвращает снимок, если он соответствует текущему содержимому файла, иначе None"""
+        if not os.path.exists(self.path):
+            return None
+
+        try:
+            with closing(sqlite3.connect(self.path)) as conn:
+                meta = dict(conn.execute("SELECT key, value FROM meta"))
+                if meta.get('schema') != str(self.SCHEMA_VERSION):
+                    return None
+
+                cached_stat = (int(meta['size']), int(meta['mtime_ns']))
+                file_stat = read_file_stat(self.filename)
+                if file_stat != cached_stat:
+                    # Файл могли только "потрогать" - сверяем содержимое
+                    if file_stat[0] != cached_stat[0] or compute_file_hash(self.filename) != meta['content_hash']:
+                        return None
+                    with conn:
+                        conn.execute("UPDATE meta SET value = ? WHERE key = 'mtime_ns'", (str(file_stat[1]),))
+
+                entries = {}
+                for sheet_name, row, day, discipline, group, load_type, hours in conn.execute(
+                        "SELECT sheet, row, day, discipline, grp, load_type, hours FROM entries ORDER BY sheet, row"):
+                    entries.setdefault(sheet_name, []).append(
+                        (row, day, discipline, group, load_type) + tuple(json.loads(hours)))
+
+                season_rows = {sheet_name: [] for sheet_name in json.loads(meta['season_sheets'])}
+                for sheet_name, row, discipline, group, load_type, hours in conn.execute(
+                        "SELECT sheet, row, discipline, grp, load_type, hours FROM season_rows ORDER BY sheet, row"):
+                    season_rows[sheet_name].append((row, discipline, group, load_type) + tuple(json.loads(hours)))
+
+                sheetnames = json.loads(meta['sheetnames'])
+                for sheet_name in json.loads(meta['monthly_sheets']):
+                    entries.setdefault(sheet_name, [])
+
+                return JournalSnapshot(self.filename, file_stat, meta['content_hash'], sheetnames,
+                                       entries, season_rows, json.loads(meta['disciplines']),
+                                       json.loads(meta['groups']))
+        except (sqlite3.Error, OSError, KeyError, ValueError) as e:
+            print(f"Ошибка чтения кэша журнала: {e}")
+            return None
+
+    def store(self, snapshot):
+        """Перезаписывает кэш снимком одной транзакцией"""
+        try:
+            with closing(sqlite3.connect(self.path)) as conn:
+                with conn:
+                    # Таблицы пересоздаются, чтобы кэш старой версии схемы не мешал записи
+                    conn.execute("DROP TABLE IF EXISTS meta")
+                    conn.execute("DROP TABLE IF EXISTS entries")
+                    conn.execute("DROP TABLE IF EXISTS season_rows")
+                    conn.execute("CREATE TABLE meta (key TEXT PRIMARY KEY, value TEXT)")
+                    conn.execute("CREATE TABLE entries "
+                                 "(sheet TEXT, row INTEGER, day, discipline, grp, load_type, hours TEXT)")
+                    conn.execute("CREATE TABLE season_rows "
+                                 "(sheet TEXT, row INTEGER, discipline, grp, load_type, hours TEXT)")
+
+                    conn.executemany("INSERT INTO meta VALUES (?, ?)", [
+                        ('schema', str(self.SCHEMA_VERSION)),
+                        ('size', str(snapshot.file_stat[0])),
+                        ('mtime_ns', str(snapshot.file_stat[1])),
+                        ('content_hash', snapshot.content_hash),
+                        ('sheetnames', json.dumps(snapshot.sheetnames, ensure_ascii=False)),
+                        ('monthly_sheets', json.dumps(list(snapshot.entries), ensure_ascii=False)),
+                        ('season_sheets', json.dumps(list(snapshot.season_rows), ensure_ascii=False)),
+                        ('disciplines', json.dumps(snapshot.disciplines, ensure_ascii=False)),
+                        ('groups', json.dumps(snapshot.groups, ensure_ascii=False)),
+                    ])
+                    # Часы всех видов занятий хранятся одним вектором
+                    conn.executemany("INSERT INTO entries VALUES (?, ?, ?, ?, ?, ?, ?)",
+                                     [(sheet_name,) + row[:5] + (json.dumps(row[5:]),)
+                                      for sheet_name, rows in snapshot.entries.items() for row in rows])
+                    conn.executemany("INSERT INTO season_rows VALUES (?, ?, ?, ?, ?, ?)",
+                                     [(sheet_name,) + row[:4] + (json.dumps(row[4:]),)
+                                      for sheet_name, rows in snapshot.season_rows.items() for row in rows])
+            return True
+        except (sqlite3.Error, OSError) as e:
+            print(f"Ошибка записи кэша журнала: {e}")
+            return False
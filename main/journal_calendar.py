@@ -0,0 +1,317 @@
+import json
+import os
+import re
+from datetime import date, datetime, timedelta
+from journal_workbook import read_file_stat
+
+NUMERATOR = "числитель"
+DENOMINATOR = "знаменатель"
+BOTH_WEEKS = "обе недели"
+
+
+class CalendarError(ValueError):
+    """Файл календаря не читается или описывает даты неверно"""
+
+
+def build_month_sheet_map(sheetnames):
+    """Месяц (1-12) -> первый лист, в названии которого номер месяца стоит отдельным словом"""
+    month_sheets = {}
+    for month in range(1, 13):
+        pattern = re.compile(r'\b' + f"{month:02d}" + r'\b')
+        for sheet_name in sheetnames:
+            if pattern.search(sheet_name):
+                month_sheets[month] = sheet_name
+                break
+    return month_sheets
+
+
+def parse_day(text):
+    try:
+        return date.fromisoformat(str(text).strip())
+    except ValueError:
+        raise CalendarError(f"Неверная дата \"{text}\" - ожидается ГГГГ-ММ-ДД")
+
+
+def parse_day_range(text):
+    """"ГГГГ-ММ-ДД" или интервал "ГГГГ-ММ-ДД/ГГГГ-ММ-ДД" (включительно) -> (первый день, последний день)"""
+    first, _, last = str(text).partition('/')
+    first = parse_day(first)
+    last = parse_day(last) if last else first
+    if last < first:
+        raise CalendarError(f"Интервал \"{text}\" заканчивается раньше, чем начинается")
+    return first, last
+
+
+def parse_ics_day(value):
+    """Дата из значения DTSTART/DTEND: 20251104 или 20251104T090000[Z]"""
+    value = value.strip()
+    try:
+        return datetime.strptime(value[:8], '%Y%m%d').date()
+    except ValueError:
+        raise CalendarError(f"Неверная дата \"{value}\" в файле iCalendar")
+
+
+def unescape_ics_text(value):
+    """Текст свойства iCalendar без экранирования: \\, \\; \\n \\\\"""
+    return re.sub(r'\\([\\;,nN])', lambda match: '\n' if match.group(1) in 'nN' else match.group(1), value)
+
+
+def iter_ics_lines(lines):
+    """Склеивает перенесенные строки iCalendar (продолжение начинается с пробела или табуляции) на лету"""
+    pending = None
+    for line in lines:
+        line = line.rstrip('\r\n')
+        if line[:1] in (' ', '\t') and pending is not None:
+            pending += line[1:]
+            continue
+        if pending is not None:
+            yield pending
+        pending = line
+    if pending:
+        yield pending
+
+
+def iter_ics_events(path):
+    """Потоково читает события iCalendar: словарь свойство -> значение для каждого VEVENT
+
+    Файл читается построчно и в памяти держится только текущее событие. Параметры
+    свойств (;VALUE=DATE, ;TZID=...) отбрасываются - даты читаются из значения;
+    повторяющиеся EXDATE склеиваются через запятую.
+    """
+    with open(path, 'r', encoding='utf-8-sig') as f:
+        event = None
+        for line in iter_ics_lines(f):
+            name, _, value = line.partition(':')
+            name = name.partition(';')[0].upper()
+            if name == 'BEGIN' and value.strip().upper() == 'VEVENT':
+                event = {}
+            elif name == 'END' and value.strip().upper() == 'VEVENT' and event is not None:
+                yield event
+                event = None
+            elif event is not None:
+                if name == 'EXDATE' and name in event:
+                    value = event[name] + ',' + value
+                event[name] = value
+
+
+def read_ics_holidays(path):
+    """Читает события iCalendar как нерабочие дни: [(первый день, последний день, название)]
+
+    Для событий на весь день DTEND не входит в событие, для событий со временем входит
+    день окончания. Повторяющиеся события не разворачиваются, поэтому отвергаются - иначе
+    праздник молча пропал бы из календаря.
+    """
+    holidays = []
+    for event in iter_ics_events(path):
+        summary = unescape_ics_text(event.get('SUMMARY', '')).strip()
+        if 'RRULE' in event or 'RDATE' in event:
+            raise CalendarError(f"Повторяющиеся события не поддерживаются: {summary}")
+        if 'DTSTART' not in event:
+            raise CalendarError(f"У события нет даты начала: {summary}")
+        first = last = parse_ics_day(event['DTSTART'])
+        if 'DTEND' in event:
+            last = parse_ics_day(event['DTEND'])
+            if 'T' not in event['DTEND']:
+                last -= timedelta(days=1)
+            last = max(first, last)
+        holidays.append((first, last, summary))
+    return holidays
+
+
+class CalendarDefinition:
+    """Календарь учебных лет из файла, заранее сведенный в таблицы поиска по порядковому номеру дня
+
+    JSON-файл:
+        {
+          "years": {"2025": {"start": "2025-09-08", "first_week": "числитель"}},
+          "holidays": {"2025-11-04": "День народного единства", "2025-12-29/2026-01-11": "Каникулы"},
+          "transfers": {"2025-11-01": "2025-11-03"},
+          "ics": ["праздники.ics"]
+        }
+
+    years - начало занятий учебного года (год - по 1 сентября) и тип его первой недели;
+    holidays - нерабочие дни и интервалы, можно списком без названий; transfers - рабочий
+    день -> день, расписание которого в него переносится (тот день становится нерабочим);
+    ics - файлы iCalendar с дополнительными нерабочими днями. Вместо JSON можно указать
+    сразу файл .ics.
+    """
+
+    def __init__(self, years=None, holidays=(), transfers=None, sources=()):
+        # Учебный год -> (граница года, понедельник первой недели, четность первой недели)
+        self.years = {}
+        for year, (start, first_week) in (years or {}).items():
+            boundary = min(date(year, 9, 1), start)
+            if not date(year, 6, 1) <= start <= date(year, 12, 31):
+                raise CalendarError(f"Начало {year} учебного года {start} вне осени")
+            self.years[year] = (boundary.toordinal(), start.toordinal() - start.weekday(),
+                                0 if first_week == NUMERATOR else 1)
+
+        # Нерабочие дни: порядковый номер дня -> причина
+        self.excluded = {}
+        for first, last, reason in holidays:
+            for ordinal in range(first.toordinal(), last.toordinal() + 1):
+                self.excluded.setdefault(ordinal, reason or "нерабочий день")
+
+        # Переносы в обе стороны: рабочий день -> день расписания и обратно
+        self.working_as = {}
+        self.replaced_by = {}
+        for working_day, schedule_day in (transfers or {}).items():
+            working, schedule = working_day.toordinal(), schedule_day.toordinal()
+            if working in self.excluded:
+                raise CalendarError(f"День переноса {working_day} отмечен как нерабочий")
+            if schedule in self.replaced_by:
+                raise CalendarError(f"Расписание {schedule_day} перенесено дважды")
+            self.working_as[working] = schedule
+            self.replaced_by[schedule] = working
+            self.excluded.setdefault(schedule, f"перенесено на {working_day.strftime('%d.%m.%Y')}")
+
+        # Файлы, из которых собран календарь, и их отпечатки - для проверки актуальности
+        self.sources = {path: read_file_stat(path) for path in sources}
+
+    @classmethod
+    def load(cls, path):
+        path = os.path.abspath(path)
+        try:
+            if path.lower().endswith('.ics'):
+                return cls(holidays=read_ics_holidays(path), sources=[path])
+
+            with open(path, 'r', encoding='utf-8') as f:
+                config = json.load(f)
+            if not isinstance(config, dict):
+                raise CalendarError("Календарь должен быть объектом JSON")
+
+            years = {}
+            for year, settings in config.get('years', {}).items():
+                if not str(year).isdigit() or not isinstance(settings, dict) or 'start' not in settings:
+                    raise CalendarError(f"Неверное описание {year} учебного года")
+                # Календарь заглядывает в следующий год, поэтому 9999 уже не подходит
+                if not 1 <= int(year) <= 9998:
+                    raise CalendarError(f"Учебный год {year} вне диапазона 1-9998")
+                first_week = settings.get('first_week', NUMERATOR)
+                if first_week not in (NUMERATOR, DENOMINATOR):
+                    raise CalendarError(f"Первая неделя {year} года: \"{first_week}\" - ожидается "
+                                        f"\"{NUMERATOR}\" или \"{DENOMINATOR}\"")
+                years[int(year)] = (parse_day(settings['start']), first_week)
+
+            holidays = config.get('holidays', [])
+            if isinstance(holidays, dict):
+                holidays = [(*parse_day_range(key), reason) for key, reason in holidays.items()]
+            else:
+                holidays = [(*parse_day_range(key), "") for key in holidays]
+
+            transfers = {parse_day(working): parse_day(schedule)
+                         for working, schedule in config.get('transfers', {}).items()}
+
+            sources = [path]
+            directory = os.path.dirname(path)
+            for ics_file in config.get('ics', []):
+                ics_path = os.path.join(directory, ics_file)
+                holidays += read_ics_holidays(ics_path)
+                sources.append(os.path.abspath(ics_path))
+
+            return cls(years, holidays, transfers, sources)
+        except (OSError, json.JSONDecodeError, AttributeError, TypeError) as e:
+            raise CalendarError(f"Не удалось прочитать календарь {path}: {e}")
+
+    def is_current(self):
+        """Не менялись ли файлы, из которых собран календарь"""
+        try:
+            return all(read_file_stat(path) == stat for path, stat in self.sources.items())
+        except OSError:
+            return False
+
+
+# Собранные календари: путь -> определение; пересобираются, только если файлы изменились
+_definitions = {}
+
+
+def load_calendar_definition(path):
+    """Определение календаря из файла; разобранные файлы берутся из кэша, пока не изменятся"""
+    path = os.path.abspath(path)
+    definition = _definitions.get(path)
+    if definition is None or not definition.is_current():
+        definition = CalendarDefinition.load(path)
+        _definitions[path] = definition
+    return definition
+
+
+class AcademicCalendar:
+    """Календарь журнала: листы месяцев, четность недель и нерабочие дни
+
+    Соответствие месяцев листам строится один раз для книги. Четность недели считается
+    арифметически от первой недели учебного года: по умолчанию это неделя 1 сентября,
+    определение календаря может задать другое начало занятий и тип первой недели.
+    Нерабочие дни и переносы берутся из таблиц определения, поэтому проверка даты не
+    зависит от длины периода. Даты периода выдаются генератором сразу с шагом в неделю
+    или две, без перебора по дням.
+    """
+
+    def __init__(self, sheetnames=(), definition=None):
+        self.month_sheets = build_month_sheet_map(sheetnames)
+        self.definition = definition or CalendarDefinition()
+
+    def sheet_for(self, day):
+        return self.month_sheets.get(day.month)
+
+    def year_bounds(self, year):
+        """Граница учебного года, понедельник (или 1 сентября) его первой недели и ее четность"""
+        bounds = self.definition.years.get(year)
+        if bounds is None:
+            start = date(year, 9, 1).toordinal()
+            bounds = (start, start, 0)
+        return bounds
+
+    def year_start(self, day):
+        """Начало учебного года, в который попадает дата"""
+        ordinal = day.toordinal()
+        start = self.year_bounds(day.year)[0]
+        if ordinal >= start:
+            return date.fromordinal(start)
+        return date.fromordinal(self.year_bounds(day.year - 1)[0])
+
+    def week_parity(self, day):
+        """Тип недели, в которую попадает дата, по календарю"""
+        first_monday, parity = self.year_bounds(self.year_start(day).year)[1:]
+        return NUMERATOR if ((day.toordinal() - first_monday) // 7 + parity) % 2 == 0 else DENOMINATOR
+
+    def week_type(self, day):
+        """Тип недели расписания даты: перенесенный день идет по четности дня, из которого перенесен"""
+        ordinal = self.definition.working_as.get(day.toordinal())
+        return self.week_parity(date.fromordinal(ordinal) if ordinal else day)
+
+    def excluded_reason(self, day):
+        """Почему в этот день нет занятий или None, если день рабочий"""
+        return self.definition.excluded.get(day.toordinal())
+
+    def iter_dates(self, start, end, week_type=BOTH_WEEKS):
+        """Даты с start по end в день недели start: каждую неделю или только в недели нужной четности
+
+        Период режется по учебным годам - внутри года четность чередуется каждую неделю,
+        поэтому даты года получаются одним диапазоном с постоянным шагом. Нерабочие дни
+        пропускаются, перенесенное расписание выдается датой переноса; рабочие дни
+        переноса идут не по своему расписанию и тоже пропускаются.
+        """
+        excluded = self.definition.excluded
+        replaced_by = self.definition.replaced_by
+        working_as = self.definition.working_as
+
+        segment_start = start
+        while segment_start <= end:
+            next_year_start = date.fromordinal(self.year_bounds(self.year_start(segment_start).year + 1)[0])
+            segment_end = min(end, next_year_start - timedelta(days=1))
+
+            first = segment_start
+            step = 7
+            if week_type != BOTH_WEEKS:
+                step = 14
+                if self.week_parity(first) != week_type:
+                    first += timedelta(days=7)
+            for ordinal in range(first.toordinal(), segment_end.toordinal() + 1, step):
+                if ordinal in replaced_by:
+                    yield date.fromordinal(replaced_by[ordinal])
+                elif ordinal not in excluded and ordinal not in working_as:
+                    yield date.fromordinal(ordinal)
+
+            # Следующий учебный год продолжается с того же дня недели
+            weeks = -(-(next_year_start - start).days // 7)
+            segment_start = start + timedelta(weeks=weeks)
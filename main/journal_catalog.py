@@ -0,0 +1,66 @@
+from bisect import bisect_left
+from journal_totals import excel_text
+
+
+def catalog_key(name):
+    return name.lower()
+
+
+def clean_name(value):
+    """Имя для каталога: текст ячейки без пробелов по краям или None для пустой ячейки"""
+    if value is None:
+        return None
+    name = excel_text(value).strip()
+    return name or None
+
+
+def collect_names(rows, position):
+    """Собирает имена из колонки position строк в множество"""
+    names = set()
+    for row in rows:
+        name = clean_name(row[position])
+        if name:
+            names.add(name)
+    return names
+
+
+class NameCatalog:
+    """Имена дисциплин или групп без повторов, отсортированные без учета регистра
+
+    Порядок совпадает с QCompleter.CaseInsensitivelySortedModel, поэтому список отдается
+    комплитеру как есть - варианты по префиксу он ищет двоичным поиском. Новое имя
+    вставляется на свое место без пересборки списка.
+    """
+
+    def __init__(self, names=()):
+        by_key = {}
+        for name in names:
+            name = clean_name(name)
+            if name:
+                by_key.setdefault(catalog_key(name), name)
+        self.keys = sorted(by_key)
+        self.names = [by_key[key] for key in self.keys]
+
+    def __len__(self):
+        return len(self.names)
+
+    def __contains__(self, name):
+        name = clean_name(name)
+        if not name:
+            return False
+        key = catalog_key(name)
+        index = bisect_left(self.keys, key)
+        return index < len(self.keys) and self.keys[index] == key
+
+    def add(self, name):
+        """Добавляет имя и возвращает его позицию в списке; None - если имя пустое или уже есть"""
+        name = clean_name(name)
+        if not name:
+            return None
+        key = catalog_key(name)
+        index = bisect_left(self.keys, key)
+        if index < len(self.keys) and self.keys[index] == key:
+            return None
+        self.keys.insert(index, key)
+        self.names.insert(index, name)
+        return index
@@ -0,0 +1,68 @@
+from bisect import bisect_left
+from PySide6.QtCore import Qt, QAbstractListModel, QModelIndex
+
+
+def format_date_info(date_info):
+    return (f"{date_info['day']:02d}.{date_info['month']:02d}.{date_info['year']} "
+            f"({date_info['sheet']}, {date_info['week_type']})")
+
+
+class DateSelection(QAbstractListModel):
+    """Выбранные даты без повторов, упорядоченные по дате, - модель для списка и выбора дат
+
+    Даты хранятся отсортированным списком порядковых номеров и словарем описаний:
+    проверка на повтор - поиск в словаре, место вставки или удаления - двоичный поиск.
+    Виджеты получают сигналы только об измененной строке, а не перестраиваются целиком.
+    """
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.ordinals = []
+        self.infos = {}
+
+    def __len__(self):
+        return len(self.ordinals)
+
+    def __iter__(self):
+        return (self.infos[ordinal] for ordinal in self.ordinals)
+
+    def __contains__(self, day):
+        return day.toordinal() in self.infos
+
+    def __getitem__(self, row):
+        return self.infos[self.ordinals[row]]
+
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self.ordinals)
+
+    def data(self, index, role=Qt.DisplayRole):
+        if role == Qt.DisplayRole and index.isValid() and index.row() < len(self.ordinals):
+            return format_date_info(self[index.row()])
+        return None
+
+    def add(self, date_info):
+        """Добавляет дату на ее место; возвращает False, если дата уже выбрана"""
+        ordinal = date_info['date'].toordinal()
+        if ordinal in self.infos:
+            return False
+        row = bisect_left(self.ordinals, ordinal)
+        self.beginInsertRows(QModelIndex(), row, row)
+        self.ordinals.insert(row, ordinal)
+        self.infos[ordinal] = date_info
+        self.endInsertRows()
+        return True
+
+    def remove_row(self, row):
+        """Убирает дату по номеру строки и возвращает ее описание"""
+        self.beginRemoveRows(QModelIndex(), row, row)
+        ordinal = self.ordinals.pop(row)
+        date_info = self.infos.pop(ordinal)
+        self.endRemoveRows()
+        return date_info
+
+    def reset(self, date_infos=()):
+        """Заменяет выбор целиком - для сгенерированного периода и очистки"""
+        self.beginResetModel()
+        self.infos = {date_info['date'].toordinal(): date_info for date_info in date_infos}
+        self.ordinals = sorted(self.infos)
+        self.endResetModel()
@@ -0,0 +1,862 @@
+import re
+from openpyxl.utils.cell import column_index_from_string, get_column_letter, range_boundaries
+from journal_totals import excel_text, excel_trim
+
+
+class UnsupportedFormula(Exception):
+    """Формула использует то, что вычислитель не поддерживает"""
+
+
+class ExcelError:
+    """Значение ошибки Excel (#Н/Д, #ЗНАЧ! и т.п.)"""
+
+    __slots__ = ('code',)
+
+    def __init__(self, code):
+        self.code = code
+
+    def __eq__(self, other):
+        return isinstance(other, ExcelError) and other.code == self.code
+
+    def __hash__(self):
+        return hash(self.code)
+
+    def __repr__(self):
+        return self.code
+
+
+NA = ExcelError('#N/A')
+VALUE = ExcelError('#VALUE!')
+DIV0 = ExcelError('#DIV/0!')
+
+# Значение ячейки, которое вычислить нельзя (неподдерживаемая формула или зависимость от нее)
+UNKNOWN = object()
+
+STRING_PATTERN = r'"(?:[^"]|"")*"'
+REF_PATTERN = r"(?:(?:'(?:[^']|'')+'|[^\W\d][\w.]*)!)?\$?[A-Z]{1,3}\$?\d+(?::\$?[A-Z]{1,3}\$?\d+)?(?![\w(])"
+
+TOKEN_RE = re.compile(rf"""
+    (?P<space>\s+)
+  | (?P<string>{STRING_PATTERN})
+  | (?P<ref>{REF_PATTERN})
+  | (?P<number>\d+(?:\.\d*)?(?:[Ee][+-]?\d+)?|\.\d+(?:[Ee][+-]?\d+)?)
+  | (?P<name>[^\W\d][\w.]*)
+  | (?P<op><>|<=|>=|[-+*/&=<>(),;%^])
+""", re.VERBOSE)
+
+# Строки пропускаются, чтобы текст вида "A1" внутри кавычек не считался ссылкой
+RELATIVE_KEY_RE = re.compile(rf"{STRING_PATTERN}|(?P<ref>{REF_PATTERN})")
+CELL_PART_RE = re.compile(r'(\$?)([A-Z]{1,3})(\$?)(\d+)')
+
+COMPARISONS = ('=', '<>', '<', '>', '<=', '>=')
+
+
+def tokenize(text):
+    tokens = []
+    position = 0
+    while position < len(text):
+        match = TOKEN_RE.match(text, position)
+        if not match:
+            raise UnsupportedFormula(f"Не разобран фрагмент формулы: {text[position:position + 20]}")
+        position = match.end()
+        kind = match.lastgroup
+        if kind != 'space':
+            tokens.append((kind, match.group()))
+    return tokens
+
+
+def relative_key(formula, row, column):
+    """Формула, в которой относительные ссылки записаны смещениями от ячейки (как в стиле R1C1)
+
+    Формулы, протянутые по строкам шаблона, дают один и тот же ключ.
+    """
+    def relative_part(match):
+        col_abs, letters, row_abs, digits = match.groups()
+        col_text = letters if col_abs else f"C[{column_index_from_string(letters) - column}]"
+        row_text = digits if row_abs else f"R[{int(digits) - row}]"
+        return f"{col_text}{row_text}"
+
+    def replace(match):
+        if match.group('ref') is None:
+            return match.group()
+        return CELL_PART_RE.sub(relative_part, match.group())
+
+    return RELATIVE_KEY_RE.sub(replace, formula)
+
+
+def shift_tree(tree, row_offset, column_offset):
+    """Сдвигает относительные ссылки дерева формулы на заданное число строк и колонок"""
+    kind = tree[0]
+    if kind == 'ref':
+        sheet_name, row, column, (row_abs, col_abs) = tree[1:]
+        return ('ref', sheet_name, row if row_abs else row + row_offset,
+                column if col_abs else column + column_offset, tree[4])
+    if kind == 'range':
+        sheet_name, min_row, min_col, max_row, max_col = tree[1]
+        min_row_abs, min_col_abs, max_row_abs, max_col_abs = tree[2]
+        return ('range', (sheet_name,
+                          min_row if min_row_abs else min_row + row_offset,
+                          min_col if min_col_abs else min_col + column_offset,
+                          max_row if max_row_abs else max_row + row_offset,
+                          max_col if max_col_abs else max_col + column_offset), tree[2])
+    if kind == 'bin':
+        return ('bin', tree[1], shift_tree(tree[2], row_offset, column_offset),
+                shift_tree(tree[3], row_offset, column_offset))
+    if kind == 'neg':
+        return ('neg', shift_tree(tree[1], row_offset, column_offset))
+    if kind == 'call':
+        return ('call', tree[1], [shift_tree(arg, row_offset, column_offset) for arg in tree[2]])
+    return tree
+
+
+class FormulaParser:
+    """Разбирает формулу в дерево из кортежей
+
+    Ссылки и именованные диапазоны сразу разрешаются в ('ref', лист, строка, колонка, флаги)
+    и ('range', (лист, первая строка, первая колонка, последняя строка, последняя колонка), флаги),
+    где флаги отмечают абсолютные ($) строки и колонки.
+    """
+
+    def __init__(self, sheet_name, resolve_name):
+        self.sheet_name = sheet_name
+        self.resolve_name = resolve_name
+        self.tokens = []
+        self.position = 0
+        # Ключ формулы в смещениях -> (дерево, строка и колонка ячейки, для которой оно разобрано)
+        self.templates = {}
+
+    def parse_at(self, formula, row, column):
+        """Разбирает формулу ячейки, беря готовое дерево у такой же формулы из соседней строки"""
+        key = relative_key(formula, row, column)
+        template = self.templates.get(key)
+        if template is not None:
+            tree, origin_row, origin_column = template
+            return shift_tree(tree, row - origin_row, column - origin_column)
+        tree = self.parse(formula)
+        self.templates[key] = (tree, row, column)
+        return tree
+
+    def parse(self, formula):
+        self.tokens = tokenize(formula[1:])
+        self.position = 0
+        node = self.parse_comparison()
+        if self.position != len(self.tokens):
+            raise UnsupportedFormula(f"Лишние символы в формуле {formula}")
+        return node
+
+    def peek(self):
+        return self.tokens[self.position] if self.position < len(self.tokens) else (None, None)
+
+    def take(self, value=None):
+        token = self.peek()
+        if token[0] is None or (value is not None and token[1] != value):
+            raise UnsupportedFormula(f"Ожидалось {value or 'выражение'}")
+        self.position += 1
+        return token
+
+    def parse_comparison(self):
+        node = self.parse_concat()
+        while self.peek()[1] in COMPARISONS:
+            op = self.take()[1]
+            node = ('bin', op, node, self.parse_concat())
+        return node
+
+    def parse_concat(self):
+        node = self.parse_additive()
+        while self.peek()[1] == '&':
+            self.take()
+            node = ('bin', '&', node, self.parse_additive())
+        return node
+
+    def parse_additive(self):
+        node = self.parse_multiplicative()
+        while self.peek()[1] in ('+', '-'):
+            op = self.take()[1]
+            node = ('bin', op, node, self.parse_multiplicative())
+        return node
+
+    def parse_multiplicative(self):
+        node = self.parse_unary()
+        while self.peek()[1] in ('*', '/'):
+            op = self.take()[1]
+            node = ('bin', op, node, self.parse_unary())
+        return node
+
+    def parse_unary(self):
+        if self.peek()[1] in ('-', '+'):
+            op = self.take()[1]
+            node = self.parse_unary()
+            return ('neg', node) if op == '-' else node
+        return self.parse_primary()
+
+    def parse_primary(self):
+        kind, value = self.take()
+        if kind == 'number':
+            return ('const', float(value) if any(ch in value for ch in '.eE') else int(value))
+        if kind == 'string':
+            return ('const', value[1:-1].replace('""', '"'))
+        if kind == 'ref':
+            return parse_reference(value, self.sheet_name)
+        if kind == 'op' and value == '(':
+            node = self.parse_comparison()
+            self.take(')')
+            return node
+        if kind == 'name':
+            if self.peek()[1] == '(':
+                return self.parse_call(value.upper())
+            if value.upper() in ('TRUE', 'FALSE'):
+                return ('const', value.upper() == 'TRUE')
+            return self.resolve_name(value)
+        raise UnsupportedFormula(f"Неожиданный элемент формулы: {value}")
+
+    def parse_call(self, name):
+        if name not in FUNCTIONS:
+            raise UnsupportedFormula(f"Функция {name} не поддерживается")
+        self.take('(')
+        args = []
+        if self.peek()[1] != ')':
+            args.append(self.parse_comparison())
+            while self.peek()[1] in (',', ';'):
+                self.take()
+                args.append(self.parse_comparison())
+        self.take(')')
+        return ('call', name, args)
+
+
+def parse_reference(text, sheet_name):
+    """Разбирает ссылку вида 'Лист'!$A$1:$B$2 в узел дерева формулы"""
+    if '!' in text:
+        sheet_name, text = text.rsplit('!', 1)
+        if sheet_name.startswith("'"):
+            sheet_name = sheet_name[1:-1].replace("''", "'")
+    min_col, min_row, max_col, max_row = range_boundaries(text.replace('$', ''))
+    flags = []
+    for part in text.split(':'):
+        col_abs, letters, row_abs, digits = CELL_PART_RE.fullmatch(part).groups()
+        flags += [bool(row_abs), bool(col_abs)]
+    if ':' not in text:
+        return ('ref', sheet_name, min_row, min_col, tuple(flags))
+    return ('range', (sheet_name, min_row, min_col, max_row, max_col), tuple(flags))
+
+
+def is_number(value):
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+
+def to_number(value):
+    if isinstance(value, ExcelError):
+        return value
+    if value is None:
+        return 0
+    if isinstance(value, bool):
+        return int(value)
+    if is_number(value):
+        return value
+    try:
+        return float(value)
+    except ValueError:
+        return VALUE
+
+
+def to_bool(value):
+    if isinstance(value, ExcelError):
+        return value
+    if value is None:
+        return False
+    if isinstance(value, str):
+        upper = value.upper()
+        if upper in ('TRUE', 'FALSE'):
+            return upper == 'TRUE'
+        return VALUE
+    return bool(value)
+
+
+def to_text(value):
+    return value if isinstance(value, ExcelError) else excel_text(value)
+
+
+def compare(op, left, right):
+    """Сравнение по правилам Excel: числа < текст < логические, текст без учета регистра"""
+    for value in (left, right):
+        if isinstance(value, ExcelError):
+            return value
+    if left is None:
+        left = '' if isinstance(right, str) else (False if isinstance(right, bool) else 0)
+    if right is None:
+        right = '' if isinstance(left, str) else (False if isinstance(left, bool) else 0)
+
+    def rank(value):
+        return 2 if isinstance(value, bool) else (1 if isinstance(value, str) else 0)
+
+    left_key = (rank(left), left.lower() if isinstance(left, str) else left)
+    right_key = (rank(right), right.lower() if isinstance(right, str) else right)
+    if op == '=':
+        return left_key == right_key
+    if op == '<>':
+        return left_key != right_key
+    if op == '<':
+        return left_key < right_key
+    if op == '>':
+        return left_key > right_key
+    if op == '<=':
+        return left_key <= right_key
+    return left_key >= right_key
+
+
+def criteria_key(value):
+    """Ключ значения в индексе условий СУММЕСЛИ/СЧЁТЕСЛИ"""
+    if value is None or value == '':
+        return ''
+    if isinstance(value, bool):
+        return ('bool', value)
+    if is_number(value):
+        return float(value)
+    if isinstance(value, str):
+        return value.lower()
+    return value
+
+
+def parse_criteria(criteria):
+    """Возвращает ('eq', ключ) для точного совпадения или ('test', функция) для остальных условий"""
+    if isinstance(criteria, str):
+        match = re.match(r'(<>|<=|>=|=|<|>)(.*)$', criteria, re.DOTALL)
+        op, operand = (match.group(1), match.group(2)) if match else ('=', criteria)
+        try:
+            operand_value = float(operand)
+        except ValueError:
+            operand_value = operand
+        if op == '=' and not isinstance(operand_value, float) and re.search(r'[*?~]', operand):
+            pattern = re.compile(wildcard_pattern(operand), re.IGNORECASE | re.DOTALL)
+            return 'test', lambda value: isinstance(value, str) and pattern.fullmatch(value) is not None
+        if op == '=':
+            return 'eq', criteria_key(operand_value)
+        if operand == '':
+            return 'test', lambda value: (value not in (None, '')) == (op == '<>')
+        return 'test', lambda value: value is not None and type(value) is not bool and (
+            isinstance(operand_value, float) == is_number(value)) and compare(op, value, operand_value) is True
+    return 'eq', criteria_key(criteria)
+
+
+def wildcard_pattern(text):
+    parts = []
+    index = 0
+    while index < len(text):
+        char = text[index]
+        if char == '~' and index + 1 < len(text):
+            parts.append(re.escape(text[index + 1]))
+            index += 2
+            continue
+        parts.append('.*' if char == '*' else '.' if char == '?' else re.escape(char))
+        index += 1
+    return ''.join(parts)
+
+
+class RangeNode:
+    """Диапазон ячеек как вершина графа зависимостей
+
+    Значения диапазона и индекс для поиска по условию кэшируются, пока не изменится
+    ни одна ячейка диапазона.
+    """
+
+    __slots__ = ('key', 'dependents', 'values', 'index')
+
+    def __init__(self, key):
+        self.key = key
+        self.dependents = set()
+        self.values = None
+        self.index = None
+
+    def contains_rows(self, first_row, last_row):
+        return self.key[1] <= last_row and first_row <= self.key[3]
+
+    def reset(self):
+        self.values = None
+        self.index = None
+
+
+class FormulaEvaluator:
+    """Вычисляет формулы шаблона журнала, чтобы сохранять их значения в файл
+
+    openpyxl не пересчитывает формулы, и после его сохранения у формул нет значений:
+    программы, читающие только значения, видят пустые ячейки. Вычислитель поддерживает
+    подмножество функций, которое использует шаблон (СУММЕСЛИ, СУММ, ПОИСКПОЗ, СЧЁТЕСЛИ,
+    СЧЁТЗ, СЦЕПИТЬ, СЖПРОБЕЛЫ, ЕСЛИ, ИЛИ, МАКС), и именованные диапазоны. Формулы с другими
+    функциями пропускаются вместе со всем, что от них зависит.
+
+    По ссылкам формул строится граф зависимостей: изменение ячейки сбрасывает только
+    зависящие от нее значения, и при следующем вычислении пересчитываются только они.
+
+    Формулы и значения ячеек читаются из файла функцией read_cells(лист), поэтому отложенные
+    листы книги при построении не разбираются.
+    """
+
+    def __init__(self, wb, sheet_names, read_cells):
+        self.wb = wb
+        self.sheet_names = [name for name in sheet_names if name in wb.sheetnames]
+        # (лист, строка, колонка) -> дерево формулы
+        self.formulas = {}
+        self.unsupported = set()
+        # Вычисленные значения формул
+        self.values = {}
+        # Лист -> {(строка, колонка): формулы, ссылающиеся на эту ячейку}
+        self.cell_dependents = {}
+        # Лист -> {ключ диапазона: вершина} и лист -> {колонка: вершины диапазонов с этой колонкой}
+        self.ranges = {}
+        self.column_ranges = {}
+        self.worksheets = {}
+        self.names = {}
+        # Листы, значения формул которых изменились с последнего сохранения
+        self.stale_sheets = set(self.sheet_names)
+        # Ячейки листов, прочитанные из файла: лист -> {(строка, колонка): значение}.
+        # Пока use_workbook ложно, все значения берутся отсюда, и вычислитель можно строить
+        # в фоне, не трогая книгу в памяти; потом отсюда читаются только неразобранные листы
+        self.file_cells = {}
+        self.use_workbook = False
+
+        for sheet_name in self.sheet_names:
+            cells = self.file_cells[sheet_name] = read_cells(sheet_name)
+            parser = FormulaParser(sheet_name, lambda name, sheet_name=sheet_name: self.resolve_name(name, sheet_name))
+            for (row, column), value in cells.items():
+                if isinstance(value, str) and value.startswith('='):
+                    key = (sheet_name, row, column)
+                    try:
+                        tree = parser.parse_at(value, row, column)
+                        self.register_dependencies(key, tree)
+                    except (UnsupportedFormula, ValueError):
+                        self.unsupported.add(key)
+                        continue
+                    self.formulas[key] = tree
+
+        # Листы без вычисляемых формул, на которые ссылаются формулы (например, Инфо)
+        for sheet_name in set(self.cell_dependents) | set(self.ranges):
+            if sheet_name not in self.file_cells and sheet_name in wb.sheetnames:
+                self.file_cells[sheet_name] = read_cells(sheet_name)
+
+    def resolve_name(self, name, sheet_name):
+        """Разрешает именованный диапазон книги или листа в узел дерева формулы"""
+        key = (name, sheet_name)
+        if key not in self.names:
+            self.names[key] = self.lookup_name(name, sheet_name)
+        return self.names[key]
+
+    def lookup_name(self, name, sheet_name):
+        defined = self.worksheet(sheet_name).defined_names.get(name) or self.wb.defined_names.get(name)
+        if defined is None:
+            raise UnsupportedFormula(f"Неизвестное имя {name}")
+        destinations = list(defined.destinations)
+        if len(destinations) != 1:
+            raise UnsupportedFormula(f"Имя {name} не является одним диапазоном")
+        target_sheet, reference = destinations[0]
+        return parse_reference(reference, target_sheet)
+
+    def register_dependencies(self, key, tree):
+        kind = tree[0]
+        if kind == 'ref':
+            self.cell_dependents.setdefault(tree[1], {}).setdefault((tree[2], tree[3]), set()).add(key)
+        elif kind == 'range':
+            self.range_node(tree[1]).dependents.add(key)
+        elif kind == 'bin':
+            self.register_dependencies(key, tree[2])
+            self.register_dependencies(key, tree[3])
+        elif kind == 'neg':
+            self.register_dependencies(key, tree[1])
+        elif kind == 'call':
+            args = tree[2]
+            if tree[1] == 'SUMIF' and len(args) == 3:
+                # Суммируется диапазон размером с диапазон условий - от него формула и зависит
+                self.register_dependencies(key, args[0])
+                self.register_dependencies(key, args[1])
+                self.range_node(sumif_sum_range(range_argument(args[0]), range_argument(args[2]))).dependents.add(key)
+                return
+            for arg in args:
+                self.register_dependencies(key, arg)
+
+    def range_node(self, range_key):
+        nodes = self.ranges.setdefault(range_key[0], {})
+        node = nodes.get(range_key)
+        if node is None:
+            node = nodes[range_key] = RangeNode(range_key)
+            columns = self.column_ranges.setdefault(range_key[0], {})
+            for column in range(range_key[2], range_key[4] + 1):
+                columns.setdefault(column, []).append(node)
+        return node
+
+    # --- Сброс значений ---
+
+    def invalidate_rows(self, sheet_name, first_row, last_row):
+        """Сбрасывает значения формул, зависящих от строк first_row..last_row листа"""
+        stack = []
+        for node in self.ranges.get(sheet_name, {}).values():
+            if node.contains_rows(first_row, last_row):
+                node.reset()
+                stack.extend(node.dependents)
+        points = self.cell_dependents.get(sheet_name, {})
+        for (row, column), dependents in points.items():
+            if first_row <= row <= last_row:
+                stack.extend(dependents)
+        self.invalidate(stack)
+
+    def invalidate_sheet(self, sheet_name):
+        """Сбрасывает значения формул, зависящих от любых ячеек листа"""
+        self.invalidate_rows(sheet_name, 1, float('inf'))
+
+    def invalidate(self, stack):
+        while stack:
+            key = stack.pop()
+            if key not in self.values:
+                continue
+            del self.values[key]
+            sheet_name, row, column = key
+            self.stale_sheets.add(sheet_name)
+            stack.extend(self.cell_dependents.get(sheet_name, {}).get((row, column), ()))
+            for node in self.column_ranges.get(sheet_name, {}).get(column, ()):
+                if node.key[1] <= row <= node.key[3]:
+                    node.reset()
+                    stack.extend(node.dependents)
+
+    # --- Вычисление ---
+
+    def evaluate_all(self):
+        """Вычисляет все формулы, значения которых сброшены или еще не считались"""
+        for key in self.formulas:
+            if key not in self.values:
+                self.cell_value(*key)
+
+    def worksheet(self, sheet_name):
+        """Лист книги openpyxl без разбора отложенного листа: у заготовки есть имена листа, но нет ячеек"""
+        ws = self.worksheets.get(sheet_name)
+        if ws is None and sheet_name in self.wb.sheetnames:
+            ws = self.worksheets[sheet_name] = self.wb.workbook[sheet_name]
+        return ws
+
+    def cell_value(self, sheet_name, row, column):
+        key = (sheet_name, row, column)
+        if key in self.values:
+            return self.values[key]
+
+        tree = self.formulas.get(key)
+        if tree is None:
+            if key in self.unsupported:
+                return UNKNOWN
+            ws = self.worksheet(sheet_name) if self.use_workbook and self.wb.is_materialized(sheet_name) else None
+            if ws is not None:
+                cell = ws._cells.get((row, column))
+                value = cell.value if cell is not None else None
+            elif sheet_name in self.file_cells:
+                value = self.file_cells[sheet_name].get((row, column))
+            else:
+                return UNKNOWN
+            if (isinstance(value, str) and value.startswith('=')) or not isinstance(value, (str, int, float, type(None))):
+                # Формула вне вычисляемых листов или значение вне подмножества (даты и т.п.)
+                return UNKNOWN
+            return value
+
+        self.values[key] = UNKNOWN
+        try:
+            value = self.evaluate(tree)
+        except UnsupportedFormula:
+            value = UNKNOWN
+        if value is None:
+            value = 0
+        self.values[key] = value
+        return value
+
+    def range_values(self, range_key):
+        node = self.range_node(range_key)
+        if node.values is None:
+            sheet_name, min_row, min_col, max_row, max_col = range_key
+            values = []
+            for row in range(min_row, max_row + 1):
+                for column in range(min_col, max_col + 1):
+                    value = self.cell_value(sheet_name, row, column)
+                    if value is UNKNOWN:
+                        raise UnsupportedFormula(f"Диапазон {range_key} зависит от невычисляемой ячейки")
+                    values.append(value)
+            node.values = values
+        return node.values
+
+    def range_index(self, range_key):
+        """Индекс диапазона: ключ значения -> позиции ячеек с этим значением"""
+        node = self.range_node(range_key)
+        if node.index is None:
+            index = {}
+            for position, value in enumerate(self.range_values(range_key)):
+                index.setdefault(criteria_key(value), []).append(position)
+                if isinstance(value, str):
+                    try:
+                        # Текст "5" совпадает с условием 5 так же, как число 5
+                        index.setdefault(float(value), []).append(position)
+                    except ValueError:
+                        pass
+            node.index = index
+        return node.index
+
+    def evaluate(self, tree):
+        kind = tree[0]
+        if kind == 'const':
+            return tree[1]
+        if kind == 'ref':
+            value = self.cell_value(tree[1], tree[2], tree[3])
+            if value is UNKNOWN:
+                raise UnsupportedFormula("Ссылка на невычисляемую ячейку")
+            return value
+        if kind == 'range':
+            # Диапазон вне функции: Excel берет ячейку на пересечении со строкой формулы, это не поддерживается
+            raise UnsupportedFormula("Диапазон вне аргумента функции")
+        if kind == 'neg':
+            value = to_number(self.evaluate(tree[1]))
+            return value if isinstance(value, ExcelError) else -value
+        if kind == 'bin':
+            return self.evaluate_binary(tree[1], self.evaluate(tree[2]), self.evaluate(tree[3]))
+        return FUNCTIONS[tree[1]](self, tree[2])
+
+    def evaluate_binary(self, op, left, right):
+        if op in COMPARISONS:
+            return compare(op, left, right)
+        if op == '&':
+            left, right = to_text(left), to_text(right)
+            for value in (left, right):
+                if isinstance(value, ExcelError):
+                    return value
+            return left + right
+
+        left, right = to_number(left), to_number(right)
+        for value in (left, right):
+            if isinstance(value, ExcelError):
+                return value
+        if op == '+':
+            return left + right
+        if op == '-':
+            return left - right
+        if op == '*':
+            return left * right
+        if right == 0:
+            return DIV0
+        return left / right
+
+    def argument_values(self, arg):
+        """Значения аргумента: все ячейки диапазона или одно значение"""
+        if arg[0] == 'range':
+            return self.range_values(arg[1])
+        return [self.evaluate(arg)]
+
+    def matching_positions(self, range_key, criteria):
+        mode, test = parse_criteria(criteria)
+        if mode == 'eq':
+            return self.range_index(range_key).get(test, [])
+        return [position for position, value in enumerate(self.range_values(range_key)) if test(value)]
+
+    # --- Значения для сохранения ---
+
+    def sheet_values(self, sheet_names):
+        """Значения вычисленных формул листов: лист -> {адрес ячейки: значение}"""
+        result = {sheet_name: {} for sheet_name in sheet_names if sheet_name in self.sheet_names}
+        for (sheet_name, row, column), value in self.values.items():
+            if sheet_name in result and value is not UNKNOWN:
+                result[sheet_name][f"{get_column_letter(column)}{row}"] = value
+        return result
+
+    def take_stale_sheets(self):
+        stale_sheets = self.stale_sheets
+        self.stale_sheets = set()
+        return stale_sheets
+
+    def restore_stale_sheets(self, sheet_names):
+        self.stale_sheets.update(sheet_names)
+
+
+def range_argument(arg):
+    if arg[0] != 'range':
+        if arg[0] == 'ref':
+            return (arg[1], arg[2], arg[3], arg[2], arg[3])
+        raise UnsupportedFormula("Ожидался диапазон")
+    return arg[1]
+
+
+def sumif_sum_range(criteria_range, sum_range):
+    """Диапазон суммирования СУММЕСЛИ: Excel берет его того же размера, что и диапазон условий"""
+    sheet_name, min_row, min_col, max_row, max_col = criteria_range
+    return (sum_range[0], sum_range[1], sum_range[2],
+            sum_range[1] + max_row - min_row, sum_range[2] + max_col - min_col)
+
+
+def function_sum(evaluator, args):
+    total = 0
+    for arg in args:
+        if arg[0] == 'range':
+            for value in evaluator.range_values(arg[1]):
+                if isinstance(value, ExcelError):
+                    return value
+                if is_number(value):
+                    total += value
+        else:
+            value = to_number(evaluator.evaluate(arg))
+            if isinstance(value, ExcelError):
+                return value
+            total += value
+    return total
+
+
+def function_max(evaluator, args):
+    numbers = []
+    for arg in args:
+        for value in evaluator.argument_values(arg):
+            if isinstance(value, ExcelError):
+                return value
+            if is_number(value):
+                numbers.append(value)
+    return max(numbers) if numbers else 0
+
+
+def function_sumif(evaluator, args):
+    if len(args) not in (2, 3):
+        raise UnsupportedFormula("СУММЕСЛИ принимает 2 или 3 аргумента")
+    criteria_range = range_argument(args[0])
+    criteria = evaluator.evaluate(args[1])
+    if isinstance(criteria, ExcelError):
+        return criteria
+    sum_key = sumif_sum_range(criteria_range, range_argument(args[2])) if len(args) == 3 else criteria_range
+    positions = evaluator.matching_positions(criteria_range, criteria)
+    if not positions:
+        return 0
+    values = evaluator.range_values(sum_key)
+    total = 0
+    for position in positions:
+        value = values[position]
+        if isinstance(value, ExcelError):
+            return value
+        if is_number(value):
+            total += value
+    return total
+
+
+def function_countif(evaluator, args):
+    if len(args) != 2:
+        raise UnsupportedFormula("СЧЁТЕСЛИ принимает 2 аргумента")
+    criteria = evaluator.evaluate(args[1])
+    if isinstance(criteria, ExcelError):
+        return criteria
+    return len(evaluator.matching_positions(range_argument(args[0]), criteria))
+
+
+def function_counta(evaluator, args):
+    count = 0
+    for arg in args:
+        count += sum(1 for value in evaluator.argument_values(arg) if value is not None)
+    return count
+
+
+def function_match(evaluator, args):
+    if len(args) != 3 or to_number(evaluator.evaluate(args[2])) != 0:
+        raise UnsupportedFormula("ПОИСКПОЗ поддерживается только с точным совпадением")
+    lookup = evaluator.evaluate(args[0])
+    if isinstance(lookup, ExcelError):
+        return lookup
+    if lookup is None:
+        return NA
+
+    # В отличие от СЧЁТЕСЛИ, ПОИСКПОЗ не приравнивает текст к числу
+    range_key = range_argument(args[1])
+    values = evaluator.range_values(range_key)
+    for position in evaluator.range_index(range_key).get(criteria_key(lookup), []):
+        if isinstance(values[position], str) == isinstance(lookup, str):
+            return position + 1
+    return NA
+
+
+def function_concatenate(evaluator, args):
+    parts = []
+    for arg in args:
+        value = to_text(evaluator.evaluate(arg))
+        if isinstance(value, ExcelError):
+            return value
+        parts.append(value)
+    return ''.join(parts)
+
+
+def function_trim(evaluator, args):
+    if len(args) != 1:
+        raise UnsupportedFormula("СЖПРОБЕЛЫ принимает 1 аргумент")
+    value = to_text(evaluator.evaluate(args[0]))
+    return value if isinstance(value, ExcelError) else excel_trim(value)
+
+
+def function_if(evaluator, args):
+    if len(args) not in (2, 3):
+        raise UnsupportedFormula("ЕСЛИ принимает 2 или 3 аргумента")
+    condition = to_bool(evaluator.evaluate(args[0]))
+    if isinstance(condition, ExcelError):
+        return condition
+    if condition:
+        return evaluator.evaluate(args[1])
+    return evaluator.evaluate(args[2]) if len(args) == 3 else False
+
+
+def function_or(evaluator, args):
+    result = False
+    for arg in args:
+        for value in evaluator.argument_values(arg):
+            if arg[0] == 'range' and not isinstance(value, (bool, int, float, ExcelError)):
+                continue
+            value = to_bool(value)
+            if isinstance(value, ExcelError):
+                return value
+            result = result or value
+    return result
+
+
+FUNCTIONS = {
+    'SUM': function_sum,
+    'MAX': function_max,
+    'SUMIF': function_sumif,
+    'COUNTIF': function_countif,
+    'COUNTA': function_counta,
+    'MATCH': function_match,
+    'CONCATENATE': function_concatenate,
+    'TRIM': function_trim,
+    'IF': function_if,
+    'OR': function_or,
+}
+
+
+CELL_RE = re.compile(r'<c\b([^>]*?)(/>|>(.*?)</c>)', re.DOTALL)
+CELL_REF_RE = re.compile(r'\br="([A-Z]+\d+)"')
+CELL_TYPE_RE = re.compile(r'\s+t="[^"]*"')
+CELL_VALUE_RE = re.compile(r'<v\s*/>|<v>.*?</v>|<is>.*?</is>', re.DOTALL)
+
+
+def format_cached_value(value):
+    """Возвращает (тип ячейки, текст значения) для записи значения формулы в XML"""
+    if isinstance(value, ExcelError):
+        return 'e', value.code
+    if isinstance(value, bool):
+        return 'b', '1' if value else '0'
+    if isinstance(value, str):
+        escaped = value.replace('&', '&amp;').replace('<', '&lt;').replace('>', '&gt;')
+        return 'str', escaped
+    if isinstance(value, float) and value.is_integer():
+        return None, str(int(value))
+    return None, repr(value)
+
+
+def apply_cached_values(sheet_xml, values):
+    """Записывает значения формул в XML листа, не трогая остальные ячейки"""
+    if not values:
+        return sheet_xml
+
+    def replace_cell(match):
+        attrs, body = match.group(1), match.group(3)
+        if body is None or '<f' not in body:
+            return match.group(0)
+        reference = CELL_REF_RE.search(attrs)
+        if not reference or reference.group(1) not in values:
+            return match.group(0)
+
+        cell_type, text = format_cached_value(values[reference.group(1)])
+        attrs = CELL_TYPE_RE.sub('', attrs)
+        if cell_type:
+            attrs += f' t="{cell_type}"'
+        body = CELL_VALUE_RE.sub('', body)
+        return f'<c{attrs}>{body}<v>{text}</v></c>'
+
+    return CELL_RE.sub(replace_cell, sheet_xml.decode('utf-8')).encode('utf-8')
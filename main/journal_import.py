@@ -0,0 +1,197 @@
+import csv
+import json
+import os
+from datetime import datetime, timedelta
+from journal_calendar import iter_ics_events, parse_ics_day, unescape_ics_text
+
+# Заголовки колонок CSV: дата занятия и его название в системе расписания
+CSV_DATE_COLUMNS = ('date', 'дата')
+CSV_TITLE_COLUMNS = ('summary', 'subject', 'title', 'занятие', 'предмет', 'дисциплина', 'название')
+ICS_WEEKDAYS = ('MO', 'TU', 'WE', 'TH', 'FR', 'SA', 'SU')
+
+
+class ScheduleImportError(ValueError):
+    """Файл расписания не разбирается"""
+
+
+def mapping_key(title):
+    """Ключ таблицы соответствий: название без лишних пробелов и без учета регистра"""
+    return " ".join(title.split()).lower()
+
+
+def parse_csv_day(value):
+    """Дата из ячейки CSV: 14.01.2026 или 2026-01-14, возможно со временем"""
+    value = value.strip().split()[0] if value.strip() else ''
+    for date_format in ('%d.%m.%Y', '%Y-%m-%d', '%d.%m.%y'):
+        try:
+            return datetime.strptime(value, date_format).date()
+        except ValueError:
+            pass
+    raise ScheduleImportError(f"Неверная дата \"{value}\"")
+
+
+def iter_csv_events(path):
+    """Потоково читает CSV-выгрузку: (дата, название) по строкам
+
+    Разделитель определяется по заголовку; колонки даты и названия ищутся по именам.
+    """
+    with open(path, 'r', encoding='utf-8-sig', newline='') as f:
+        header_line = f.readline()
+        delimiter = ';' if header_line.count(';') > header_line.count(',') else ','
+        header = [column.strip().lower() for column in next(csv.reader([header_line], delimiter=delimiter))]
+        date_column = next((header.index(name) for name in CSV_DATE_COLUMNS if name in header), None)
+        title_column = next((header.index(name) for name in CSV_TITLE_COLUMNS if name in header), None)
+        if date_column is None or title_column is None:
+            raise ScheduleImportError("В заголовке CSV нужны колонки даты (\"Дата\") и названия занятия (\"Занятие\")")
+
+        for line_number, row in enumerate(csv.reader(f, delimiter=delimiter), start=2):
+            if len(row) <= max(date_column, title_column) or not row[date_column].strip():
+                continue
+            try:
+                yield parse_csv_day(row[date_column]), row[title_column].strip()
+            except ScheduleImportError as e:
+                raise ScheduleImportError(f"Строка {line_number}: {e}")
+
+
+def parse_rrule(value):
+    return dict(part.split('=', 1) for part in value.upper().split(';') if '=' in part)
+
+
+def iter_weekly_occurrences(start, rule, period_end):
+    """Даты еженедельного RRULE (INTERVAL, BYDAY, UNTIL, COUNT) по порядку, не дальше period_end"""
+    interval = int(rule.get('INTERVAL', 1))
+    weekdays = sorted(ICS_WEEKDAYS.index(day[-2:]) for day in rule['BYDAY'].split(',')) if 'BYDAY' in rule \
+        else [start.weekday()]
+    last = min(parse_ics_day(rule['UNTIL']), period_end) if 'UNTIL' in rule else period_end
+    count = int(rule['COUNT']) if 'COUNT' in rule else None
+
+    monday = start - timedelta(days=start.weekday())
+    while monday <= last:
+        for weekday in weekdays:
+            day = monday + timedelta(days=weekday)
+            if day < start:
+                continue
+            if day > last or count == 0:
+                return
+            yield day
+            if count is not None:
+                count -= 1
+        monday += timedelta(weeks=interval)
+
+
+def iter_ics_schedule(path, period_start, period_end):
+    """Занятия из iCalendar: (дата, название); еженедельные повторы разворачиваются в пределах периода
+
+    События с повторами другого вида выдаются с датой None - импорт их пропускает и
+    показывает, сколько таких было.
+    """
+    for event in iter_ics_events(path):
+        title = unescape_ics_text(event.get('SUMMARY', '')).strip()
+        if 'DTSTART' not in event:
+            continue
+        start = parse_ics_day(event['DTSTART'])
+
+        if 'RRULE' not in event:
+            if period_start <= start <= period_end:
+                yield start, title
+            continue
+
+        rule = parse_rrule(event['RRULE'])
+        if rule.get('FREQ') != 'WEEKLY' or 'RDATE' in event:
+            yield None, title
+            continue
+        excluded = {parse_ics_day(value) for value in event.get('EXDATE', '').split(',') if value.strip()}
+        for day in iter_weekly_occurrences(start, rule, period_end):
+            if day >= period_start and day not in excluded:
+                yield day, title
+
+
+def iter_schedule_events(path, period_start, period_end):
+    """(дата, название) занятий из выгрузки расписания .ics или .csv"""
+    if path.lower().endswith('.ics'):
+        return iter_ics_schedule(path, period_start, period_end)
+    return ((day, title) for day, title in iter_csv_events(path) if period_start <= day <= period_end)
+
+
+class ImportMapping:
+    """Таблица соответствий названий занятий из системы расписания записям журнала
+
+    JSON-файл: название -> {"discipline", "group", "load_type", "hours": {вид занятий: часы}}.
+    Виды занятий можно писать полем ('lecture') или подписью ("Лекции"). Названия,
+    которые встретились при импорте без соответствия, дописываются в файл со значением
+    null - их остается заполнить.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.entries = {}
+
+    def load(self):
+        self.entries = {}
+        if not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                entries = json.load(f)
+            if isinstance(entries, dict):
+                self.entries = entries
+            else:
+                print(f"Соответствия импорта должны быть объектом JSON: {self.path}")
+        except Exception as e:
+            print(f"Ошибка загрузки соответствий импорта: {e}")
+
+    def save(self):
+        try:
+            with open(self.path, 'w', encoding='utf-8') as f:
+                json.dump(self.entries, f, ensure_ascii=False, indent=2)
+        except Exception as e:
+            print(f"Ошибка сохранения соответствий импорта: {e}")
+
+    def lookup_table(self):
+        """Ключ названия -> описание записи; только заполненные соответствия"""
+        return {mapping_key(title): entry for title, entry in self.entries.items() if isinstance(entry, dict)}
+
+    def add_unmapped(self, titles):
+        """Дописывает незнакомые названия с пустым соответствием; возвращает True, если что-то добавлено"""
+        known = {mapping_key(title) for title in self.entries}
+        added = False
+        for title in titles:
+            if mapping_key(title) not in known:
+                self.entries[title] = None
+                known.add(mapping_key(title))
+                added = True
+        if added:
+            self.save()
+        return added
+
+
+def mapping_data(entry, hours_fields, load_types):
+    """Данные записи журнала из соответствия; ScheduleImportError, если соответствие заполнено неверно"""
+    discipline = str(entry.get('discipline') or '').strip()
+    group = str(entry.get('group') or '').strip()
+    load_type = entry.get('load_type') or load_types[0]
+    if not discipline or not group:
+        raise ScheduleImportError("не указаны дисциплина или группа")
+    if load_type not in load_types:
+        raise ScheduleImportError(f"неизвестный вид нагрузки \"{load_type}\"")
+
+    fields = {}
+    for field, label, column in hours_fields:
+        fields[field] = field
+        fields[label.lower()] = field
+    data = {'discipline': discipline, 'group': group, 'load_type': load_type}
+    data.update({field: 0.0 for field, label, column in hours_fields})
+    hours = entry.get('hours') or {}
+    if not isinstance(hours, dict):
+        raise ScheduleImportError("часы должны быть объектом")
+    for key, value in hours.items():
+        field = fields.get(str(key).strip().lower())
+        if field is None:
+            raise ScheduleImportError(f"неизвестный вид занятий \"{key}\"")
+        try:
+            data[field] = float(str(value).replace(',', '.'))
+        except ValueError:
+            raise ScheduleImportError(f"часы \"{value}\" - не число")
+    if not any(data[field] for field, label, column in hours_fields):
+        raise ScheduleImportError("не указаны часы")
+    return data
@@ -1,24 +1,122 @@
-import openpyxl
-from PySide6.QtWidgets import QMessageBox, QFileDialog
-from PySide6.QtCore import QDate
-from datetime import datetime, timedelta, date
+from PySide6.QtWidgets import QMessageBox, QFileDialog, QTableWidgetItem, QTreeWidgetItem
+from PySide6.QtCore import Qt, QDate, QThreadPool, QStringListModel, QCoreApplication
+from PySide6.QtGui import QColor
 import re
 import os
 import time
+import csv
 import json
+from collections import Counter
+from datetime import date
 from openpyxl.styles import Alignment
+from openpyxl.utils import column_index_from_string, get_column_letter
+from journal_workbook import WorkbookSession, StreamingSheetReader, collect_entry_rows, load_workbook_with_progress
+from journal_cache import SidecarCache
+from journal_catalog import NameCatalog, collect_names
+from journal_dates import DateSelection
+from journal_calendar import AcademicCalendar, CalendarError, load_calendar_definition, NUMERATOR, DENOMINATOR, BOTH_WEEKS
+from journal_oplog import OperationLog
+from journal_timetable import Timetable, WEEKDAYS
+from journal_import import ImportMapping, iter_schedule_events, mapping_data, mapping_key
+from journal_model import MonthRow, MonthSheetModel, SeasonSheetIndex, row_content_hash
+from journal_totals import aggregate_fact_hours, season_plan_fact
+from journal_workers import WorkbookLoadWorker, WorkbookSaveWorker, SnapshotBuildWorker, FormulaBuildWorker
 
 class JournalLogic:
     def __init__(self):
         self.filename = None
-        self.wb = None
+        self.session = WorkbookSession()
+        self.thread_pool = QThreadPool.globalInstance()
+        self.load_worker = None
+        # Сохранения выполняются строго по очереди в отдельном пуле из одного потока
+        self.save_pool = QThreadPool()
+        self.save_pool.setMaxThreadCount(1)
+        self.queued_save = None
+        self.pending_saves = 0
+        # Кэш журнала строится в фоне после открытия и после каждого сохранения
+        self.snapshot_pool = QThreadPool()
+        self.snapshot_pool.setMaxThreadCount(1)
+        self.queued_snapshot = None
+        self.snapshot = None
+        # Вычислитель формул строится в фоне после каждой загрузки книги для редактирования
+        self.formula_pool = QThreadPool()
+        self.formula_pool.setMaxThreadCount(1)
+        self.SAVE_STATUSES = {
+            'saved': ("Сохранено", "green"),
+            'pending': ("Сохранение...", "#d2691e"),
+            'failed': ("Ошибка сохранения", "red"),
+        }
         self.START_ROW = 7
-        self.HOURS_COLS = {'lecture': 12, 'practice': 13, 'lab': 14}
-        self.selected_dates = []
+        # Последняя строка, входящая в диапазоны СУММЕСЛИ семестровых листов ('09'!$D$7:$D$159)
+        self.FORMULA_END_ROW = 159
+        # Записи ниже FORMULA_END_ROW не попадают в итоги семестра
+        self.MONTH_CAPACITY = self.FORMULA_END_ROW - self.START_ROW + 1
+        self.NEARLY_FULL_ROWS = 10
+        self.SEASON_SHEETS = ('осень', 'весна')
+        # Лист-отчет, собирающий итоги месячных листов: его формулы тоже вычисляются при сохранении
+        self.CARD_SHEET = 'карточка'
+        # Месячные листы, из которых СУММЕСЛИ строк "факт" собирают часы семестра
+        self.SEASON_MONTHS = {
+            'осень': ('09', '10', '11', '12', '01'),
+            'весна': ('02', '03', '04', '05', '06', '07', '08'),
+        }
+        # Строки "план"/"факт" семестровых листов - весь диапазон формул шаблона (КлючОсень = осень!$C$5:$C$178)
+        self.SEASON_FIRST_ROW = 5
+        self.SEASON_LAST_ROW = 178
+        self.reader = None
+        self.oplog = None
+        self.sheetnames = []
+        # Листы месяцев, четность недель и нерабочие дни для выбора дат; определение - из файла календаря
+        self.calendar_file = None
+        self.calendar = AcademicCalendar()
+        # Разобранные записи месячных листов: лист -> (ключ поколения, записи)
+        self.entry_rows_cache = {}
+        # Индексы строк семестровых листов: лист -> (поколение книги, индекс)
+        self.season_indexes = {}
+        # Каталоги дисциплин и групп для подсказок ввода и модели, через которые их видят виджеты
+        self.CATALOG_FIELDS = ('discipline', 'group')
+        self.catalogs = {field: NameCatalog() for field in self.CATALOG_FIELDS}
+        self.catalog_models = {field: QStringListModel() for field in self.CATALOG_FIELDS}
+        # Колонки часов месячного листа L-Y по видам занятий: (поле, подпись, колонка)
+        self.HOURS_FIELDS = [
+            ('lecture', "Лекции", 12),
+            ('practice', "Практические", 13),
+            ('lab', "Лабораторные", 14),
+            ('consultation', "Консультации", 15),
+            ('control_work', "Контрольные работы", 16),
+            ('course_work', "Курсовые работы", 17),
+            ('credit', "Зачеты", 18),
+            ('exam', "Экзамены", 19),
+            ('ksr', "КСР", 20),
+            ('internship', "Рук. практиками", 21),
+            ('research', "Рук. научной работой", 22),
+            ('thesis', "Рук. ВКР", 23),
+            ('gek', "ГЭК, ИАК", 24),
+            ('other', "Прочие", 25),
+        ]
+        self.HOURS_COLS = {field: column for field, label, column in self.HOURS_FIELDS}
+        # Колонки записи: число, дисциплина, группа, вид нагрузки и все колонки часов
+        self.ENTRY_COLUMNS = ('E', 'F', 'G', 'H') + tuple(get_column_letter(column) for column in self.HOURS_COLS.values())
+        # Строки "план": дисциплина, группа, вид нагрузки и плановые часы J-W (те же виды занятий, что L-Y)
+        self.SEASON_COLUMNS = ('D', 'E', 'F') + tuple(get_column_letter(column) for column in range(10, 10 + len(self.HOURS_FIELDS)))
+        # Выбранные даты по порядку; модель общая для списка дат и выбора даты для удаления
+        self.selected_dates = DateSelection()
+        # Задания на добавление, которые запишутся одной операцией
+        self.job_queue = []
         self.LOAD_TYPES = ["осн.", "почас.", "совм."]
         self.config_file = "app_config.json"
+        # Недельное расписание для заполнения журнала за семестр
+        self.timetable = Timetable("timetable.json")
+        # Соответствия названий занятий из выгрузок расписания записям журнала
+        self.import_mapping = ImportMapping("import_mapping.json")
         self.ui = None
         self.load_config()
+        self.timetable.load()
+    
+    @property
+    def wb(self):
+        """Рабочая книга, которая держится в памяти между операциями"""
+        return self.session.wb
     
     def set_ui(self, ui):
         """Устанавливает ссылку на UI"""
@@ -31,6 +129,7 @@ class JournalLogic:
                 with open(self.config_file, 'r', encoding='utf-8') as f:
                     config = json.load(f)
                     self.filename = config.get('last_file')
+                    self.calendar_file = config.get('calendar_file')
         except Exception as e:
             print(f"Ошибка загрузки конфигурации: {e}")
     
@@ -38,7 +137,8 @@ class JournalLogic:
         """Сохраняет конфигурацию приложения"""
         try:
             config = {
-                'last_file': self.filename
+                'last_file': self.filename,
+                'calendar_file': self.calendar_file
             }
             with open(self.config_file, 'w', encoding='utf-8') as f:
                 json.dump(config, f, ensure_ascii=False, indent=2)
@@ -86,76 +186,369 @@ class JournalLogic:
             self.load_workbook(filename)
     
     def load_workbook(self, filename):
-        """Загружает рабочую книгу Excel"""
+        """Открывает журнал для просмотра и запускает фоновую загрузку книги для редактирования
+        
+        Если для файла есть действительный кэш, книга загружается только перед первой записью.
+        """
+        if not os.path.exists(filename):
+            QMessageBox.critical(self.ui, "Ошибка", f"Файл {filename} не найден")
+            return
+        
+        self.cancel_loading()
+        self.wait_for_saves()
+        self.close_workbook()
+        
+        # Пока книга для редактирования грузится в фоне, данные уже можно просматривать
+        if not self.open_for_viewing(filename):
+            return
+        
+        # Операции, не попавшие в файл до закрытия программы, применяем сразу
+        if self.oplog.has_records():
+            if self.ensure_workbook_fresh():
+                self.show_data()
+            self.set_editing_enabled(True)
+            return
+        
+        if self.snapshot:
+            self.set_editing_enabled(True)
+            return
+        
+        worker = WorkbookLoadWorker(filename)
+        worker.signals.progress.connect(lambda index, total, sheet_name, w=worker: self.on_load_progress(w, index, total, sheet_name))
+        worker.signals.finished.connect(lambda loaded_file, wb, w=worker: self.on_workbook_loaded(w, loaded_file, wb))
+        worker.signals.failed.connect(lambda message, w=worker: self.on_load_failed(w, message))
+        worker.signals.cancelled.connect(lambda w=worker: self.on_load_finished(w))
+        self.load_worker = worker
+        
+        if self.ui:
+            self.ui.load_progress.setRange(0, 0)
+            self.ui.load_progress.setFormat("Загрузка для редактирования...")
+            self.ui.load_progress.setVisible(True)
+            self.ui.cancel_load_btn.setVisible(True)
+        
+        self.thread_pool.start(worker)
+    
+    def open_for_viewing(self, filename):
+        """Открывает файл для просмотра потоковым чтением, без загрузки модели openpyxl"""
+        try:
+            self.reader = StreamingSheetReader(filename)
+            self.oplog = OperationLog(filename)
+            self.entry_rows_cache.clear()
+            self.filename = filename
+            if self.ui:
+                self.ui.file_path_label.setText(filename)
+            self.set_editing_enabled(False)
+            
+            # Неизмененный журнал открывается из кэша, без разбора xlsx
+            self.snapshot = SidecarCache(filename).load()
+            if self.snapshot:
+                self.sheetnames = self.snapshot.sheetnames
+            else:
+                self.sheetnames = self.reader.sheetnames
+                self.schedule_snapshot_build()
+            
+            self.calendar = AcademicCalendar(self.sheetnames, self.load_calendar_definition())
+            
+            # Обновляем список листов - только месячные листы
+            monthly_sheets = self.filter_monthly_sheets(self.sheetnames)
+            if self.ui:
+                self.ui.sheet_combo.clear()
+                self.ui.sheet_combo.addItems(monthly_sheets)
+            
+            # Заполняем каталоги дисциплин и групп
+            self.load_catalogs()
+            
+            # Сохраняем конфигурацию
+            self.save_config()
+            
+            # Показываем данные
+            self.show_data()
+            return True
+            
+        except Exception as e:
+            self.reader = None
+            self.snapshot = None
+            QMessageBox.critical(self.ui, "Ошибка", f"Ошибка загрузки файла: {e}")
+            return False
+    
+    def schedule_snapshot_build(self):
+        """Ставит в очередь построение кэша журнала по текущему файлу"""
+        # Построение, которое еще не началось, прочитает и последнюю версию файла
+        if not self.filename or (self.queued_snapshot and not self.queued_snapshot.is_started):
+            return
+        
+        worker = SnapshotBuildWorker(
+            self.filename,
+            select_monthly_sheets=self.filter_monthly_sheets,
+            entry_range=(self.START_ROW, self.FORMULA_END_ROW),
+            entry_columns=self.ENTRY_COLUMNS,
+            season_sheets=self.SEASON_SHEETS,
+            season_columns=self.SEASON_COLUMNS,
+            season_range=(self.SEASON_FIRST_ROW, self.SEASON_LAST_ROW))
+        worker.signals.finished.connect(lambda snapshot, w=worker: self.on_snapshot_built(w, snapshot))
+        self.queued_snapshot = worker
+        self.snapshot_pool.start(worker)
+    
+    def on_snapshot_built(self, worker, snapshot):
+        """Подключает построенный в фоне снимок открытого журнала"""
+        if self.queued_snapshot is worker:
+            self.queued_snapshot = None
+        if snapshot.filename == self.filename:
+            self.snapshot = snapshot
+            # Снимок собирает имена и из месячных листов - дополняем ими каталоги
+            self.learn_names('discipline', snapshot.disciplines)
+            self.learn_names('group', snapshot.groups)
+    
+    def snapshot_rows(self, rows_by_sheet, sheet_name):
+        """Возвращает строки листа из снимка, если снимок соответствует файлу и лист не менялся в памяти"""
+        if (not self.snapshot or sheet_name not in rows_by_sheet or self.is_sheet_in_memory(sheet_name)
+                or self.snapshot.file_stat != self.reader.file_stamp()):
+            return None
+        return rows_by_sheet[sheet_name]
+    
+    def set_editing_enabled(self, enabled):
+        """Включает кнопки, которые записывают в журнал"""
+        if self.ui:
+            self.ui.add_entries_btn.setEnabled(enabled)
+            self.ui.commit_queue_btn.setEnabled(enabled)
+            self.ui.fill_timetable_btn.setEnabled(enabled)
+    
+    def cancel_loading(self):
+        """Отменяет текущую фоновую загрузку книги"""
+        if self.load_worker:
+            self.load_worker.cancel()
+            self.on_load_finished(self.load_worker)
+    
+    def on_load_progress(self, worker, index, total, sheet_name):
+        """Показывает ход загрузки по листам"""
+        if worker is not self.load_worker or not self.ui:
+            return
+        
+        self.ui.load_progress.setRange(0, total)
+        self.ui.load_progress.setValue(index)
+        if sheet_name:
+            self.ui.load_progress.setFormat(f"Лист {sheet_name}: %v из %m")
+        else:
+            self.ui.load_progress.setFormat("Подготовка данных...")
+    
+    def on_load_finished(self, worker):
+        """Скрывает индикатор загрузки"""
+        if worker is not self.load_worker:
+            return
+        
+        self.load_worker = None
+        if self.ui:
+            self.ui.load_progress.setVisible(False)
+            self.ui.cancel_load_btn.setVisible(False)
+    
+    def on_load_failed(self, worker, message):
+        """Сообщает об ошибке фоновой загрузки"""
+        if worker is not self.load_worker:
+            return
+        
+        self.on_load_finished(worker)
+        QMessageBox.critical(self.ui, "Ошибка", message)
+    
+    def on_workbook_loaded(self, worker, filename, wb):
+        """Подключает загруженную в фоне книгу для редактирования"""
+        if worker is not self.load_worker:
+            # Загрузка была отменена или заменена более новой
+            wb.close()
+            return
+        
+        self.on_load_finished(worker)
+        
         try:
             self.close_workbook()
-            self.wb = self.safe_load_workbook(filename)
+            self.attach_workbook(filename, wb)
+            self.filename = filename
+            self.set_editing_enabled(True)
             
-            if self.wb:
-                self.filename = filename
-                if self.ui:
-                    self.ui.file_path_label.setText(filename)
-                    self.ui.add_entries_btn.setEnabled(True)
-                
-                # Обновляем список листов - только месячные листы
-                all_sheets = self.wb.sheetnames
-                monthly_sheets = self.filter_monthly_sheets(all_sheets)
-                if self.ui:
-                    self.ui.sheet_combo.clear()
-                    self.ui.sheet_combo.addItems(monthly_sheets)
-                
-                # Обновляем список дисциплин
-                self.update_disciplines_list()
-                
-                # Сохраняем конфигурацию
-                self.save_config()
-                
-                # Показываем данные
-                self.show_data()
-                
         except Exception as e:
             QMessageBox.critical(self.ui, "Ошибка", f"Ошибка загрузки файла: {e}")
     
-    def update_disciplines_list(self):
-        """Обновляет список дисциплин из листов 'Осень' и 'Весна'"""
-        if not self.wb or not self.ui:
-            return
-        
-        disciplines = set()
-        
-        # Получаем дисциплины из листа 'Осень'
-        if 'осень' in self.wb.sheetnames:
-            sheet = self.wb['осень']
-            row = 5
-            while row <= 100:
-                try:
-                    discipline = sheet[f'D{row}'].value
-                    if discipline and isinstance(discipline, str) and discipline.strip():
-                        disciplines.add(discipline.strip())
-                except:
-                    pass
-                row += 2
-        
-        # Получаем дисциплины из листа 'Весна'
-        if 'весна' in self.wb.sheetnames:
-            sheet = self.wb['весна']
-            row = 5
-            while row <= 100:
-                try:
-                    discipline = sheet[f'D{row}'].value
-                    if discipline and isinstance(discipline, str) and discipline.strip():
-                        disciplines.add(discipline.strip())
-                except:
-                    pass
-                row += 2
-        
-        # Сортируем дисциплины по алфавиту
-        sorted_disciplines = sorted(list(disciplines))
-        
-        # Обновляем комбобокс дисциплин
-        if 'discipline' in self.ui.entries:
-            self.ui.entries['discipline'].clear()
-            self.ui.entries['discipline'].addItems(sorted_disciplines)
+    def attach_workbook(self, filename, wb):
+        """Подключает книгу для редактирования и применяет к ней операции, еще не сохраненные в файл"""
+        self.session.attach(filename, wb)
+        self.session.formula_sheets = (self.filter_monthly_sheets(wb.sheetnames)
+                                       + list(self.SEASON_SHEETS) + [self.CARD_SHEET])
+        self.schedule_formula_build()
+        operations = self.oplog.pending(self.session.content_hash) if self.oplog else []
+        if not operations:
+            return
+        
+        for operation in operations:
+            self.apply_operation(operation)
+        self.safe_save_workbook()
+        QMessageBox.information(self.ui, "Восстановление",
+            f"Применены операции, не сохраненные в файл ранее: {len(operations)}")
+    
+    def schedule_formula_build(self):
+        """Запускает фоновое построение вычислителя формул для подключенной книги"""
+        worker = FormulaBuildWorker(self.session.wb, self.session.filename, self.session.formula_sheets)
+        generation = self.session.generation
+        worker.signals.finished.connect(
+            lambda formulas, w=worker: self.on_formulas_built(w, formulas, generation))
+        self.formula_pool.start(worker)
+    
+    def on_formulas_built(self, worker, formulas, generation):
+        """Подключает вычислитель формул; сохраненное без значений формул сохраняется еще раз"""
+        if self.session.attach_formulas(formulas, generation) and self.session.sheet_generations:
+            self.safe_save_workbook()
+    
+    def log_operation(self, op_type, payload):
+        """Записывает операцию в журнал операций до ее применения к книге"""
+        operation = {'op': op_type, **payload}
+        operation['seq'] = self.oplog.append(op_type, payload) if self.oplog else None
+        return operation
+    
+    def apply_operation(self, operation):
+        """Применяет операцию добавления или удаления к книге в памяти и возвращает ее результат"""
+        # Книгу нельзя менять, пока фоновое сохранение ее сериализует
+        with self.session.lock:
+            if operation['op'] == 'add':
+                result = self.write_jobs(operation['jobs'])
+            else:
+                result = self.delete_entries(operation['sheet'], operation['rows'])
+            if operation.get('seq'):
+                self.session.applied_seq = operation['seq']
+        
+        # Каталоги пополняются записанными именами, без перечитывания листов
+        if operation['op'] == 'add':
+            self.learn_names('discipline', [job['data']['discipline'] for job in operation['jobs']])
+            self.learn_names('group', [job['data']['group'] for job in operation['jobs']])
+        return result
+    
+    def is_sheet_in_memory(self, sheet_name):
+        """Проверяет, отличается ли лист в памяти от его содержимого на диске"""
+        return bool(self.wb and (sheet_name in self.session.dirty_sheets
+                                 or (self.pending_saves and self.wb.is_materialized(sheet_name))))
+    
+    def get_entry_rows(self, sheet_name):
+        """Возвращает записи месячного листа (строка, число, дисциплина, группа, нагрузка, часы по колонкам L-Y...)
+        
+        Записи кэшируются и перечитываются, только когда в лист что-то записали
+        или изменился файл, из которого они прочитаны.
+        """
+        if self.snapshot:
+            entries = self.snapshot_rows(self.snapshot.entries, sheet_name)
+            if entries is not None:
+                return entries
+        
+        file_stamp = None if self.is_sheet_in_memory(sheet_name) else self.reader.file_stamp()
+        key = self.session.sheet_generation(sheet_name) + (file_stamp,)
+        cached = self.entry_rows_cache.get(sheet_name)
+        if cached and cached[0] == key:
+            return cached[1]
+        
+        rows = self.read_sheet_rows(sheet_name, self.START_ROW, self.FORMULA_END_ROW, self.ENTRY_COLUMNS)
+        entries = collect_entry_rows(rows, self.START_ROW)
+        
+        self.entry_rows_cache[sheet_name] = (key, entries)
+        return entries
+    
+    def read_sheet_rows(self, sheet_name, first_row, last_row, columns):
+        """Читает строки листа в кортежи (номер строки, значения колонок...)
+        
+        Пока в листе есть несохраненные изменения, данные берутся из книги в памяти,
+        иначе - потоково из файла на диске. Неразобранные листы книги при этом не разбираются:
+        их содержимое на диске совпадает с загруженным.
+        """
+        if self.is_sheet_in_memory(sheet_name):
+            indexes = [column_index_from_string(column) for column in columns]
+            min_col = min(indexes)
+            rows = []
+            for row_number, values in enumerate(self.wb[sheet_name].iter_rows(
+                    min_row=first_row, max_row=last_row, min_col=min_col, max_col=max(indexes),
+                    values_only=True), first_row):
+                rows.append((row_number,) + tuple(values[index - min_col] for index in indexes))
+            return rows
+        
+        return self.reader.read_rows(sheet_name, first_row, last_row, columns)
+    
+    def load_catalogs(self):
+        """Заполняет каталоги дисциплин и групп при открытии файла
+        
+        Из снимка берутся имена и семестровых, и месячных листов. Без снимка - только
+        семестровых: месячные листы добавятся, когда в фоне построится снимок.
+        """
+        season_sheets = [sheet_name for sheet_name in self.SEASON_SHEETS if sheet_name in self.sheetnames]
+        if self.snapshot:
+            names = {'discipline': self.snapshot.disciplines, 'group': self.snapshot.groups}
+        else:
+            season_rows = [self.get_season_rows(sheet_name) for sheet_name in season_sheets]
+            names = {'discipline': set().union(*(collect_names(rows, 1) for rows in season_rows)),
+                     'group': set().union(*(collect_names(rows, 2) for rows in season_rows))}
+        
+        for field in self.CATALOG_FIELDS:
+            self.catalogs[field] = NameCatalog(names[field])
+            self.catalog_models[field].setStringList(self.catalogs[field].names)
+    
+    def learn_names(self, field, names):
+        """Добавляет новые имена в каталог и вставляет их в модель подсказок на свои места"""
+        catalog = self.catalogs[field]
+        model = self.catalog_models[field]
+        for name in names:
+            index = catalog.add(name)
+            if index is not None:
+                model.insertRows(index, 1)
+                model.setData(model.index(index), catalog.names[index])
+    
+    def get_season_rows(self, sheet_name):
+        """Возвращает строки "план" семестрового листа (строка, дисциплина, группа, нагрузка, плановые часы...)"""
+        if self.snapshot:
+            rows = self.snapshot_rows(self.snapshot.season_rows, sheet_name)
+            if rows is not None:
+                return rows
+        
+        # Строки "план" идут через одну: 5, 7, ...
+        return [row for row in self.read_sheet_rows(sheet_name, self.SEASON_FIRST_ROW, self.SEASON_LAST_ROW, self.SEASON_COLUMNS)
+                if (row[0] - self.SEASON_FIRST_ROW) % 2 == 0]
+    
+    def get_season_totals(self, season_sheet):
+        """Считает план и факт по строкам семестрового листа без пересчета формул Excel
+        
+        Повторяет СУММЕСЛИ строк "факт": часы месячных листов семестра суммируются
+        по ключам $дисциплина$группа$нагрузка$ за один проход.
+        """
+        hours_count = len(self.HOURS_FIELDS)
+        entry_rows = []
+        for month_sheet in self.SEASON_MONTHS.get(season_sheet, ()):
+            if month_sheet in self.sheetnames:
+                entry_rows.extend(self.get_entry_rows(month_sheet))
+        fact_totals = aggregate_fact_hours(entry_rows, hours_count)
+        return season_plan_fact(self.get_season_rows(season_sheet), fact_totals, self.LOAD_TYPES, hours_count)
+    
+    def update_totals(self):
+        """Показывает в боковой панели план и факт по строкам выбранного семестра"""
+        if not self.reader or not self.ui:
+            return
+        
+        season_sheet = self.ui.totals_season_combo.currentText()
+        self.ui.totals_table.setRowCount(0)
+        if season_sheet not in self.sheetnames:
+            return
+        
+        try:
+            totals = self.get_season_totals(season_sheet)
+        except Exception as e:
+            print(f"Ошибка подсчета итогов семестра: {e}")
+            return
+        
+        self.ui.totals_table.setRowCount(len(totals))
+        for current_row, (row, discipline, group, load_type, plan, fact) in enumerate(totals):
+            plan_total = sum(plan)
+            fact_total = sum(fact)
+            values = [discipline, group, load_type, f"{plan_total:g}", f"{fact_total:g}", f"{fact_total - plan_total:+g}"]
+            details = "\n".join(f"{label}: план {plan[index]:g}, факт {fact[index]:g}"
+                                for index, (field, label, column) in enumerate(self.HOURS_FIELDS)
+                                if plan[index] or fact[index])
+            for column, value in enumerate(values):
+                item = QTableWidgetItem(str(value if value is not None else ''))
+                item.setToolTip(f"Строка {row}\n{details}" if details else f"Строка {row}")
+                if column == 5 and fact_total > plan_total:
+                    item.setForeground(QColor("red"))
+                self.ui.totals_table.setItem(current_row, column, item)
     
     def filter_monthly_sheets(self, sheetnames):
         """Фильтрует листы, оставляя только месячные с номерами 01-12"""
@@ -187,11 +580,15 @@ class JournalLogic:
    - Введите название дисциплины (можно выбрать из списка или ввести новую)
    - Укажите группу
    - Выберите вид нагрузки
-   - Заполните часы для лекций, практических и/или лабораторных работ
+   - Заполните часы по нужным видам занятий (лекции, практические, лабораторные,
+     консультации, экзамены и другие колонки шаблона)
 
 5. ДОБАВЛЕНИЕ ЗАПИСЕЙ
    - Нажмите "Добавить записи" для внесения данных в файл
    - Данные автоматически распределятся по соответствующим листам
+   - Чтобы внести несколько дисциплин или групп за раз, добавляйте их кнопкой
+     "В очередь", проверяйте записи в панели "Очередь записей" и затем нажмите
+     "Записать очередь" - все записи сохранятся в файл одним действием
 
 6. ПРОСМОТР И УДАЛЕНИЕ
    - Выберите лист для просмотра данных
@@ -233,37 +630,77 @@ class JournalLogic:
     def close_workbook(self):
         """Безопасное закрытие рабочей книги"""
         try:
-            if hasattr(self, 'wb') and self.wb:
-                self.wb.close()
-                self.wb = None
+            self.session.close()
         except Exception as e:
             print(f"Ошибка при закрытии файла: {e}")
     
     def safe_save_workbook(self):
-        """Безопасное сохранение рабочей книги с повторными попытками"""
+        """Ставит сохранение рабочей книги в фоновую очередь"""
         if not self.wb:
             QMessageBox.critical(self.ui, "Ошибка", "Файл не загружен")
             return False
-            
-        max_retries = 3
-        for attempt in range(max_retries):
-            try:
-                if self.wb:
-                    self.wb.save(self.filename)
-                    return True
-            except PermissionError:
-                if attempt < max_retries - 1:
-                    time.sleep(0.5)
-                    continue
-                else:
-                    QMessageBox.critical(self.ui, "Ошибка", 
-                        f"Нет доступа к файлу {self.filename}!\n"
-                        f"Убедитесь, что файл не открыт в другой программе.")
-                    return False
-            except Exception as e:
-                QMessageBox.critical(self.ui, "Ошибка", f"Ошибка сохранения файла: {e}")
-                return False
-        return False
+        
+        # Сохранение, которое еще не начало сериализацию, запишет и последние изменения
+        if self.queued_save and not self.queued_save.is_started:
+            return True
+        
+        worker = WorkbookSaveWorker(self.session, self.oplog)
+        worker.signals.retrying.connect(
+            lambda attempt, delay: self.set_save_status('pending', f"файл занят, попытка {attempt + 1} через {delay:.1f} с"))
+        worker.signals.finished.connect(lambda w=worker: self.on_save_finished(w))
+        worker.signals.failed.connect(lambda message, w=worker: self.on_save_failed(w, message))
+        self.queued_save = worker
+        self.pending_saves += 1
+        self.set_save_status('pending')
+        self.save_pool.start(worker)
+        return True
+    
+    def on_save_finished(self, worker):
+        """Обновляет отпечаток файла и статус после успешного сохранения"""
+        self.finish_save(worker)
+        self.session.remember_fingerprint()
+        if not self.pending_saves:
+            self.set_save_status('saved')
+            self.schedule_snapshot_build()
+    
+    def on_save_failed(self, worker, message):
+        """Сообщает об ошибке фонового сохранения"""
+        self.finish_save(worker)
+        self.set_save_status('failed')
+        QMessageBox.critical(self.ui, "Ошибка", message)
+    
+    def finish_save(self, worker):
+        self.pending_saves -= 1
+        if self.queued_save is worker:
+            self.queued_save = None
+    
+    def wait_for_saves(self):
+        """Дожидается завершения всех поставленных в очередь сохранений"""
+        self.save_pool.waitForDone()
+    
+    def wait_for_snapshot(self):
+        """Дожидается построения кэша журнала, чтобы не оборвать его при выходе"""
+        self.snapshot_pool.waitForDone()
+    
+    def wait_for_formulas(self):
+        """Дожидается фонового построения вычислителя формул и подключает его
+
+        Сигнал о готовности доставляется сразу, чтобы сохранение значений формул
+        успело встать в очередь раньше, чем выход дождется сохранений.
+        """
+        self.formula_pool.waitForDone()
+        QCoreApplication.sendPostedEvents()
+    
+    def set_save_status(self, status, details=None):
+        """Показывает состояние сохранения: сохранено, сохраняется или ошибка"""
+        if not self.ui:
+            return
+        
+        text, color = self.SAVE_STATUSES[status]
+        if details:
+            text = f"{text} ({details})"
+        self.ui.save_status_label.setText(text)
+        self.ui.save_status_label.setStyleSheet(f"QLabel {{ color: {color}; font-weight: bold; }}")
     
     def safe_load_workbook(self, filename):
         """Безопасная загрузка рабочей книги с повторными попытками"""
@@ -271,7 +708,7 @@ class JournalLogic:
         for attempt in range(max_retries):
             try:
                 if os.path.exists(filename):
-                    return openpyxl.load_workbook(filename)
+                    return load_workbook_with_progress(filename)
                 else:
                     QMessageBox.critical(self.ui, "Ошибка", f"Файл {filename} не найден")
                     return None
@@ -289,36 +726,98 @@ class JournalLogic:
                 return None
         return None
 
-    def date_to_datetime(self, date_obj):
-        return datetime.combine(date_obj, datetime.min.time()) if isinstance(date_obj, date) and not isinstance(date_obj, datetime) else date_obj
-
-    def determine_week_type(self, input_date):
-        current_date = self.date_to_datetime(input_date)
-        year = current_date.year
+    def ensure_workbook_fresh(self):
+        """Перечитывает книгу только если файл изменили вне приложения"""
+        # Пока идет сохранение, актуальна книга в памяти, а не файл на диске
+        if self.pending_saves or not self.session.is_changed_on_disk():
+            return self.wb
         
-        september_1 = datetime(year, 9, 1)
-        if current_date < september_1:
-            september_1 = datetime(year-1, 9, 1)
-        
-        days_diff = (current_date - september_1).days
-        return "числитель" if (days_diff // 7) % 2 == 0 else "знаменатель"
+        # Книга еще не загружена (журнал открыт из кэша) или грузится в фоне - загружаем сразу
+        self.cancel_loading()
+        self.close_workbook()
+        wb = self.safe_load_workbook(self.filename)
+        if wb:
+            self.attach_workbook(self.filename, wb)
+        return self.wb
 
-    def find_sheet_for_month(self, month):
-        if not self.wb:
+    def load_calendar_definition(self):
+        """Определение календаря из выбранного файла или None, если файл не задан или не читается"""
+        if not self.calendar_file:
             return None
-            
-        month_names = {1: "01", 2: "02", 3: "03", 4: "04", 5: "05", 6: "06",
-                      7: "07", 8: "08", 9: "09", 10: "10", 11: "11", 12: "12"}
-        
-        target_month = month_names.get(month)
-        if not target_month:
+        try:
+            return load_calendar_definition(self.calendar_file)
+        except CalendarError as e:
+            QMessageBox.warning(self.ui, "Календарь", f"{e}\nЧетность недель считается от 1 сентября, праздники не учитываются")
             return None
+
+    def refresh_calendar(self):
+        """Пересобирает календарь, если файл определения изменился; выбранные даты сверяются с новым календарем"""
+        definition = self.load_calendar_definition()
+        if definition is self.calendar.definition or (definition is None and not self.calendar.definition.sources):
+            return
+        self.calendar = AcademicCalendar(self.sheetnames, definition)
         
-        for sheet_name in self.wb.sheetnames:
-            if re.search(r'\b' + re.escape(target_month) + r'\b', sheet_name):
-                return sheet_name
+        dates = []
+        for date_info in self.selected_dates:
+            date_info = self.make_date_info(date_info['date'])
+            if date_info and not self.calendar.excluded_reason(date_info['date']):
+                dates.append(date_info)
+        if len(dates) != len(self.selected_dates) and self.ui:
+            QMessageBox.warning(self.ui, "Календарь",
+                f"Календарь изменился: убрано нерабочих дат - {len(self.selected_dates) - len(dates)}")
+        self.selected_dates.reset(dates)
+        self.update_dates_info()
+
+    def select_calendar_file(self):
+        """Выбирает файл календаря учебного года (JSON или iCalendar)"""
+        filename, _ = QFileDialog.getOpenFileName(
+            self.ui,
+            "Выберите календарь учебного года",
+            "",
+            "Календарь (*.json *.ics)"
+        )
+        if not filename:
+            return
         
-        return None
+        try:
+            load_calendar_definition(filename)
+        except CalendarError as e:
+            QMessageBox.critical(self.ui, "Ошибка", str(e))
+            return
+        
+        self.calendar_file = filename
+        self.save_config()
+        self.refresh_calendar()
+        QMessageBox.information(self.ui, "Успех", f"Календарь загружен: {os.path.basename(filename)}")
+
+    def split_jobs_by_calendar(self, jobs):
+        """Убирает из заданий даты, на которые по календарю нет занятий
+
+        Возвращает задания с оставшимися датами и описания убранных дат.
+        """
+        valid_jobs = []
+        rejected = []
+        for job in jobs:
+            dates = []
+            for date_info in job['dates']:
+                reason = self.calendar.excluded_reason(date(date_info['year'], date_info['month'], date_info['day']))
+                if reason:
+                    rejected.append(f"{date_info['day']:02d}.{date_info['month']:02d}.{date_info['year']} ({reason})")
+                else:
+                    dates.append(date_info)
+            if dates:
+                valid_jobs.append({**job, 'dates': dates})
+        return valid_jobs, rejected
+
+    def make_date_info(self, day):
+        """Описание даты для списка выбранных дат или None, если для ее месяца нет листа"""
+        sheet_name = self.calendar.sheet_for(day)
+        if not sheet_name:
+            return None
+        return {
+            'date': day, 'day': day.day, 'month': day.month, 'year': day.year,
+            'sheet': sheet_name, 'week_type': self.calendar.week_type(day)
+        }
 
     def generate_dates_by_period(self):
         if not self.ui:
@@ -330,54 +829,30 @@ class JournalLogic:
             
             # Определяем тип недели
             if self.ui.numerator_radio.isChecked():
-                target_week_type = "числитель"
+                target_week_type = NUMERATOR
             elif self.ui.denominator_radio.isChecked():
-                target_week_type = "знаменатель"
+                target_week_type = DENOMINATOR
             else:
-                target_week_type = "обе недели"
+                target_week_type = BOTH_WEEKS
             
             if start_dt >= end_dt:
                 QMessageBox.critical(self.ui, "Ошибка", "Дата начала должна быть раньше даты окончания")
                 return
             
-            self.selected_dates.clear()
-            generated_count = 0
-            
-            if target_week_type == "обе недели":
-                current_date = start_dt
-                while current_date <= end_dt:
-                    sheet_name = self.find_sheet_for_month(current_date.month)
-                    if sheet_name:
-                        self.selected_dates.append({
-                            'date': current_date, 'day': current_date.day, 'month': current_date.month,
-                            'year': current_date.year, 'sheet': sheet_name,
-                            'week_type': self.determine_week_type(current_date)
-                        })
-                        generated_count += 1
-                    current_date += timedelta(days=7)
-            else:
-                current_date = start_dt
-                while current_date <= end_dt:
-                    week_type = self.determine_week_type(current_date)
-                    if week_type == target_week_type:
-                        sheet_name = self.find_sheet_for_month(current_date.month)
-                        if sheet_name:
-                            self.selected_dates.append({
-                                'date': current_date, 'day': current_date.day, 'month': current_date.month,
-                                'year': current_date.year, 'sheet': sheet_name, 'week_type': week_type
-                            })
-                            generated_count += 1
-                        current_date += timedelta(days=7)
-                    else:
-                        current_date += timedelta(days=1)
-            
-            self.selected_dates.sort(key=lambda x: (x['month'], x['day']))
+            self.refresh_calendar()
+            dates = []
+            for day in self.calendar.iter_dates(start_dt, end_dt, target_week_type):
+                date_info = self.make_date_info(day)
+                if date_info:
+                    dates.append(date_info)
+            self.selected_dates.reset(dates)
+            generated_count = len(self.selected_dates)
+            
             self.update_dates_info()
-            self.update_dates_display()
             
             if generated_count > 0:
                 dates_list = ", ".join([f"{date['day']}.{date['month']:02d}" for date in self.selected_dates])
-                week_type_display = "числитель и знаменатель (каждую неделю)" if target_week_type == "обе недели" else target_week_type
+                week_type_display = "числитель и знаменатель (каждую неделю)" if target_week_type == BOTH_WEEKS else target_week_type
                 
                 QMessageBox.information(self.ui, "Успех", 
                     f"Сгенерировано {generated_count} дат\n"
@@ -396,33 +871,23 @@ class JournalLogic:
             
         try:
             date_obj = self.ui.single_date.date().toPython()
-            sheet_name = self.find_sheet_for_month(date_obj.month)
+            self.refresh_calendar()
+            date_info = self.make_date_info(date_obj)
             
-            if not sheet_name:
+            if not date_info:
                 QMessageBox.critical(self.ui, "Ошибка", f"Не найден лист для месяца {date_obj.month}")
                 return
             
-            for existing_date in self.selected_dates:
-                if (existing_date['day'] == date_obj.day and 
-                    existing_date['month'] == date_obj.month and 
-                    existing_date['year'] == date_obj.year):
-                    QMessageBox.warning(self.ui, "Внимание", "Эта дата уже есть в списке")
-                    return
-            
-            date_info = {
-                'date': date_obj, 
-                'day': date_obj.day, 
-                'month': date_obj.month,
-                'year': date_obj.year, 
-                'sheet': sheet_name,
-                'week_type': self.determine_week_type(date_obj)
-            }
+            reason = self.calendar.excluded_reason(date_obj)
+            if reason:
+                QMessageBox.warning(self.ui, "Внимание", f"{date_obj.strftime('%d.%m.%Y')} - занятий нет: {reason}")
+                return
             
-            self.selected_dates.append(date_info)
-            self.selected_dates.sort(key=lambda x: (x['month'], x['day']))
+            if not self.selected_dates.add(date_info):
+                QMessageBox.warning(self.ui, "Внимание", "Эта дата уже есть в списке")
+                return
             
             self.update_dates_info()
-            self.update_dates_display()
             
             QMessageBox.information(self.ui, "Успех", f"Дата {date_obj.strftime('%d.%m.%Y')} добавлена")
             
@@ -439,29 +904,13 @@ class JournalLogic:
             return
         
         if 0 <= selected_index < len(self.selected_dates):
-            removed_date = self.selected_dates.pop(selected_index)
+            removed_date = self.selected_dates.remove_row(selected_index)
             self.update_dates_info()
-            self.update_dates_display()
             QMessageBox.information(self.ui, "Успех", f"Дата {removed_date['day']}.{removed_date['month']:02d}.{removed_date['year']} удалена")
 
-    def update_dates_display(self):
-        if not self.ui:
-            return
-            
-        self.ui.dates_listbox.clear()
-        date_values = []
-        for date_info in self.selected_dates:
-            display_text = f"{date_info['day']:02d}.{date_info['month']:02d}.{date_info['year']} ({date_info['sheet']}, {date_info['week_type']})"
-            self.ui.dates_listbox.addItem(display_text)
-            date_values.append(f"{date_info['day']:02d}.{date_info['month']:02d}.{date_info['year']}")
-        
-        self.ui.remove_date_combo.clear()
-        self.ui.remove_date_combo.addItems(date_values)
-
     def clear_dates(self):
-        self.selected_dates.clear()
+        self.selected_dates.reset()
         self.update_dates_info()
-        self.update_dates_display()
         if self.ui:
             QMessageBox.information(self.ui, "Успех", "Все даты очищены")
 
@@ -476,7 +925,9 @@ class JournalLogic:
             for date in self.selected_dates:
                 sheets_count[date['sheet']] = sheets_count.get(date['sheet'], 0) + 1
             
-            sheets_info = ", ".join([f"{sheet}: {count}" for sheet, count in sheets_count.items()])
+            capacity = self.plan_capacity(self.job_queue + [{'dates': self.selected_dates}]) if self.reader else {}
+            sheets_info = ", ".join([f"{sheet}: {count}" + (f" (своб. {capacity[sheet][2]})" if sheet in capacity else "")
+                                     for sheet, count in sheets_count.items()])
             week_types = set(date['week_type'] for date in self.selected_dates)
             week_types_info = f"Типы: {', '.join(week_types)}" if week_types else ""
             
@@ -486,34 +937,36 @@ class JournalLogic:
 
     def show_data(self):
         """Показывает данные из выбранного листа"""
-        if not self.wb or not self.ui:
+        if not self.reader or not self.ui:
             return
         
         sheet_name = self.ui.sheet_combo.currentText()
-        if sheet_name and sheet_name in self.wb.sheetnames:
+        if sheet_name and sheet_name in self.sheetnames:
             self.ui.table_widget.setRowCount(0)
             
             try:
-                sheet = self.wb[sheet_name]
-                row = self.START_ROW
+                entries = self.get_entry_rows(sheet_name)
+                self.ui.table_widget.setRowCount(len(entries))
                 
-                while sheet[f'E{row}'].value is not None:
-                    day = sheet[f'E{row}'].value
-                    if isinstance(day, (int, float)):
-                        current_row = self.ui.table_widget.rowCount()
-                        self.ui.table_widget.insertRow(current_row)
-                        
-                        self.ui.table_widget.setItem(current_row, 0, QTableWidgetItem(str(int(day))))
-                        self.ui.table_widget.setItem(current_row, 1, QTableWidgetItem(str(sheet[f'F{row}'].value or '')))
-                        self.ui.table_widget.setItem(current_row, 2, QTableWidgetItem(str(sheet[f'G{row}'].value or '')))
-                        self.ui.table_widget.setItem(current_row, 3, QTableWidgetItem(str(sheet[f'H{row}'].value or '')))
-                        self.ui.table_widget.setItem(current_row, 4, QTableWidgetItem(str(sheet.cell(row=row, column=12).value or '')))
-                        self.ui.table_widget.setItem(current_row, 5, QTableWidgetItem(str(sheet.cell(row=row, column=13).value or '')))
-                        self.ui.table_widget.setItem(current_row, 6, QTableWidgetItem(str(sheet.cell(row=row, column=14).value or '')))
-                    
-                    row += 1
+                used_hours = [False] * len(self.HOURS_FIELDS)
+                for current_row, (row, day, discipline, group, load_type, *hours) in enumerate(entries):
+                    day_item = QTableWidgetItem(str(int(day)))
+                    day_item.setData(Qt.UserRole, (row, row_content_hash((day, discipline, group, load_type, *hours))))
+                    self.ui.table_widget.setItem(current_row, 0, day_item)
+                    self.ui.table_widget.setItem(current_row, 1, QTableWidgetItem(str(discipline or '')))
+                    self.ui.table_widget.setItem(current_row, 2, QTableWidgetItem(str(group or '')))
+                    self.ui.table_widget.setItem(current_row, 3, QTableWidgetItem(str(load_type or '')))
+                    for index, value in enumerate(hours):
+                        if value:
+                            used_hours[index] = True
+                            self.ui.table_widget.setItem(current_row, 4 + index, QTableWidgetItem(str(value)))
+                
+                # Показываем лекции, практические и лабораторные всегда, остальные виды - если в листе есть часы
+                for index, used in enumerate(used_hours):
+                    self.ui.table_widget.setColumnHidden(4 + index, index >= 3 and not used)
                     
                 self.update_selection_info()
+                self.update_totals()
                 
             except Exception as e:
                 QMessageBox.critical(self.ui, "Ошибка", f"Ошибка при чтении данных: {e}")
@@ -540,7 +993,7 @@ class JournalLogic:
 
     def delete_selected_entries(self):
         """Удаляет выбранные записи из таблицы и файла Excel"""
-        if not self.wb:
+        if not self.reader:
             QMessageBox.critical(self.ui, "Ошибка", "Файл не загружен")
             return
             
@@ -552,12 +1005,8 @@ class JournalLogic:
             QMessageBox.warning(self.ui, "Внимание", "Выберите записи для удаления")
             return
         
-        entries_to_delete = []
-        for row in selected_rows:
-            day = self.ui.table_widget.item(row, 0).text()
-            discipline = self.ui.table_widget.item(row, 1).text()
-            group = self.ui.table_widget.item(row, 2).text()
-            entries_to_delete.append((day, discipline, group))
+        # Каждая строка таблицы помнит строку листа и хеш содержимого записи
+        entries_to_delete = [list(self.ui.table_widget.item(row, 0).data(Qt.UserRole)) for row in sorted(selected_rows)]
         
         confirm = QMessageBox.question(
             self.ui,
@@ -571,11 +1020,8 @@ class JournalLogic:
             return
         
         try:
-            # Закрываем и перезагружаем workbook для гарантии свежих данных
-            self.close_workbook()
-            self.wb = self.safe_load_workbook(self.filename)
-            
-            if not self.wb:
+            # Перечитываем workbook только если файл изменили вне приложения
+            if not self.ensure_workbook_fresh():
                 return
             
             sheet_name = self.ui.sheet_combo.currentText()
@@ -583,31 +1029,9 @@ class JournalLogic:
                 QMessageBox.critical(self.ui, "Ошибка", "Лист не найден")
                 return
             
-            sheet = self.wb[sheet_name]
-            deleted_count = 0
-            
-            rows_to_delete = []
-            for entry_data in entries_to_delete:
-                day = int(entry_data[0])
-                discipline = entry_data[1]
-                group = entry_data[2]
-                
-                row = self.START_ROW
-                while sheet[f'E{row}'].value is not None:
-                    sheet_day = sheet[f'E{row}'].value
-                    sheet_discipline = sheet[f'F{row}'].value or ''
-                    sheet_group = sheet[f'G{row}'].value or ''
-                    
-                    if (isinstance(sheet_day, (int, float)) and int(sheet_day) == day and
-                        sheet_discipline == discipline and sheet_group == group):
-                        rows_to_delete.append(row)
-                        break
-                    row += 1
-            
-            rows_to_delete.sort(reverse=True)
-            for row_num in rows_to_delete:
-                self.delete_row(sheet, row_num)
-                deleted_count += 1
+            # Операция сначала попадает в журнал операций, чтобы пережить неудачное сохранение
+            operation = self.log_operation('delete', {'sheet': sheet_name, 'rows': entries_to_delete})
+            deleted_count = self.apply_operation(operation)
             
             # Сохраняем и перезагружаем файл
             if self.safe_save_workbook():
@@ -617,149 +1041,557 @@ class JournalLogic:
         except Exception as e:
             QMessageBox.critical(self.ui, "Ошибка", f"Ошибка при удалении записей: {e}")
 
-    def delete_row(self, sheet, row_num):
-        """Удаляет строку из листа Excel и сдвигает остальные строки вверх"""
-        max_row = self.START_ROW
-        while sheet[f'E{max_row}'].value is not None:
-            max_row += 1
-        
-        for row in range(row_num, max_row):
-            sheet[f'E{row}'] = sheet[f'E{row + 1}'].value
-            sheet[f'F{row}'] = sheet[f'F{row + 1}'].value
-            sheet[f'G{row}'] = sheet[f'G{row + 1}'].value
-            sheet[f'H{row}'] = sheet[f'H{row + 1}'].value
-            sheet.cell(row=row, column=12).value = sheet.cell(row=row + 1, column=12).value
-            sheet.cell(row=row, column=13).value = sheet.cell(row=row + 1, column=13).value
-            sheet.cell(row=row, column=14).value = sheet.cell(row=row + 1, column=14).value
-        
-        # Очищаем последнюю строку (ВКЛЮЧАЯ КОЛОНКИ С ЧАСАМИ)
-        sheet[f'E{max_row}'] = None
-        sheet[f'F{max_row}'] = None
-        sheet[f'G{max_row}'] = None
-        sheet[f'H{max_row}'] = None
-        sheet.cell(row=max_row, column=12).value = None
-        sheet.cell(row=max_row, column=13).value = None
-        sheet.cell(row=max_row, column=14).value = None
+    def delete_entries(self, sheet_name, targets):
+        """Удаляет из месячного листа записи (номер строки, хеш содержимого) и возвращает число удаленных"""
+        if sheet_name not in self.wb.sheetnames:
+            return 0
+        
+        sheet = self.wb[sheet_name]
+        model = MonthSheetModel.from_sheet(sheet, self.START_ROW, self.HOURS_COLS.values())
+        rows_to_delete = set()
+        for row_number, content_hash in targets:
+            index = model.find_row(row_number, content_hash, rows_to_delete)
+            if index is not None:
+                rows_to_delete.add(index)
+        
+        if rows_to_delete:
+            model.delete_rows(rows_to_delete)
+            self.session.mark_dirty(sheet_name, *model.write_back(sheet))
+        return len(rows_to_delete)
+
+    def read_job_form(self, require_dates=True):
+        """Читает дисциплину, группу, вид нагрузки и часы из полей ввода
+        
+        Возвращает словарь данных записи или None, если поля заполнены неверно.
+        Без require_dates выбранные даты не нужны - так данные берутся для слота расписания.
+        """
+        if not all([self.selected_dates or not require_dates, 
+                   self.ui.entries['discipline'].currentText() if hasattr(self.ui.entries['discipline'], 'currentText') else self.ui.entries['discipline'].text(),
+                   self.ui.entries['group'].text(), 
+                   self.ui.entries['load_type'].currentText() if hasattr(self.ui.entries['load_type'], 'currentText') else self.ui.entries['load_type'].text()]):
+            QMessageBox.critical(self.ui, "Ошибка", "Заполните все обязательные поля и сгенерируйте даты")
+            return None
+        
+        discipline = self.ui.entries['discipline'].currentText() if hasattr(self.ui.entries['discipline'], 'currentText') else self.ui.entries['discipline'].text()
+        group = self.ui.entries['group'].text()
+        load_type = self.ui.entries['load_type'].currentText() if hasattr(self.ui.entries['load_type'], 'currentText') else self.ui.entries['load_type'].text()
+        
+        data = {
+            'discipline': discipline,
+            'group': group,
+            'load_type': load_type,
+        }
+        for field, label, column in self.HOURS_FIELDS:
+            value = self.ui.entries[field].text().strip().replace(',', '.')
+            try:
+                data[field] = float(value) if value else 0.0
+            except ValueError:
+                QMessageBox.critical(self.ui, "Ошибка", f"Проверьте поле \"{label}\" - оно должно содержать только число")
+                return None
+        
+        if not any(data[field] for field in self.HOURS_COLS):
+            QMessageBox.warning(self.ui, "Внимание", "Заполните часы хотя бы по одному виду занятий")
+            return None
+        
+        return data
+
+    def job_date(self, date_info):
+        """Дата задания на добавление - то, что попадает в журнал операций"""
+        return {key: date_info[key] for key in ('day', 'month', 'year', 'sheet', 'week_type')}
+
+    def make_job(self, data):
+        """Собирает задание на добавление: данные записи и выбранные даты"""
+        return {'dates': [self.job_date(date_info) for date_info in self.selected_dates], 'data': data}
 
     def add_entries(self):
         """Добавляет записи в журнал"""
-        if not self.wb or not self.ui:
+        if not self.reader or not self.ui:
             QMessageBox.critical(self.ui, "Ошибка", "Файл не загружен")
             return
+        
+        data = self.read_job_form()
+        if not data:
+            return
+        
+        unwritten = self.commit_jobs([self.make_job(data)])
+        if unwritten:
+            # Непоместившиеся даты ждут в очереди, пока в листах не освободится место
+            self.job_queue.extend(unwritten)
+            self.update_queue_preview()
+        elif unwritten is not None:
+            # Очищаем поля ввода; у дисциплины стирается только текст - список остается каталогом
+            for field in ['discipline', 'group', *self.HOURS_COLS]:
+                if field in self.ui.entries:
+                    if hasattr(self.ui.entries[field], 'clearEditText'):
+                        self.ui.entries[field].clearEditText()
+                    elif hasattr(self.ui.entries[field], 'clear'):
+                        self.ui.entries[field].clear()
             
-        if not all([self.wb, self.selected_dates, 
-                   self.ui.entries['discipline'].currentText() if hasattr(self.ui.entries['discipline'], 'currentText') else self.ui.entries['discipline'].text(),
-                   self.ui.entries['group'].text(), 
-                   self.ui.entries['load_type'].currentText() if hasattr(self.ui.entries['load_type'], 'currentText') else self.ui.entries['load_type'].text()]):
-            QMessageBox.critical(self.ui, "Ошибка", "Заполните все обязательные поля и сгенерируйте даты")
+            if 'load_type' in self.ui.entries:
+                self.ui.entries['load_type'].setCurrentIndex(0)
+
+    def queue_job(self):
+        """Ставит текущие данные и даты в очередь на добавление"""
+        if not self.ui:
             return
         
+        data = self.read_job_form()
+        if not data:
+            return
+        
+        self.job_queue.append(self.make_job(data))
+        self.update_queue_preview()
+
+    def commit_queue(self):
+        """Записывает все задания очереди одной операцией и одним сохранением"""
+        if not self.reader or not self.ui:
+            QMessageBox.critical(self.ui, "Ошибка", "Файл не загружен")
+            return
+        
+        if not self.job_queue:
+            QMessageBox.warning(self.ui, "Внимание", "Очередь пуста")
+            return
+        
+        unwritten = self.commit_jobs(self.job_queue)
+        if unwritten is not None:
+            self.job_queue = unwritten
+            self.update_queue_preview()
+
+    def clear_queue(self):
+        """Очищает очередь заданий, ничего не записывая"""
+        self.job_queue = []
+        self.update_queue_preview()
+
+    def update_queue_preview(self):
+        """Показывает записи из очереди, сгруппированные по листам"""
+        if not self.ui:
+            return
+        
+        rows_by_sheet = {}
+        for job in self.job_queue:
+            data = job['data']
+            hours = ", ".join(f"{label.lower()} {data[field]:g}" for field, label, column in self.HOURS_FIELDS
+                              if data.get(field))
+            for date_info in job['dates']:
+                rows_by_sheet.setdefault(date_info['sheet'], []).append(
+                    (date_info['day'], f"{date_info['day']:02d}.{date_info['month']:02d}: "
+                     f"{data['discipline']}, {data['group']}, {data['load_type']}, {hours}"))
+        
+        capacity = self.plan_capacity(self.job_queue)
+        self.ui.queue_tree.clear()
+        for sheet_name in self.filter_monthly_sheets(self.sheetnames):
+            rows = rows_by_sheet.get(sheet_name)
+            if not rows:
+                continue
+            used, queued, free = capacity[sheet_name]
+            sheet_item = QTreeWidgetItem([f"{sheet_name} ({len(rows)}) - свободно {free} из {self.MONTH_CAPACITY}"])
+            if free < 0:
+                sheet_item.setForeground(0, QColor("red"))
+            elif free < self.NEARLY_FULL_ROWS:
+                sheet_item.setForeground(0, QColor("#d2691e"))
+            for day, text in sorted(rows, key=lambda row: row[0]):
+                sheet_item.addChild(QTreeWidgetItem([text]))
+            self.ui.queue_tree.addTopLevelItem(sheet_item)
+        self.ui.queue_tree.expandAll()
+        
+        total = sum(len(rows) for rows in rows_by_sheet.values())
+        self.ui.queue_info_label.setText(f"Заданий: {len(self.job_queue)} | Записей: {total}")
+
+    def add_timetable_slot(self):
+        """Добавляет в недельное расписание слот из полей ввода"""
+        if not self.ui:
+            return
+        
+        data = self.read_job_form(require_dates=False)
+        if not data:
+            return
+        
+        self.timetable.add(self.ui.timetable_weekday_combo.currentIndex(),
+                           self.ui.timetable_week_combo.currentText(), data)
+        self.update_timetable_view()
+
+    def remove_timetable_slot(self):
+        """Убирает выбранный слот из недельного расписания"""
+        if not self.ui:
+            return
+        
+        index = self.ui.timetable_tree.indexOfTopLevelItem(self.ui.timetable_tree.currentItem())
+        if index == -1:
+            QMessageBox.warning(self.ui, "Внимание", "Выберите занятие в расписании")
+            return
+        
+        self.timetable.remove(index)
+        self.update_timetable_view()
+
+    def update_timetable_view(self):
+        """Показывает слоты недельного расписания"""
+        if not self.ui:
+            return
+        
+        self.ui.timetable_tree.clear()
+        for slot in self.timetable.slots:
+            data = slot['data']
+            hours = ", ".join(f"{label.lower()} {data[field]:g}" for field, label, column in self.HOURS_FIELDS
+                              if data.get(field))
+            self.ui.timetable_tree.addTopLevelItem(QTreeWidgetItem([
+                WEEKDAYS[slot['weekday']], slot['week_type'],
+                f"{data['discipline']}, {data['group']}, {data['load_type']}, {hours}"]))
+        self.ui.timetable_info_label.setText(f"Занятий в неделю: {len(self.timetable.slots)}")
+
+    def fill_from_timetable(self):
+        """Разворачивает расписание на выбранный период и записывает все занятия одной операцией
+        
+        Даты каждого слота распределяются по листам месяцев; записи, не поместившиеся
+        в листы, остаются в очереди.
+        """
+        if not self.reader or not self.ui:
+            QMessageBox.critical(self.ui, "Ошибка", "Файл не загружен")
+            return
+        
+        if not self.timetable.slots:
+            QMessageBox.warning(self.ui, "Внимание", "Расписание пусто")
+            return
+        
+        start_dt = self.ui.start_date.date().toPython()
+        end_dt = self.ui.end_date.date().toPython()
+        if start_dt >= end_dt:
+            QMessageBox.critical(self.ui, "Ошибка", "Дата начала должна быть раньше даты окончания")
+            return
+        
+        self.refresh_calendar()
+        jobs = []
+        missing_months = set()
+        for slot, days in self.timetable.expand(self.calendar, start_dt, end_dt):
+            dates = []
+            for day in days:
+                date_info = self.make_date_info(day)
+                if date_info:
+                    dates.append(self.job_date(date_info))
+                else:
+                    missing_months.add(day.month)
+            if dates:
+                jobs.append({'dates': dates, 'data': dict(slot['data'])})
+        
+        total = sum(len(job['dates']) for job in jobs)
+        if not total:
+            QMessageBox.warning(self.ui, "Внимание", "В выбранном периоде нет занятий по расписанию")
+            return
+        
+        question = (f"Записать {total} занятий по {len(jobs)} строкам расписания "
+                    f"за {start_dt.strftime('%d.%m.%Y')} - {end_dt.strftime('%d.%m.%Y')}?")
+        if missing_months:
+            question += f"\nНет листов для месяцев: {', '.join(f'{month:02d}' for month in sorted(missing_months))}"
+        confirm = QMessageBox.question(self.ui, "Заполнение по расписанию", question, QMessageBox.Yes | QMessageBox.No)
+        if confirm != QMessageBox.Yes:
+            return
+        
+        unwritten = self.commit_jobs(jobs)
+        if unwritten:
+            self.job_queue.extend(unwritten)
+            self.update_queue_preview()
+
+    def import_schedule(self):
+        """Импортирует занятия выбранного периода из выгрузки расписания (.ics или .csv)
+        
+        Файл читается потоково, названия занятий переводятся в записи журнала по таблице
+        соответствий. Занятия, которые уже есть в листах, не дублируются; все остальные
+        записываются одной операцией и одним сохранением. Незнакомые названия дописываются
+        в таблицу соответствий, чтобы их осталось только заполнить.
+        """
+        if not self.reader or not self.ui:
+            QMessageBox.critical(self.ui, "Ошибка", "Файл не загружен")
+            return
+        
+        filename, _ = QFileDialog.getOpenFileName(
+            self.ui,
+            "Выберите выгрузку расписания",
+            "",
+            "Расписание (*.ics *.csv)"
+        )
+        if not filename:
+            return
+        
+        start_dt = self.ui.start_date.date().toPython()
+        end_dt = self.ui.end_date.date().toPython()
+        if start_dt >= end_dt:
+            QMessageBox.critical(self.ui, "Ошибка", "Дата начала должна быть раньше даты окончания")
+            return
+        
+        self.refresh_calendar()
+        self.import_mapping.load()
+        mappings = self.import_mapping.lookup_table()
+        
+        # Данные записи по ключу названия: разбираются один раз на название
+        data_by_key = {}
+        invalid = {}
+        unmapped = set()
+        unsupported = set()
+        missing_months = set()
+        dates_by_key = {}
         try:
-            discipline = self.ui.entries['discipline'].currentText() if hasattr(self.ui.entries['discipline'], 'currentText') else self.ui.entries['discipline'].text()
-            group = self.ui.entries['group'].text()
-            load_type = self.ui.entries['load_type'].currentText() if hasattr(self.ui.entries['load_type'], 'currentText') else self.ui.entries['load_type'].text()
-            lecture = self.ui.entries['lecture'].text()
-            practice = self.ui.entries['practice'].text()
-            lab = self.ui.entries['lab'].text()
-            
-            data = {
-                'discipline': discipline,
-                'group': group,
-                'load_type': load_type,
-                'lecture': float(lecture) if lecture else 0.0,
-                'practice': float(practice) if practice else 0.0,
-                'lab': float(lab) if lab else 0.0
-            }
+            for day, title in iter_schedule_events(filename, start_dt, end_dt):
+                if day is None:
+                    unsupported.add(title)
+                    continue
+                key = mapping_key(title)
+                if key not in data_by_key:
+                    if key not in mappings:
+                        unmapped.add(title)
+                        continue
+                    try:
+                        data_by_key[key] = mapping_data(mappings[key], self.HOURS_FIELDS, self.LOAD_TYPES)
+                    except ValueError as e:
+                        invalid[title] = str(e)
+                        data_by_key[key] = None
+                if data_by_key[key] is None:
+                    continue
+                date_info = self.make_date_info(day)
+                if date_info:
+                    dates_by_key.setdefault(key, []).append(self.job_date(date_info))
+                else:
+                    missing_months.add(day.month)
+        except (ValueError, OSError, csv.Error) as e:
+            QMessageBox.critical(self.ui, "Ошибка", f"Ошибка чтения расписания: {e}")
+            return
+        
+        # Повторный импорт не дублирует занятия: уже записанные в лист вычитаются
+        existing = Counter()
+        for sheet_name in set(date_info['sheet'] for dates in dates_by_key.values() for date_info in dates):
+            for row, day, discipline, group, load_type, *hours in self.get_entry_rows(sheet_name):
+                existing[(sheet_name, day, discipline, group, load_type)] += 1
+        
+        jobs = []
+        duplicates = 0
+        for key, dates in dates_by_key.items():
+            data = data_by_key[key]
+            new_dates = []
+            for date_info in dates:
+                entry_key = (date_info['sheet'], date_info['day'], data['discipline'], data['group'], data['load_type'])
+                if existing[entry_key] > 0:
+                    existing[entry_key] -= 1
+                    duplicates += 1
+                else:
+                    new_dates.append(date_info)
+            if new_dates:
+                jobs.append({'dates': new_dates, 'data': data})
+        
+        notes = []
+        if unmapped:
+            self.import_mapping.add_unmapped(sorted(unmapped))
+            notes.append(f"Нет соответствий для {len(unmapped)} названий - заполните их в "
+                         f"{os.path.abspath(self.import_mapping.path)}:\n" + "\n".join(sorted(unmapped)[:10]))
+        if invalid:
+            notes.append("Неверные соответствия:\n" + "\n".join(f"{title}: {error}" for title, error in invalid.items()))
+        if unsupported:
+            notes.append(f"Пропущены события с неподдерживаемым повтором: {len(unsupported)}")
+        if missing_months:
+            notes.append(f"Нет листов для месяцев: {', '.join(f'{month:02d}' for month in sorted(missing_months))}")
+        if duplicates:
+            notes.append(f"Уже есть в журнале: {duplicates}")
+        
+        total = sum(len(job['dates']) for job in jobs)
+        if not total:
+            QMessageBox.warning(self.ui, "Импорт расписания",
+                                "\n\n".join(["Нет новых занятий для записи"] + notes))
+            return
+        
+        question = (f"Записать {total} занятий из {os.path.basename(filename)} "
+                    f"за {start_dt.strftime('%d.%m.%Y')} - {end_dt.strftime('%d.%m.%Y')}?")
+        confirm = QMessageBox.question(self.ui, "Импорт расписания", "\n\n".join([question] + notes),
+                                       QMessageBox.Yes | QMessageBox.No)
+        if confirm != QMessageBox.Yes:
+            return
+        
+        unwritten = self.commit_jobs(jobs)
+        if unwritten:
+            self.job_queue.extend(unwritten)
+            self.update_queue_preview()
+
+    def sheet_used_rows(self, sheet_name):
+        """Число строк месячного листа, занятых записями, начиная с START_ROW"""
+        entries = self.get_entry_rows(sheet_name)
+        return entries[-1][0] - self.START_ROW + 1 if entries else 0
+
+    def plan_capacity(self, jobs):
+        """Считает по листам заданий (занято, добавляется, останется свободно) строк диапазона итогов
+        
+        Занятые строки берутся из кэша разобранных записей, поэтому подсчет дешевый.
+        """
+        queued = {}
+        for job in jobs:
+            for date_info in job['dates']:
+                queued[date_info['sheet']] = queued.get(date_info['sheet'], 0) + 1
+        
+        capacity = {}
+        for sheet_name, count in queued.items():
+            used = self.sheet_used_rows(sheet_name)
+            capacity[sheet_name] = (used, count, self.MONTH_CAPACITY - used - count)
+        return capacity
+
+    def split_jobs_by_capacity(self, jobs):
+        """Делит задания на помещающиеся в диапазон итогов и непоместившиеся
+        
+        Свободные строки листа достаются датам в порядке очереди.
+        """
+        free_rows = {}
+        fitting_jobs = []
+        overflow_jobs = []
+        for job in jobs:
+            fitting_dates = []
+            overflow_dates = []
+            for date_info in job['dates']:
+                sheet_name = date_info['sheet']
+                if sheet_name not in free_rows:
+                    free_rows[sheet_name] = self.MONTH_CAPACITY - self.sheet_used_rows(sheet_name)
+                if free_rows[sheet_name] > 0:
+                    free_rows[sheet_name] -= 1
+                    fitting_dates.append(date_info)
+                else:
+                    overflow_dates.append(date_info)
+            if fitting_dates:
+                fitting_jobs.append({**job, 'dates': fitting_dates})
+            if overflow_dates:
+                overflow_jobs.append({**job, 'dates': overflow_dates})
+        return fitting_jobs, overflow_jobs
+
+    def commit_jobs(self, jobs):
+        """Записывает задания на добавление в книгу и сохраняет ее один раз
+        
+        Возвращает задания, которые не поместились в диапазон итогов и остались незаписанными,
+        или None, если ничего не записано.
+        """
+        try:
+            # Перечитываем workbook только если файл изменили вне приложения
+            if not self.ensure_workbook_fresh():
+                return None
             
-            if data['lecture'] == 0 and data['practice'] == 0 and data['lab'] == 0:
-                QMessageBox.warning(self.ui, "Внимание", "Заполните хотя бы одно поле: Лекции, Практические или Лабораторные")
-                return
+            # Даты, выбранные до изменения календаря, не должны попасть в лист
+            self.refresh_calendar()
+            jobs, rejected = self.split_jobs_by_calendar(jobs)
+            if rejected:
+                QMessageBox.warning(self.ui, "Календарь", "Пропущены нерабочие дни:\n" + "\n".join(rejected))
+                if not jobs:
+                    return None
             
-            # Закрываем и перезагружаем workbook для гарантии свежих данных
-            self.close_workbook()
-            self.wb = self.safe_load_workbook(self.filename)
+            # Записи за FORMULA_END_ROW выпали бы из итогов семестра
+            jobs, overflow_jobs = self.split_jobs_by_capacity(jobs)
+            if overflow_jobs:
+                overflow = {}
+                for job in overflow_jobs:
+                    for date_info in job['dates']:
+                        overflow[date_info['sheet']] = overflow.get(date_info['sheet'], 0) + 1
+                overflow_info = ", ".join(f"{sheet_name}: {count}" for sheet_name, count in overflow.items())
+                if not jobs:
+                    QMessageBox.critical(self.ui, "Ошибка",
+                        f"Записи не помещаются в листы (строки {self.START_ROW}-{self.FORMULA_END_ROW}): {overflow_info}")
+                    return None
+                confirm = QMessageBox.question(
+                    self.ui,
+                    "Недостаточно строк",
+                    f"Не помещаются записи (строки {self.START_ROW}-{self.FORMULA_END_ROW}): {overflow_info}\n"
+                    f"Записать только помещающиеся? Остальные останутся в очереди.",
+                    QMessageBox.Yes | QMessageBox.No
+                )
+                if confirm != QMessageBox.Yes:
+                    return None
             
-            if not self.wb:
-                return
+            # Операция сначала попадает в журнал операций, чтобы пережить неудачное сохранение
+            operation = self.log_operation('add', {'jobs': jobs})
             
-            dates_by_sheet = {}
-            for date_info in self.selected_dates:
-                sheet_name = date_info['sheet']
-                if sheet_name not in dates_by_sheet:
-                    dates_by_sheet[sheet_name] = []
-                dates_by_sheet[sheet_name].append(date_info)
+            # Записываем даты в месячные листы и заполняем листы "Осень" и "Весна"
+            results, season_results = self.apply_operation(operation)
             
-            results = {}
-            for sheet_name, dates in dates_by_sheet.items():
-                if sheet_name not in self.wb.sheetnames:
-                    continue
-                    
-                sheet = self.wb[sheet_name]
-                dates.sort(key=lambda x: x['day'])
-                
-                added_rows = []
-                for date_info in dates:
-                    row = self.add_entry_to_sheet(sheet, date_info['day'], data)
-                    if row:
-                        added_rows.append(f"{date_info['day']}.{date_info['month']:02d}(стр.{row})")
-                
-                if added_rows:
-                    results[sheet_name] = added_rows
+            # Сохраняем файл
+            if not self.safe_save_workbook():
+                return None
             
-            # Заполняем листы "Осень" и "Весна"
-            season_results = self.fill_season_sheets(data)
+            # Обновляем отображение
+            self.show_data()
             
-            # Сохраняем файл
-            if self.safe_save_workbook():
-                # Обновляем отображение
-                self.show_data()
-                
-                # Обновляем список дисциплин после добавления новых записей
-                self.update_disciplines_list()
-                
-                msg_lines = ["Записи добавлены:"]
-                for sheet_name, dates in results.items():
-                    msg_lines.append(f"{sheet_name}: {', '.join(dates)}")
-                
-                if season_results:
-                    msg_lines.append("\nСеместровые листы:")
-                    for sheet_name, result in season_results.items():
-                        msg_lines.append(f"{sheet_name}: {result}")
-                
-                if results or season_results:
-                    QMessageBox.information(self.ui, "Успех", "\n".join(msg_lines))
-                    
-                    # Очищаем поля ввода
-                    for field in ['discipline', 'group', 'lecture', 'practice', 'lab']:
-                        if field in self.ui.entries:
-                            if hasattr(self.ui.entries[field], 'clear'):
-                                self.ui.entries[field].clear()
-                    
-                    if 'load_type' in self.ui.entries:
-                        self.ui.entries['load_type'].setCurrentIndex(0)
+            if not results and not season_results:
+                QMessageBox.warning(self.ui, "Внимание", "Не удалось добавить записи")
+                return None
+            
+            msg_lines = ["Записи добавлены:"]
+            for sheet_name, rows in results.items():
+                if len(jobs) > 1:
+                    msg_lines.append(f"{sheet_name}: {len(rows)}")
                 else:
-                    QMessageBox.warning(self.ui, "Внимание", "Не удалось добавить записи")
-                
-        except ValueError as e:
-            QMessageBox.critical(self.ui, "Ошибка", "Проверьте числовые поля (Лекции, Практические, Лабораторные) - они должны содержать только числа")
+                    msg_lines.append(f"{sheet_name}: {', '.join(rows)}")
+            
+            if season_results:
+                msg_lines.append("\nСеместровые листы:")
+                for sheet_name, sheet_results in season_results.items():
+                    msg_lines.append(f"{sheet_name}: {'; '.join(sheet_results)}")
+            
+            nearly_full = []
+            for sheet_name in results:
+                free = self.MONTH_CAPACITY - self.sheet_used_rows(sheet_name)
+                if free < self.NEARLY_FULL_ROWS:
+                    nearly_full.append(f"{sheet_name} (свободно {free})")
+            if nearly_full:
+                msg_lines.append(f"\nЛисты почти заполнены: {', '.join(nearly_full)}")
+            if overflow_jobs:
+                msg_lines.append(f"\nНе поместились и остались в очереди: {overflow_info}")
+            
+            QMessageBox.information(self.ui, "Успех", "\n".join(msg_lines))
+            return overflow_jobs
+            
         except Exception as e:
             QMessageBox.critical(self.ui, "Ошибка", f"Ошибка при добавлении записей: {e}")
+            return None
+
+    def write_jobs(self, jobs):
+        """Записывает задания в месячные и семестровые листы и возвращает результаты по листам"""
+        results = self.write_entries([(date_info, job['data']) for job in jobs for date_info in job['dates']])
+        season_results = {}
+        for job in jobs:
+            for sheet_name, result in self.fill_season_sheets(job['dates'], job['data']).items():
+                season_results.setdefault(sheet_name, []).append(result)
+        return results, season_results
+
+    def write_entries(self, entries):
+        """Записывает записи (дата, данные) всех заданий в месячные листы и возвращает добавленные строки
+        
+        Записи группируются по листам, поэтому каждый лист разбирается и записывается
+        один раз, сколько бы заданий в него ни попало.
+        """
+        entries_by_sheet = {}
+        for date_info, data in entries:
+            entries_by_sheet.setdefault(date_info['sheet'], []).append((date_info, data))
+        
+        results = {}
+        for sheet_name, sheet_entries in entries_by_sheet.items():
+            if sheet_name not in self.wb.sheetnames:
+                continue
+                
+            sheet = self.wb[sheet_name]
+            sheet_entries.sort(key=lambda entry: entry[0]['day'])
+            
+            # Все даты листа вливаются в записи одним проходом и записываются одним блоком
+            model = MonthSheetModel.from_sheet(sheet, self.START_ROW, self.HOURS_COLS.values())
+            rows = model.insert_many([self.make_month_row(date_info['day'], data) for date_info, data in sheet_entries])
+            added_rows = [f"{date_info['day']}.{date_info['month']:02d}(стр.{row})"
+                          for (date_info, data), row in zip(sheet_entries, rows)]
+            
+            self.session.mark_dirty(sheet_name, *model.write_back(sheet))
+            results[sheet_name] = added_rows
+        
+        return results
 
-    def fill_season_sheets(self, data):
+    def fill_season_sheets(self, dates, data):
         """Заполняет листы 'Осень' и 'Весна' данными и возвращает результаты"""
         season_results = {}
         
         try:
-            if not self.selected_dates:
+            if not dates:
                 return season_results
             
-            months = set(date_info['month'] for date_info in self.selected_dates)
+            months = set(f"{date_info['month']:02d}" for date_info in dates)
             
-            autumn_months = {9, 10, 11, 12}
-            spring_months = {1, 2, 3, 4, 5}
-            
-            fill_autumn = any(month in autumn_months for month in months)
-            fill_spring = any(month in spring_months for month in months)
+            # Январь входит в итоги осеннего семестра, как в формулах шаблона
+            fill_autumn = any(month in self.SEASON_MONTHS['осень'] for month in months)
+            fill_spring = any(month in self.SEASON_MONTHS['весна'] for month in months)
             
             if fill_autumn and 'осень' in self.wb.sheetnames:
                 result = self.fill_season_sheet('осень', data)
@@ -776,127 +1608,49 @@ class JournalLogic:
         
         return season_results
 
+    def season_index(self, sheet_name):
+        """Возвращает индекс строк семестрового листа, построенный один раз для загруженной книги
+
+        Записи в семестровые листы идут только через индекс, поэтому он остается
+        актуальным до перезагрузки книги.
+        """
+        cached = self.season_indexes.get(sheet_name)
+        if cached and cached[0] == self.session.generation:
+            return cached[1]
+        
+        index = SeasonSheetIndex.from_sheet(self.wb[sheet_name], self.SEASON_FIRST_ROW, self.SEASON_LAST_ROW)
+        self.season_indexes[sheet_name] = (self.session.generation, index)
+        return index
+
     def fill_season_sheet(self, sheet_name, data):
-        """Заполняет конкретный семестровый лист и возвращает результат"""
+        """Находит строку "план" для дисциплины, группы и вида нагрузки или занимает свободную и возвращает результат"""
         try:
-            sheet = self.wb[sheet_name]
-            
-            row = 5
-            max_rows_to_check = 50
-            
-            while row <= max_rows_to_check:
-                try:
-                    cell_d = sheet[f'D{row}']
-                    cell_e = sheet[f'E{row}']
-                    cell_f = sheet[f'F{row}']
-                    
-                    def is_cell_empty(cell):
-                        try:
-                            return cell.value is None or str(cell.value).strip() == ''
-                        except:
-                            return True
-                    
-                    if (is_cell_empty(cell_d) and 
-                        is_cell_empty(cell_e) and 
-                        is_cell_empty(cell_f)):
-                        break
-                except:
-                    pass
-                
-                row += 2
+            rows, created = self.season_index(sheet_name).upsert(data['discipline'], data['group'], data['load_type'])
+            if rows is None:
+                return f"Не найдено свободных строк (проверено до строки {self.SEASON_LAST_ROW})"
             
-            if row > max_rows_to_check:
-                return f"Не найдено свободных строк (проверено до строки {max_rows_to_check})"
+            row = rows[0]
+            description = f"строка {row}: {data['discipline']}, {data['group']}, {data['load_type']}"
+            if not created:
+                return f"{description} (уже в плане)"
             
             try:
-                sheet[f'D{row}'] = data['discipline']
-                sheet[f'E{row}'] = data['group']
-                sheet[f'F{row}'] = data['load_type']
-                
-                for col in ['D', 'E', 'F']:
+                sheet = self.wb[sheet_name]
+                for col, value in (('D', data['discipline']), ('E', data['group']), ('F', data['load_type'])):
+                    sheet[f'{col}{row}'] = value
                     sheet[f'{col}{row}'].alignment = Alignment(horizontal='center', vertical='center')
-                
-                return f"строка {row}: {data['discipline']}, {data['group']}, {data['load_type']}"
+                self.session.mark_dirty(sheet_name, row, row)
+                return description
                 
             except Exception as write_error:
+                # Индекс уже считает строку занятой - при следующем обращении он построится заново
+                self.season_indexes.pop(sheet_name, None)
                 return f"Ошибка записи в строку {row}: {str(write_error)}"
             
         except Exception as e:
             return f"Ошибка: {str(e)}"
 
-    def add_entry_to_sheet(self, sheet, day, data):
-        """Добавляет запись в лист и возвращает номер строки"""
-        try:
-            last_row = self.START_ROW
-            while sheet[f'E{last_row}'].value is not None:
-                last_row += 1
-            
-            existing_date_rows = []
-            row = self.START_ROW
-            while sheet[f'E{row}'].value is not None:
-                existing_day = sheet[f'E{row}'].value
-                if isinstance(existing_day, (int, float)) and int(existing_day) == day:
-                    existing_date_rows.append(row)
-                row += 1
-            
-            if existing_date_rows:
-                last_date_row = max(existing_date_rows)
-                insert_row = last_date_row + 1
-                self.shift_rows_down(sheet, insert_row, last_row)
-                self.fill_row_data(sheet, insert_row, day, data)
-                return insert_row
-            else:
-                return self.insert_entry_sorted(sheet, day, data, last_row)
-        except Exception as e:
-            print(f"Ошибка при добавлении записи: {e}")
-            return None
-
-    def shift_rows_down(self, sheet, start_row, last_row):
-        """Сдвигает строки вниз"""
-        for row in range(last_row, start_row - 1, -1):
-            sheet[f'E{row+1}'] = sheet[f'E{row}'].value
-            sheet[f'F{row+1}'] = sheet[f'F{row}'].value
-            sheet[f'G{row+1}'] = sheet[f'G{row}'].value
-            sheet[f'H{row+1}'] = sheet[f'H{row}'].value
-            sheet.cell(row=row+1, column=12).value = sheet.cell(row=row, column=12).value
-            sheet.cell(row=row+1, column=13).value = sheet.cell(row=row, column=13).value
-            sheet.cell(row=row+1, column=14).value = sheet.cell(row=row, column=14).value
-            
-            # ОЧИЩАЕМ ИСХОДНУЮ СТРОКУ ПРИ СДВИГЕ (если это строка вставки)
-            if row == start_row:
-                sheet.cell(row=row, column=12).value = None
-                sheet.cell(row=row, column=13).value = None
-                sheet.cell(row=row, column=14).value = None
-
-    def insert_entry_sorted(self, sheet, day, data, last_row):
-        """Вставляет запись в отсортированном порядке"""
-        insert_row = self.START_ROW
-        while sheet[f'E{insert_row}'].value is not None:
-            existing_day = sheet[f'E{insert_row}'].value
-            if isinstance(existing_day, (int, float)) and int(existing_day) > day:
-                break
-            insert_row += 1
-        
-        self.shift_rows_down(sheet, insert_row, last_row)
-        self.fill_row_data(sheet, insert_row, day, data)
-        return insert_row
-
-    def fill_row_data(self, sheet, row, day, data):
-        """Заполняет строку данными - ИСПРАВЛЕННАЯ ВЕРСИЯ"""
-        sheet[f'E{row}'] = day
-        sheet[f'F{row}'] = data['discipline']
-        sheet[f'G{row}'] = data['group']
-        sheet[f'H{row}'] = data['load_type']
-        
-        # ОЧИЩАЕМ ВСЕ КОЛОНКИ С ЧАСАМИ ПЕРЕД ЗАПОЛНЕНИЕМ
-        sheet.cell(row=row, column=12).value = None  # Лекции (J)
-        sheet.cell(row=row, column=13).value = None  # Практические (K)
-        sheet.cell(row=row, column=14).value = None  # Лабораторные (L)
-        
-        # ЗАПОЛНЯЕМ ТОЛЬКО ТЕ КОЛОНКИ, ГДЕ ЕСТЬ ЧАСЫ
-        if data['lecture'] != 0:
-            sheet.cell(row=row, column=12).value = data['lecture']
-        if data['practice'] != 0:
-            sheet.cell(row=row, column=13).value = data['practice']
-        if data['lab'] != 0:
-            sheet.cell(row=row, column=14).value = data['lab']
\ No newline at end of file
+    def make_month_row(self, day, data):
+        """Собирает запись месячного листа; нулевые часы остаются пустыми ячейками"""
+        hours = tuple(data.get(field) or None for field in self.HOURS_COLS)
+        return MonthRow(day, data['discipline'], data['group'], data['load_type'], hours)
@@ -0,0 +1,261 @@
+import hashlib
+import heapq
+import json
+from array import array
+from bisect import bisect_right
+from journal_totals import entry_key
+
+# Колонки записи месячного листа: число, дисциплина, группа, вид нагрузки
+ENTRY_COLUMNS = (5, 6, 7, 8)
+# Колонки строки "план" семестрового листа: дисциплина, группа, вид нагрузки
+SEASON_KEY_COLUMNS = (4, 5, 6)
+
+
+def row_content_hash(values):
+    """Хеш содержимого записи (число, дисциплина, группа, нагрузка, часы...)
+
+    Целые числа с плавающей точкой приводятся к int, чтобы запись из книги в памяти (2.0)
+    и та же запись, прочитанная из файла (2), давали одинаковый хеш.
+    """
+    normalized = [int(value) if isinstance(value, float) and value.is_integer() else value for value in values]
+    payload = json.dumps(normalized, ensure_ascii=False, default=str).encode('utf-8')
+    return hashlib.blake2b(payload, digest_size=8).hexdigest()
+
+
+class MonthRow:
+    """Одна запись месячного листа"""
+
+    __slots__ = ('day', 'discipline', 'group', 'load_type', 'hours')
+
+    def __init__(self, day, discipline, group, load_type, hours):
+        self.day = day
+        self.discipline = discipline
+        self.group = group
+        self.load_type = load_type
+        self.hours = hours
+
+    def values(self):
+        """Значения ячеек строки: E-H, затем колонки часов"""
+        return (self.day, self.discipline, self.group, self.load_type) + self.hours
+
+    def content_hash(self):
+        return row_content_hash(self.values())
+
+
+class MonthSheetModel:
+    """Записи месячного листа в памяти
+
+    Строки хранятся в порядке листа, рядом - массив ключей (числа месяца) для двоичного
+    поиска места вставки. Изменения копятся в памяти и записываются в лист одним блоком,
+    начиная с первой измененной строки.
+    """
+
+    def __init__(self, start_row, hours_columns, rows):
+        self.start_row = start_row
+        self.hours_columns = tuple(hours_columns)
+        self.rows = rows
+        self.keys = array('d')
+        key = 0.0
+        for row in rows:
+            # Строка без числа остается за предыдущей записью
+            if isinstance(row.day, (int, float)):
+                key = float(row.day)
+            self.keys.append(key)
+        self.is_sorted = all(self.keys[i] <= self.keys[i + 1] for i in range(len(self.keys) - 1))
+        self.written_count = len(rows)
+        self.dirty_from = None
+        # Хеш содержимого -> индексы строк, строится при первом промахе по номеру строки
+        self.hash_index = None
+
+    @classmethod
+    def from_sheet(cls, sheet, start_row, hours_columns):
+        """Читает записи листа с start_row до первой пустой ячейки в колонке E за один проход"""
+        hours_columns = tuple(hours_columns)
+        min_col = ENTRY_COLUMNS[0]
+        hours_positions = [column - min_col for column in hours_columns]
+        rows = []
+        for values in sheet.iter_rows(min_row=start_row, min_col=min_col, max_col=max(hours_columns),
+                                      values_only=True):
+            if values[0] is None:
+                break
+            rows.append(MonthRow(values[0], values[1], values[2], values[3],
+                                 tuple(values[position] for position in hours_positions)))
+        return cls(start_row, hours_columns, rows)
+
+    def row_number(self, index):
+        return self.start_row + index
+
+    def find_row(self, row_number, content_hash, taken=()):
+        """Находит индекс записи по номеру строки листа и хешу ее содержимого
+
+        Если строка с этим номером изменилась (лист поменяли после показа таблицы),
+        берется ближайшая к ней еще не занятая строка с тем же содержимым.
+        """
+        index = row_number - self.start_row
+        if 0 <= index < len(self.rows) and index not in taken and self.rows[index].content_hash() == content_hash:
+            return index
+
+        if self.hash_index is None:
+            self.hash_index = {}
+            for position, row in enumerate(self.rows):
+                self.hash_index.setdefault(row.content_hash(), []).append(position)
+        candidates = [position for position in self.hash_index.get(content_hash, ()) if position not in taken]
+        if not candidates:
+            return None
+        return min(candidates, key=lambda position: abs(position - index))
+
+    def insertion_index(self, day):
+        """Место новой записи: после последней записи того же числа, иначе перед первой записью с большим числом"""
+        if self.is_sorted:
+            return bisect_right(self.keys, day)
+
+        # Лист отсортирован вручную не по порядку - ищем так же, как в листе
+        last_same_day = None
+        first_later_day = None
+        for index, row in enumerate(self.rows):
+            if isinstance(row.day, (int, float)):
+                if int(row.day) == day:
+                    last_same_day = index
+                elif int(row.day) > day and first_later_day is None:
+                    first_later_day = index
+        if last_same_day is not None:
+            return last_same_day + 1
+        return first_later_day if first_later_day is not None else len(self.rows)
+
+    def insert_many(self, new_rows):
+        """Вставляет записи одним проходом слияния и возвращает номера их строк в листе
+
+        Каждая новая запись встает после последней записи того же числа, новые записи
+        одного числа - в порядке переданного списка.
+        """
+        new_rows = sorted(new_rows, key=lambda row: row.day)
+        if not self.is_sorted:
+            # Для листа не по порядку сохраняем позиционную семантику поштучной вставки
+            indexes = []
+            for row in new_rows:
+                index = self.insertion_index(row.day)
+                indexes = [i + 1 if i >= index else i for i in indexes]
+                self.rows.insert(index, row)
+                self.keys.insert(index, float(row.day))
+                self.mark_changed(index)
+                indexes.append(index)
+            return [self.row_number(index) for index in indexes]
+
+        merged_rows = []
+        merged_keys = array('d')
+        indexes = []
+        position = 0
+        for row in new_rows:
+            key = float(row.day)
+            while position < len(self.rows) and self.keys[position] <= key:
+                merged_rows.append(self.rows[position])
+                merged_keys.append(self.keys[position])
+                position += 1
+            if not indexes:
+                self.mark_changed(len(merged_rows))
+            indexes.append(len(merged_rows))
+            merged_rows.append(row)
+            merged_keys.append(key)
+        merged_rows.extend(self.rows[position:])
+        merged_keys.extend(self.keys[position:])
+
+        self.rows = merged_rows
+        self.keys = merged_keys
+        return [self.row_number(index) for index in indexes]
+
+    def delete_rows(self, indexes):
+        """Удаляет строки с указанными индексами одним проходом уплотнения"""
+        to_delete = set(indexes)
+        if not to_delete:
+            return
+
+        kept_rows = []
+        kept_keys = array('d')
+        for index, (row, key) in enumerate(zip(self.rows, self.keys)):
+            if index not in to_delete:
+                kept_rows.append(row)
+                kept_keys.append(key)
+        self.mark_changed(min(to_delete))
+        self.rows = kept_rows
+        self.keys = kept_keys
+
+    def mark_changed(self, index):
+        self.hash_index = None
+        if self.dirty_from is None or index < self.dirty_from:
+            self.dirty_from = index
+
+    def write_back(self, sheet):
+        """Записывает измененный блок строк в лист и очищает освободившиеся строки
+
+        Возвращает первую и последнюю перезаписанные строки листа (None, None - если записывать нечего).
+        """
+        if self.dirty_from is None:
+            return None, None
+
+        columns = ENTRY_COLUMNS + self.hours_columns
+        end_index = max(len(self.rows), self.written_count)
+        for index in range(self.dirty_from, end_index):
+            row_number = self.row_number(index)
+            values = self.rows[index].values() if index < len(self.rows) else (None,) * len(columns)
+            for column, value in zip(columns, values):
+                sheet.cell(row=row_number, column=column).value = value
+
+        first_row = self.row_number(self.dirty_from)
+        self.written_count = len(self.rows)
+        self.dirty_from = None
+        return first_row, self.row_number(end_index - 1)
+
+
+def is_blank(value):
+    return value is None or str(value).strip() == ''
+
+
+class SeasonSheetIndex:
+    """Строки "план" семестрового листа по ключам $дисциплина$группа$нагрузка$
+
+    Строится за один проход по листу. Ключи сравниваются так же, как в СУММЕСЛИ шаблона -
+    без учета регистра и лишних пробелов, поэтому одна и та же дисциплина не занимает
+    вторую строку. Свободные строки (пустые D-F) выдаются по порядку, начиная с верхней.
+    """
+
+    def __init__(self, rows):
+        # Ключ -> строка "план"; строка "факт" идет следом за ней
+        self.plan_rows = {}
+        self.free_rows = []
+        for row_number, discipline, group, load_type in rows:
+            if is_blank(discipline) and is_blank(group) and is_blank(load_type):
+                self.free_rows.append(row_number)
+            elif not is_blank(discipline):
+                self.plan_rows.setdefault(entry_key(discipline, group, load_type), row_number)
+        heapq.heapify(self.free_rows)
+
+    @classmethod
+    def from_sheet(cls, sheet, first_row, last_row):
+        """Читает колонки D-F строк "план" (first_row, first_row + 2, ...) до last_row"""
+        rows = []
+        for row_number, values in enumerate(sheet.iter_rows(
+                min_row=first_row, max_row=last_row, min_col=SEASON_KEY_COLUMNS[0],
+                max_col=SEASON_KEY_COLUMNS[-1], values_only=True), first_row):
+            if (row_number - first_row) % 2 == 0:
+                rows.append((row_number,) + tuple(values))
+        return cls(rows)
+
+    def find(self, discipline, group, load_type):
+        """Возвращает пару строк (план, факт) для ключа или None"""
+        plan_row = self.plan_rows.get(entry_key(discipline, group, load_type))
+        return (plan_row, plan_row + 1) if plan_row is not None else None
+
+    def upsert(self, discipline, group, load_type):
+        """Возвращает (пара строк (план, факт), создана ли строка); (None, False) - если свободных строк нет
+
+        Новая строка только резервируется в индексе - записать D-F в лист должен вызывающий.
+        """
+        rows = self.find(discipline, group, load_type)
+        if rows is not None:
+            return rows, False
+        if not self.free_rows:
+            return None, False
+
+        plan_row = heapq.heappop(self.free_rows)
+        self.plan_rows[entry_key(discipline, group, load_type)] = plan_row
+        return (plan_row, plan_row + 1), True
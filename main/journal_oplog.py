@@ -0,0 +1,126 @@
+import json
+import os
+import threading
+from journal_workbook import compute_file_hash
+
+
+class OperationLog:
+    """Журнал операций рядом с файлом журнала (только дозапись)
+
+    Каждая операция добавления или удаления записывается сюда до того, как применяется
+    к книге в памяти, и удаляется после сохранения, в которое она вошла. Перед подменой
+    файла сохранение оставляет отметку с хешем нового файла: по ней после сбоя видно,
+    какие операции уже есть в журнале, а какие нужно применить заново.
+    """
+
+    def __init__(self, filename):
+        self.filename = filename
+        directory, basename = os.path.split(os.path.abspath(filename))
+        self.path = os.path.join(directory, f".{basename}.oplog.jsonl")
+        self.lock = threading.Lock()
+        self.repair_tail()
+        self.last_seq = max((record.get('seq', 0) for record in self.read_records()), default=0)
+
+    def repair_tail(self):
+        """Завершает строку, недописанную при сбое, чтобы следующая запись начиналась с новой строки"""
+        try:
+            with open(self.path, 'rb+') as f:
+                f.seek(0, os.SEEK_END)
+                if f.tell() == 0:
+                    return
+                f.seek(-1, os.SEEK_END)
+                if f.read(1) != b'\n':
+                    f.write(b'\n')
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            print(f"Ошибка чтения журнала операций: {e}")
+
+    def read_records(self):
+        """Читает записи журнала операций, пропуская строки, недописанные при сбое"""
+        if not os.path.exists(self.path):
+            return []
+
+        records = []
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        records.append(json.loads(line))
+                    except ValueError:
+                        continue
+        except OSError as e:
+            print(f"Ошибка чтения журнала операций: {e}")
+        return records
+
+    def write_record(self, record):
+        with open(self.path, 'a', encoding='utf-8') as f:
+            f.write(json.dumps(record, ensure_ascii=False) + '\n')
+            f.flush()
+            os.fsync(f.fileno())
+
+    def append(self, op_type, payload):
+        """Записывает операцию на диск и возвращает ее номер (None, если записать не удалось)"""
+        with self.lock:
+            seq = self.last_seq + 1
+            try:
+                self.write_record({'seq': seq, 'op': op_type, **payload})
+            except OSError as e:
+                print(f"Ошибка записи журнала операций: {e}")
+                return None
+            self.last_seq = seq
+            return seq
+
+    def mark_saving(self, through_seq, saved_path):
+        """Отмечает, что записанный файл saved_path содержит все операции до through_seq включительно"""
+        with self.lock:
+            try:
+                self.write_record({'op': 'save', 'through': through_seq, 'hash': compute_file_hash(saved_path)})
+            except OSError as e:
+                print(f"Ошибка записи журнала операций: {e}")
+
+    def has_records(self):
+        """Проверяет, остались ли в журнале операции, которых нет в файле журнала
+
+        Журнал только с сохраненными операциями (например, после сбоя между подменой
+        файла и очисткой журнала) считается пустым.
+        """
+        if not os.path.exists(self.path) or os.path.getsize(self.path) == 0:
+            return False
+        try:
+            return bool(self.pending(compute_file_hash(self.filename)))
+        except OSError:
+            return True
+
+    def pending(self, content_hash):
+        """Возвращает операции, которых нет в файле журнала с указанным хешем"""
+        operations = []
+        committed_seq = 0
+        for record in self.read_records():
+            if record.get('op') == 'save':
+                if record.get('hash') == content_hash:
+                    committed_seq = max(committed_seq, record.get('through', 0))
+            else:
+                operations.append(record)
+        return [operation for operation in operations if operation['seq'] > committed_seq]
+
+    def discard_through(self, seq):
+        """Удаляет из журнала операции, которые уже сохранены в файл"""
+        with self.lock:
+            records = [record for record in self.read_records()
+                       if record.get('op') != 'save' and record['seq'] > seq]
+            try:
+                if not records:
+                    if os.path.exists(self.path):
+                        os.remove(self.path)
+                    return
+
+                temp_path = self.path + '.tmp'
+                with open(temp_path, 'w', encoding='utf-8') as f:
+                    for record in records:
+                        f.write(json.dumps(record, ensure_ascii=False) + '\n')
+                    f.flush()
+                    os.fsync(f.fileno())
+                os.replace(temp_path, self.path)
+            except OSError as e:
+                print(f"Ошибка записи журнала операций: {e}")
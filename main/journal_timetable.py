@@ -0,0 +1,70 @@
+import json
+import os
+from datetime import timedelta
+from journal_calendar import NUMERATOR, DENOMINATOR, BOTH_WEEKS
+
+WEEKDAYS = ("Пн", "Вт", "Ср", "Чт", "Пт", "Сб", "Вс")
+WEEK_TYPES = (BOTH_WEEKS, NUMERATOR, DENOMINATOR)
+
+
+def first_weekday_on_or_after(day, weekday):
+    return day + timedelta(days=(weekday - day.weekday()) % 7)
+
+
+class Timetable:
+    """Недельное расписание преподавателя, из которого журнал заполняется сразу за семестр
+
+    Слот - день недели, тип недели и данные записи в том же виде, что у задания на
+    добавление (дисциплина, группа, вид нагрузки, часы). Расписание хранится в JSON
+    рядом с конфигурацией приложения и не зависит от открытого журнала.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.slots = []
+
+    def load(self):
+        """Читает слоты из файла; неполные слоты пропускаются"""
+        self.slots = []
+        if not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                slots = json.load(f).get('slots', [])
+            for slot in slots:
+                if (slot.get('weekday') in range(len(WEEKDAYS)) and slot.get('week_type') in WEEK_TYPES
+                        and isinstance(slot.get('data'), dict)):
+                    self.slots.append(slot)
+            self.sort()
+        except Exception as e:
+            print(f"Ошибка загрузки расписания: {e}")
+
+    def save(self):
+        try:
+            with open(self.path, 'w', encoding='utf-8') as f:
+                json.dump({'slots': self.slots}, f, ensure_ascii=False, indent=2)
+        except Exception as e:
+            print(f"Ошибка сохранения расписания: {e}")
+
+    def sort(self):
+        # Слоты одного дня идут в порядке добавления: sort устойчив
+        self.slots.sort(key=lambda slot: (slot['weekday'], WEEK_TYPES.index(slot['week_type'])))
+
+    def add(self, weekday, week_type, data):
+        self.slots.append({'weekday': weekday, 'week_type': week_type, 'data': data})
+        self.sort()
+        self.save()
+
+    def remove(self, index):
+        del self.slots[index]
+        self.save()
+
+    def expand(self, calendar, start, end):
+        """Разворачивает слоты на период: [(слот, даты занятий)]
+
+        Даты каждого слота выдает календарь - с четностью недель, без нерабочих дней
+        и с перенесенными днями.
+        """
+        return [(slot, list(calendar.iter_dates(first_weekday_on_or_after(start, slot['weekday']), end,
+                                                slot['week_type'])))
+                for slot in self.slots]
@@ -0,0 +1,70 @@
+import re
+
+
+def excel_text(value):
+    """Текстовое представление значения ячейки, как его получает СЦЕПИТЬ"""
+    if value is None:
+        return ''
+    if isinstance(value, bool):
+        return 'TRUE' if value else 'FALSE'
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return str(value)
+
+
+def excel_trim(text):
+    """СЖПРОБЕЛЫ: убирает пробелы по краям и схлопывает повторяющиеся пробелы внутри"""
+    return re.sub(' {2,}', ' ', text.strip(' '))
+
+
+def entry_key(discipline, group, load_type):
+    """Ключ $дисциплина$группа$нагрузка$, как в колонке D месячных листов
+
+    Excel сравнивает условия СУММЕСЛИ без учета регистра, поэтому ключ приводится к нижнему регистру.
+    """
+    return f"${excel_trim(excel_text(discipline))}${excel_trim(excel_text(group))}${excel_text(load_type)}$".lower()
+
+
+def season_key(discipline, group, load_type, load_types):
+    """Ключ строки "план" семестрового листа (колонка C) или None, если строка не участвует в итогах"""
+    if not excel_trim(excel_text(discipline)) or list(load_types).count(load_type) != 1:
+        return None
+    return entry_key(discipline, group, load_type)
+
+
+def aggregate_fact_hours(entry_rows, hours_count):
+    """Суммирует часы записей месячных листов по ключам за один проход
+
+    entry_rows - записи (строка, число, дисциплина, группа, нагрузка, часы...);
+    возвращает ключ -> список сумм по колонкам часов. Как и СУММЕСЛИ, учитывает только числа.
+    """
+    totals = {}
+    for row in entry_rows:
+        key = entry_key(row[2], row[3], row[4])
+        sums = totals.get(key)
+        if sums is None:
+            sums = totals[key] = [0.0] * hours_count
+        for index, value in enumerate(row[5:5 + hours_count]):
+            if isinstance(value, (int, float)) and not isinstance(value, bool):
+                sums[index] += value
+    return totals
+
+
+def season_plan_fact(plan_rows, fact_totals, load_types, hours_count):
+    """Сопоставляет строки "план" семестрового листа с фактическими часами
+
+    plan_rows - строки (строка, дисциплина, группа, нагрузка, плановые часы...);
+    возвращает (строка, дисциплина, группа, нагрузка, план по колонкам, факт по колонкам).
+    """
+    result = []
+    for row in plan_rows:
+        row_number, discipline, group, load_type = row[:4]
+        if not excel_trim(excel_text(discipline)):
+            continue
+        plan = [value if isinstance(value, (int, float)) and not isinstance(value, bool) else 0.0
+                for value in row[4:4 + hours_count]]
+        plan += [0.0] * (hours_count - len(plan))
+        key = season_key(discipline, group, load_type, load_types)
+        fact = list(fact_totals.get(key, [0.0] * hours_count)) if key else [0.0] * hours_count
+        result.append((row_number, discipline, group, load_type, plan, fact))
+    return result
@@ -1,11 +1,13 @@
 from PySide6.QtWidgets import (QApplication, QMainWindow, QWidget, QVBoxLayout, QHBoxLayout, QGridLayout, 
                               QLabel, QLineEdit, QComboBox, QPushButton, QTableWidget, QTableWidgetItem,
-                              QHeaderView, QGroupBox, QMessageBox, QFileDialog, QListWidget,
-                              QListWidgetItem, QAbstractItemView, QRadioButton,
-                              QButtonGroup, QDateEdit, QSplitter, QDialog, QDialogButtonBox, QTextBrowser, QSizePolicy)
+                              QHeaderView, QGroupBox, QMessageBox, QFileDialog,
+                              QAbstractItemView, QRadioButton,
+                              QButtonGroup, QDateEdit, QSplitter, QDialog, QDialogButtonBox, QTextBrowser, QSizePolicy,
+                              QProgressBar, QTreeWidget, QCompleter, QListView)
 from PySide6.QtCore import Qt, QDate, QTimer
 from PySide6.QtGui import QPalette, QColor, QFont, QMovie, QAction
 import os
+from journal_timetable import WEEKDAYS, WEEK_TYPES
 
 class JournalApp(QMainWindow):
     def __init__(self, logic_handler):
@@ -70,6 +72,14 @@ class JournalApp(QMainWindow):
         open_action.triggered.connect(self.logic_handler.open_file)
         file_menu.addAction(open_action)
         
+        calendar_action = QAction("Календарь учебного года...", self)
+        calendar_action.triggered.connect(self.logic_handler.select_calendar_file)
+        file_menu.addAction(calendar_action)
+        
+        import_action = QAction("Импорт расписания (iCal, CSV)...", self)
+        import_action.triggered.connect(self.logic_handler.import_schedule)
+        file_menu.addAction(import_action)
+        
         file_menu.addSeparator()
         
         exit_action = QAction("Выход", self)
@@ -97,6 +107,18 @@ class JournalApp(QMainWindow):
         self.file_path_label.setMinimumHeight(30)
         file_layout.addWidget(self.file_path_label)
         
+        # Индикатор фоновой загрузки
+        self.load_progress = QProgressBar()
+        self.load_progress.setMinimumWidth(250)
+        self.load_progress.setVisible(False)
+        file_layout.addWidget(self.load_progress)
+        
+        self.cancel_load_btn = QPushButton("Отменить загрузку")
+        self.cancel_load_btn.setStyleSheet(self.get_danger_button_style())
+        self.cancel_load_btn.clicked.connect(self.logic_handler.cancel_loading)
+        self.cancel_load_btn.setVisible(False)
+        file_layout.addWidget(self.cancel_load_btn)
+        
         # Кнопки управления файлом
         btn_layout = QHBoxLayout()
         self.select_file_btn = QPushButton("Выбрать файл")
@@ -106,6 +128,11 @@ class JournalApp(QMainWindow):
         
         file_layout.addLayout(btn_layout)
         
+        # Состояние фонового сохранения
+        self.save_status_label = QLabel("")
+        self.save_status_label.setMinimumWidth(150)
+        file_layout.addWidget(self.save_status_label)
+        
         parent_layout.addWidget(file_group)
     
     def create_period_section(self, parent_layout):
@@ -198,6 +225,7 @@ class JournalApp(QMainWindow):
         remove_date_layout.addWidget(QLabel("Удалить дату:"))
         self.remove_date_combo = QComboBox()
         self.remove_date_combo.setMinimumWidth(150)
+        self.remove_date_combo.setModel(self.logic_handler.selected_dates)
         remove_date_layout.addWidget(self.remove_date_combo)
         
         self.remove_date_btn = QPushButton("Удалить дату")
@@ -209,7 +237,9 @@ class JournalApp(QMainWindow):
         
         # Список выбранных дат
         dates_layout.addWidget(QLabel("Выбранные даты:"))
-        self.dates_listbox = QListWidget()
+        # Список и выбор даты для удаления показывают одну модель и обновляются построчно
+        self.dates_listbox = QListView()
+        self.dates_listbox.setModel(self.logic_handler.selected_dates)
         self.dates_listbox.setMinimumHeight(150)
         dates_layout.addWidget(self.dates_listbox)
         
@@ -222,10 +252,7 @@ class JournalApp(QMainWindow):
         fields = [
             ("Дисциплина:", "discipline", "combobox"),
             ("Группа:", "group", "entry"),
-            ("Вид нагрузки:", "load_type", "combobox"),
-            ("Лекции:", "lecture", "entry"),
-            ("Практические:", "practice", "entry"),
-            ("Лабораторные:", "lab", "entry")
+            ("Вид нагрузки:", "load_type", "combobox")
         ]
         
         self.entries = {}
@@ -236,13 +263,29 @@ class JournalApp(QMainWindow):
                 if field == "discipline":
                     self.entries[field] = QComboBox()
                     self.entries[field].setEditable(True)
+                    # Список и подсказки - каталог дисциплин; введенный текст в него не добавляется
+                    self.entries[field].setModel(self.logic_handler.catalog_models[field])
+                    self.entries[field].setInsertPolicy(QComboBox.NoInsert)
+                    self.entries[field].setCompleter(self.make_completer(field))
                 else:
                     self.entries[field] = QComboBox()
                     self.entries[field].addItems(self.logic_handler.LOAD_TYPES)
             else:
                 self.entries[field] = QLineEdit()
+                if field in self.logic_handler.catalog_models:
+                    self.entries[field].setCompleter(self.make_completer(field))
             
-            data_layout.addWidget(self.entries[field], i, 1)
+            data_layout.addWidget(self.entries[field], i, 1, 1, 3)
+        
+        # Часы по всем видам занятий шаблона - в две колонки
+        hours_fields = self.logic_handler.HOURS_FIELDS
+        rows_per_column = (len(hours_fields) + 1) // 2
+        for i, (field, label, column) in enumerate(hours_fields):
+            grid_row = len(fields) + i % rows_per_column
+            grid_column = (i // rows_per_column) * 2
+            data_layout.addWidget(QLabel(f"{label}:"), grid_row, grid_column)
+            self.entries[field] = QLineEdit()
+            data_layout.addWidget(self.entries[field], grid_row, grid_column + 1)
         
         input_splitter.addWidget(data_group)
         
@@ -262,17 +305,95 @@ class JournalApp(QMainWindow):
         
         input_splitter.addWidget(gif_group)
         
+        # Колонка 4: Очередь заданий на добавление
+        queue_group = QGroupBox("Очередь записей")
+        queue_layout = QVBoxLayout(queue_group)
+        
+        self.queue_info_label = QLabel("Заданий: 0 | Записей: 0")
+        self.queue_info_label.setStyleSheet("QLabel { color: blue; font-weight: bold; }")
+        queue_layout.addWidget(self.queue_info_label)
+        
+        self.queue_tree = QTreeWidget()
+        self.queue_tree.setHeaderHidden(True)
+        self.queue_tree.setMinimumHeight(150)
+        queue_layout.addWidget(self.queue_tree)
+        
+        input_splitter.addWidget(queue_group)
+        
+        # Колонка 5: Недельное расписание
+        timetable_group = QGroupBox("Расписание недели")
+        timetable_layout = QVBoxLayout(timetable_group)
+        
+        slot_layout = QHBoxLayout()
+        self.timetable_weekday_combo = QComboBox()
+        self.timetable_weekday_combo.addItems(WEEKDAYS)
+        slot_layout.addWidget(self.timetable_weekday_combo)
+        self.timetable_week_combo = QComboBox()
+        self.timetable_week_combo.addItems(WEEK_TYPES)
+        slot_layout.addWidget(self.timetable_week_combo)
+        
+        self.add_slot_btn = QPushButton("В расписание")
+        self.add_slot_btn.setStyleSheet(self.get_action_button_style())
+        self.add_slot_btn.clicked.connect(self.logic_handler.add_timetable_slot)
+        slot_layout.addWidget(self.add_slot_btn)
+        timetable_layout.addLayout(slot_layout)
+        
+        self.timetable_info_label = QLabel("Занятий в неделю: 0")
+        self.timetable_info_label.setStyleSheet("QLabel { color: blue; font-weight: bold; }")
+        timetable_layout.addWidget(self.timetable_info_label)
+        
+        self.timetable_tree = QTreeWidget()
+        self.timetable_tree.setHeaderLabels(["День", "Неделя", "Занятие"])
+        self.timetable_tree.setRootIsDecorated(False)
+        self.timetable_tree.setMinimumHeight(150)
+        timetable_layout.addWidget(self.timetable_tree)
+        
+        timetable_btn_layout = QHBoxLayout()
+        self.remove_slot_btn = QPushButton("Убрать")
+        self.remove_slot_btn.setStyleSheet(self.get_danger_button_style())
+        self.remove_slot_btn.clicked.connect(self.logic_handler.remove_timetable_slot)
+        timetable_btn_layout.addWidget(self.remove_slot_btn)
+        
+        self.fill_timetable_btn = QPushButton("Заполнить период")
+        self.fill_timetable_btn.setStyleSheet(self.get_action_button_style())
+        self.fill_timetable_btn.clicked.connect(self.logic_handler.fill_from_timetable)
+        self.fill_timetable_btn.setEnabled(False)
+        timetable_btn_layout.addWidget(self.fill_timetable_btn)
+        timetable_layout.addLayout(timetable_btn_layout)
+        
+        input_splitter.addWidget(timetable_group)
+        self.logic_handler.update_timetable_view()
+        
         # Установка пропорций
-        input_splitter.setSizes([300, 400, 200])
+        input_splitter.setSizes([300, 400, 200, 300, 300])
         
         parent_layout.addWidget(input_splitter)
         
-        # Кнопка добавления записей
+        # Кнопки добавления записей
+        add_layout = QHBoxLayout()
         self.add_entries_btn = QPushButton("Добавить записи")
         self.add_entries_btn.setStyleSheet(self.get_action_button_style())
         self.add_entries_btn.clicked.connect(self.logic_handler.add_entries)
         self.add_entries_btn.setEnabled(False)
-        parent_layout.addWidget(self.add_entries_btn)
+        add_layout.addWidget(self.add_entries_btn)
+        
+        self.queue_job_btn = QPushButton("В очередь")
+        self.queue_job_btn.setStyleSheet(self.get_action_button_style())
+        self.queue_job_btn.clicked.connect(self.logic_handler.queue_job)
+        add_layout.addWidget(self.queue_job_btn)
+        
+        self.commit_queue_btn = QPushButton("Записать очередь")
+        self.commit_queue_btn.setStyleSheet(self.get_action_button_style())
+        self.commit_queue_btn.clicked.connect(self.logic_handler.commit_queue)
+        self.commit_queue_btn.setEnabled(False)
+        add_layout.addWidget(self.commit_queue_btn)
+        
+        self.clear_queue_btn = QPushButton("Очистить очередь")
+        self.clear_queue_btn.setStyleSheet(self.get_danger_button_style())
+        self.clear_queue_btn.clicked.connect(self.logic_handler.clear_queue)
+        add_layout.addWidget(self.clear_queue_btn)
+        
+        parent_layout.addLayout(add_layout)
     
     def create_view_section(self, parent_layout):
         """Создает секцию просмотра данных"""
@@ -319,8 +440,9 @@ class JournalApp(QMainWindow):
         
         # Таблица данных
         self.table_widget = QTableWidget()
-        self.table_widget.setColumnCount(7)
-        self.table_widget.setHorizontalHeaderLabels(["Число", "Дисциплина", "Группа", "Нагрузка", "Лекции", "Практические", "Лабораторные"])
+        hours_labels = [label for field, label, column in self.logic_handler.HOURS_FIELDS]
+        self.table_widget.setColumnCount(4 + len(hours_labels))
+        self.table_widget.setHorizontalHeaderLabels(["Число", "Дисциплина", "Группа", "Нагрузка"] + hours_labels)
         
         # Настройка таблицы
         self.table_widget.setSelectionBehavior(QAbstractItemView.SelectRows)
@@ -330,14 +452,45 @@ class JournalApp(QMainWindow):
         self.table_widget.verticalHeader().setVisible(False)
         
         # Установка ширины колонок
-        column_widths = [80, 250, 120, 100, 80, 100, 100]
+        column_widths = [80, 250, 120, 100] + [100] * len(hours_labels)
         for i, width in enumerate(column_widths):
             self.table_widget.setColumnWidth(i, width)
         
-        view_layout.addWidget(self.table_widget)
+        # Боковая панель итогов семестра: план и факт по строкам листов "осень"/"весна"
+        totals_group = QGroupBox("Итоги семестра")
+        totals_layout = QVBoxLayout(totals_group)
+        
+        self.totals_season_combo = QComboBox()
+        self.totals_season_combo.addItems(self.logic_handler.SEASON_SHEETS)
+        self.totals_season_combo.currentTextChanged.connect(self.logic_handler.update_totals)
+        totals_layout.addWidget(self.totals_season_combo)
+        
+        self.totals_table = QTableWidget()
+        self.totals_table.setColumnCount(6)
+        self.totals_table.setHorizontalHeaderLabels(["Дисциплина", "Группа", "Нагрузка", "План", "Факт", "Откл."])
+        self.totals_table.setEditTriggers(QAbstractItemView.NoEditTriggers)
+        self.totals_table.setAlternatingRowColors(True)
+        self.totals_table.verticalHeader().setVisible(False)
+        for i, width in enumerate([150, 90, 60, 50, 50, 50]):
+            self.totals_table.setColumnWidth(i, width)
+        totals_layout.addWidget(self.totals_table)
+        
+        view_splitter = QSplitter(Qt.Horizontal)
+        view_splitter.addWidget(self.table_widget)
+        view_splitter.addWidget(totals_group)
+        view_splitter.setSizes([1000, 450])
+        view_layout.addWidget(view_splitter)
         
         parent_layout.addWidget(view_group)
     
+    def make_completer(self, field):
+        """Подсказки по префиксу из каталога: модель отсортирована, и комплитер ищет в ней двоичным поиском"""
+        completer = QCompleter(self.logic_handler.catalog_models[field], self)
+        completer.setCaseSensitivity(Qt.CaseInsensitive)
+        completer.setModelSorting(QCompleter.CaseInsensitivelySortedModel)
+        completer.setCompletionMode(QCompleter.PopupCompletion)
+        return completer
+
     def get_action_button_style(self):
         """Возвращает стиль для кнопок действий"""
         return """
@@ -397,6 +550,10 @@ class JournalApp(QMainWindow):
     
     def closeEvent(self, event):
         """Обработчик закрытия приложения"""
+        self.logic_handler.cancel_loading()
+        self.logic_handler.wait_for_formulas()
+        self.logic_handler.wait_for_saves()
+        self.logic_handler.wait_for_snapshot()
         self.logic_handler.close_workbook()
         self.logic_handler.save_config()
         event.accept()
\ No newline at end of file
@@ -0,0 +1,676 @@
+import hashlib
+import os
+import posixpath
+import re
+import shutil
+import tempfile
+import threading
+import zipfile
+from io import BytesIO
+from xml.etree import ElementTree
+
+from openpyxl.packaging.relationship import get_rels_path
+from openpyxl.reader.excel import ExcelReader
+from openpyxl.styles.stylesheet import write_stylesheet
+from openpyxl.worksheet._reader import WorkSheetParser, WorksheetReader
+from openpyxl.worksheet._writer import WorksheetWriter
+from openpyxl.xml.constants import ARC_STYLE, ARC_WORKBOOK, PKG_REL_NS, REL_NS, SHEET_MAIN_NS
+from openpyxl.xml.functions import tostring
+from journal_formulas import FormulaEvaluator, apply_cached_values
+
+
+# Связи листа с частями, которые openpyxl не читает и не пишет (настройки принтера Excel).
+# Лист с такими связями можно не разбирать при загрузке и перезаписывать при сохранении,
+# копируя сами связи и части без изменений
+PASSIVE_SHEET_RELS = ('/printerSettings',)
+
+
+class LoadCancelled(Exception):
+    """Загрузка книги отменена пользователем"""
+
+
+class PatchSaveUnsupported(Exception):
+    """Книгу нельзя сохранить перезаписью только измененных листов"""
+
+
+class ProgressExcelReader(ExcelReader):
+    """Читатель книги, сообщающий о ходе загрузки по листам и поддерживающий отмену
+
+    Листы без связанных частей (примечаний, рисунков) или только с настройками принтера,
+    которые есть у каждого листа, сохраненного Excel, не разбираются при загрузке:
+    вместо них создаются пустые заготовки, которые LazyWorkbook заполняет при первом обращении.
+    """
+
+    def __init__(self, filename, on_progress=None, is_cancelled=None):
+        super().__init__(filename)
+        self.on_progress = on_progress
+        self.is_cancelled = is_cancelled
+        self.deferred_sheets = {}
+
+    def read_worksheets(self):
+        sheets = list(self.parser.find_sheets())
+        total = len(sheets)
+
+        def tracked_sheets():
+            for index, (sheet, rel) in enumerate(sheets):
+                if self.is_cancelled and self.is_cancelled():
+                    raise LoadCancelled()
+                if self.on_progress:
+                    self.on_progress(index, total, sheet.name)
+                
+                if self.can_defer(rel):
+                    # Заготовка создается здесь же, чтобы порядок листов в книге не изменился
+                    ws = self.wb.create_sheet(sheet.name)
+                    ws.sheet_state = sheet.state
+                    self.deferred_sheets[sheet.name] = rel.target
+                    continue
+                yield sheet, rel
+            if self.on_progress:
+                self.on_progress(total, total, "")
+
+        self.parser.find_sheets = tracked_sheets
+        super().read_worksheets()
+
+    def can_defer(self, rel):
+        if rel.target not in self.valid_files or "chartsheet" in rel.Type:
+            return False
+        rels_path = get_rels_path(rel.target)
+        return rels_path not in self.valid_files or has_only_passive_rels(self.archive.read(rels_path))
+
+
+def has_only_passive_rels(rels_xml):
+    """Проверяет, что все связи листа ведут к частям, которые копируются без изменений"""
+    rels = ElementTree.fromstring(rels_xml)
+    return all(rel.get('Type', '').endswith(PASSIVE_SHEET_RELS)
+               for rel in rels.iter(f'{{{PKG_REL_NS}}}Relationship'))
+
+
+def load_workbook_with_progress(filename, on_progress=None, is_cancelled=None):
+    """Загружает книгу, вызывая on_progress(индекс, всего, лист) перед разбором каждого листа"""
+    reader = ProgressExcelReader(filename, on_progress, is_cancelled)
+    try:
+        reader.read()
+    finally:
+        reader.archive.close()
+    return LazyWorkbook(reader.wb, filename, reader.deferred_sheets, reader.shared_strings)
+
+
+class LazyWorkbook:
+    """Фасад книги openpyxl, разбирающий листы только при первом обращении к ним
+
+    Неразобранные листы при частичном сохранении копируются из файла без изменений,
+    поэтому они остаются неразобранными и после сохранения.
+    """
+
+    def __init__(self, wb, filename, deferred_sheets, shared_strings):
+        self.workbook = wb
+        self.filename = filename
+        self.deferred_sheets = dict(deferred_sheets)
+        self.shared_strings = shared_strings
+        self.lock = threading.RLock()
+
+    @property
+    def sheetnames(self):
+        return self.workbook.sheetnames
+
+    def __contains__(self, sheet_name):
+        return sheet_name in self.workbook
+
+    def __getitem__(self, sheet_name):
+        self.materialize(sheet_name)
+        return self.workbook[sheet_name]
+
+    def __getattr__(self, name):
+        # Стили, имена и прочие общие части книги берутся из самой книги openpyxl
+        return getattr(self.workbook, name)
+
+    def is_materialized(self, sheet_name):
+        return sheet_name not in self.deferred_sheets
+
+    def materialize(self, sheet_name):
+        """Разбирает отложенный лист из файла в его заготовку"""
+        with self.lock:
+            part = self.deferred_sheets.get(sheet_name)
+            if part is None:
+                return
+            
+            ws = self.workbook[sheet_name]
+            with zipfile.ZipFile(self.filename) as archive:
+                with archive.open(part) as src:
+                    WorksheetReader(ws, src, self.shared_strings, self.workbook._data_only, False).bind_all()
+            del self.deferred_sheets[sheet_name]
+
+    def materialize_all(self):
+        with self.lock:
+            for sheet_name in list(self.deferred_sheets):
+                self.materialize(sheet_name)
+
+    def save(self, filename):
+        """Полное сохранение openpyxl - перед ним разбираются все отложенные листы"""
+        self.materialize_all()
+        self.workbook.save(filename)
+
+    def close(self):
+        self.workbook.close()
+
+
+def read_workbook_rels(archive):
+    """Возвращает связи книги: идентификатор -> (тип связи, путь части внутри пакета)"""
+    workbook_rels_path = posixpath.join(posixpath.dirname(ARC_WORKBOOK), '_rels', 'workbook.xml.rels')
+    rels = ElementTree.fromstring(archive.read(workbook_rels_path))
+    targets = {}
+    for rel in rels.iter(f'{{{PKG_REL_NS}}}Relationship'):
+        target = rel.get('Target')
+        if target.startswith('/'):
+            target = target[1:]
+        else:
+            target = posixpath.normpath(posixpath.join(posixpath.dirname(ARC_WORKBOOK), target))
+        targets[rel.get('Id')] = (rel.get('Type'), target)
+    return targets
+
+
+def read_sheet_parts(archive):
+    """Возвращает соответствие 'имя листа' -> путь XML-части листа внутри пакета"""
+    targets = {rel_id: target for rel_id, (rel_type, target) in read_workbook_rels(archive).items()}
+    
+    workbook = ElementTree.fromstring(archive.read(ARC_WORKBOOK))
+    parts = {}
+    for sheet in workbook.iter(f'{{{SHEET_MAIN_NS}}}sheet'):
+        parts[sheet.get('name')] = targets.get(sheet.get(f'{{{REL_NS}}}id'))
+    return parts
+
+
+def count_style_records(styles_xml):
+    """Считает форматы ячеек и дифференциальные стили в styles.xml"""
+    root = ElementTree.fromstring(styles_xml)
+    cell_xfs = root.find(f'{{{SHEET_MAIN_NS}}}cellXfs')
+    dxfs = root.find(f'{{{SHEET_MAIN_NS}}}dxfs')
+    return (len(cell_xfs) if cell_xfs is not None else 0,
+            len(dxfs) if dxfs is not None else 0)
+
+
+def render_worksheet_xml(ws):
+    """Сериализует один лист openpyxl в XML-часть пакета"""
+    writer = WorksheetWriter(ws, out=BytesIO())
+    writer.write()
+    # Связанные части (примечания, рисунки, ссылки) пришлось бы переписывать вместе с листом
+    if writer._rels or ws._comments or ws._images or ws._charts or ws.legacy_drawing is not None:
+        raise PatchSaveUnsupported(f"Лист {ws.title} содержит связанные части")
+    return writer.read()
+
+
+def restore_page_setup_rel(sheet_xml, source_xml):
+    """Возвращает перезаписанному листу ссылку на настройки принтера, которую openpyxl не сохраняет"""
+    source_tag = re.search(r'<(?:\w+:)?pageSetup\b[^>]*>', source_xml.decode('utf-8'))
+    rel_id = re.search(r'\s\w+:id="([^"]*)"', source_tag.group(0)) if source_tag else None
+    if not rel_id:
+        return sheet_xml
+    text = sheet_xml.decode('utf-8')
+    tag = re.search(r'<(?:\w+:)?pageSetup\b[^>]*?(?=\s*/?>)', text)
+    if not tag or ':id=' in tag.group(0):
+        return sheet_xml
+    rel_attrs = f' xmlns:r="{REL_NS}" r:id="{rel_id.group(1)}"'
+    return (text[:tag.end()] + rel_attrs + text[tag.end():]).encode('utf-8')
+
+
+def mark_full_recalculation(workbook_xml):
+    """Просит Excel пересчитать формулы при открытии, так как кэш значений устарел"""
+    text = workbook_xml.decode('utf-8')
+    calc_pr = re.search(r'<(\w+:)?calcPr\b[^>]*?/?>', text)
+    if not calc_pr:
+        return workbook_xml
+    tag = calc_pr.group(0)
+    if 'fullCalcOnLoad=' in tag:
+        new_tag = re.sub(r'fullCalcOnLoad="[^"]*"', 'fullCalcOnLoad="1"', tag)
+    else:
+        new_tag = re.sub(r'(/?>)$', r' fullCalcOnLoad="1"\1', tag)
+    return (text[:calc_pr.start()] + new_tag + text[calc_pr.end():]).encode('utf-8')
+
+
+def read_style_counts(filename):
+    """Считает записи таблицы стилей файла; None, если файла или таблицы стилей нет"""
+    if not os.path.exists(filename):
+        return None
+    with zipfile.ZipFile(filename) as source:
+        if ARC_STYLE not in source.NameToInfo:
+            return None
+        return count_style_records(source.read(ARC_STYLE))
+
+
+class PackageChanges:
+    """Изменения книги для частичного сохранения, снятые с книги в памяти
+
+    Снимаются под блокировкой сессии: измененные листы сразу сериализуются в XML, значения
+    формул копируются. Пакет по ним пишется уже без блокировки, пока книгу можно менять.
+    style_counts - число записей таблицы стилей в файле: styles.xml перегенерируется,
+    только когда стилей в книге стало больше (новые стили дописываются в конец таблиц).
+    """
+
+    def __init__(self, wb, dirty_titles, formula_values, style_counts):
+        self.sheetnames = list(wb.sheetnames)
+        self.sheets = {title: render_worksheet_xml(wb[title]) for title in dirty_titles}
+        # Лист -> значения формул, которые нужно записать в его XML
+        self.formula_values = formula_values
+        self.stylesheet = None
+        if style_counts != (len(wb._cell_styles), len(wb._differential_styles.styles)):
+            self.stylesheet = tostring(write_stylesheet(wb))
+
+
+def write_patched_package(source_filename, changes, out_file):
+    """Пишет пакет, подменяя только измененные листы и копируя остальные части из исходного файла"""
+    with zipfile.ZipFile(source_filename) as source:
+        sheet_parts = read_sheet_parts(source)
+        if set(sheet_parts) != set(changes.sheetnames):
+            raise PatchSaveUnsupported("Состав листов книги изменился")
+        
+        replacements = {}
+        for title, sheet_xml in changes.sheets.items():
+            part = sheet_parts.get(title)
+            if not part or part not in source.NameToInfo:
+                raise PatchSaveUnsupported(f"Не найдена часть листа {title}")
+            rels_path = get_rels_path(part)
+            if rels_path in source.NameToInfo:
+                # Настройки принтера и их связи копируются как есть, лист только ссылается на них
+                if not has_only_passive_rels(source.read(rels_path)):
+                    raise PatchSaveUnsupported(f"Лист {title} содержит связанные части")
+                sheet_xml = restore_page_setup_rel(sheet_xml, source.read(part))
+            replacements[part] = sheet_xml
+        
+        # Значения формул дописываются и в неизмененные листы, если формулы в них пересчитались
+        for title, values in changes.formula_values.items():
+            part = sheet_parts.get(title)
+            if part and part in source.NameToInfo:
+                replacements[part] = apply_cached_values(replacements.get(part) or source.read(part), values)
+        
+        if ARC_STYLE in source.NameToInfo:
+            if changes.stylesheet is not None:
+                replacements[ARC_STYLE] = changes.stylesheet
+        elif replacements:
+            raise PatchSaveUnsupported("В пакете нет таблицы стилей")
+        
+        if replacements:
+            replacements[ARC_WORKBOOK] = mark_full_recalculation(source.read(ARC_WORKBOOK))
+        
+        copy_package(source, out_file, replacements)
+
+
+def copy_package(source, out_file, replacements):
+    """Копирует части пакета source в out_file, подменяя части из replacements"""
+    with zipfile.ZipFile(out_file, 'w', zipfile.ZIP_DEFLATED) as target:
+        for info in source.infolist():
+            data = replacements.get(info.filename)
+            if data is None:
+                data = source.read(info)
+            target.writestr(info, data)
+
+
+def write_full_package(wb, out_file, formula_values=None):
+    """Полное сохранение книги openpyxl с записью значений формул"""
+    if not formula_values:
+        wb.save(out_file)
+        return
+    
+    buffer = BytesIO()
+    wb.save(buffer)
+    with zipfile.ZipFile(buffer) as source:
+        sheet_parts = read_sheet_parts(source)
+        replacements = {sheet_parts[title]: apply_cached_values(source.read(sheet_parts[title]), values)
+                        for title, values in formula_values.items() if sheet_parts.get(title)}
+        copy_package(source, out_file, replacements)
+
+
+def write_workbook_to_temp(filename, changes, write_full):
+    """Пишет книгу во временный файл рядом с оригиналом и возвращает его путь
+
+    changes - снятые с книги изменения (PackageChanges): по ним перезаписываются только
+    измененные листы, остальные части пакета копируются из текущего файла без изменений.
+    Если так сохранить нельзя, книга пишется целиком функцией write_full(файл).
+    """
+    directory = os.path.dirname(os.path.abspath(filename))
+    suffix = os.path.splitext(filename)[1]
+    fd, temp_path = tempfile.mkstemp(prefix=".~journal_", suffix=suffix, dir=directory)
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            patched = False
+            if changes is not None and os.path.exists(filename):
+                try:
+                    write_patched_package(filename, changes, f)
+                    patched = True
+                except PatchSaveUnsupported as e:
+                    print(f"Частичное сохранение невозможно, сохраняем книгу целиком: {e}")
+                    f.seek(0)
+                    f.truncate()
+            if not patched:
+                write_full(f)
+            f.flush()
+            os.fsync(f.fileno())
+        if os.path.exists(filename):
+            shutil.copymode(filename, temp_path)
+        
+        # Проверяем, что пакет читается целиком, прежде чем подменять им журнал
+        with zipfile.ZipFile(temp_path) as archive:
+            broken_part = archive.testzip()
+        if broken_part:
+            raise IOError(f"Поврежден элемент {broken_part} во временном файле")
+        return temp_path
+    except BaseException:
+        remove_temp_file(temp_path)
+        raise
+
+
+def remove_temp_file(path):
+    """Удаляет временный файл, не поднимая ошибок"""
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+
+class StreamingSheetReader:
+    """Читает значения нужных колонок листа прямо из XML пакета, не строя модель openpyxl
+
+    Метаданные пакета (листы, общие строки) кэшируются и перечитываются,
+    только когда файл на диске меняется.
+    """
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.file_stat = None
+        self.sheet_parts = {}
+        self.shared_strings = []
+
+    def refresh_metadata(self):
+        """Перечитывает список листов и общие строки, если файл изменился"""
+        file_stat = read_file_stat(self.filename)
+        if file_stat == self.file_stat:
+            return
+        
+        with zipfile.ZipFile(self.filename) as archive:
+            self.read_metadata(archive)
+        self.file_stat = file_stat
+
+    def read_metadata(self, archive):
+        """Читает список листов и общие строки из открытого пакета"""
+        self.sheet_parts = read_sheet_parts(archive)
+        self.shared_strings = []
+        for rel_type, target in read_workbook_rels(archive).values():
+            if rel_type.endswith('/sharedStrings') and target in archive.NameToInfo:
+                with archive.open(target) as src:
+                    self.shared_strings = self.parse_shared_strings(src)
+
+    def parse_shared_strings(self, src):
+        strings = []
+        for _, elem in ElementTree.iterparse(src):
+            if elem.tag == f'{{{SHEET_MAIN_NS}}}si':
+                strings.append(''.join(t.text or '' for t in elem.iter(f'{{{SHEET_MAIN_NS}}}t')))
+                elem.clear()
+        return strings
+
+    @property
+    def sheetnames(self):
+        self.refresh_metadata()
+        return list(self.sheet_parts)
+
+    def file_stamp(self):
+        """Размер и время изменения файла, по которым кэшируются прочитанные из него данные"""
+        return read_file_stat(self.filename)
+
+    def read_rows(self, sheet_name, first_row, last_row, columns):
+        """Возвращает кортежи (номер строки, значения колонок...) для строк first_row..last_row
+
+        Строки, которых нет в XML (полностью пустые), пропускаются.
+        """
+        self.refresh_metadata()
+        part = self.sheet_parts.get(sheet_name)
+        if not part:
+            return []
+        
+        column_positions = {column: index for index, column in enumerate(columns)}
+        row_tag = f'{{{SHEET_MAIN_NS}}}row'
+        cell_tag = f'{{{SHEET_MAIN_NS}}}c'
+        rows = []
+        
+        with zipfile.ZipFile(self.filename) as archive:
+            with archive.open(part) as src:
+                row_number = 0
+                for _, elem in ElementTree.iterparse(src):
+                    if elem.tag != row_tag:
+                        continue
+                    
+                    row_number = int(elem.get('r', row_number + 1))
+                    if row_number > last_row:
+                        break
+                    if row_number >= first_row:
+                        values = [None] * len(columns)
+                        for cell in elem.iter(cell_tag):
+                            column = cell.get('r').rstrip('0123456789')
+                            position = column_positions.get(column)
+                            if position is not None:
+                                values[position] = self.read_cell_value(cell)
+                        rows.append((row_number,) + tuple(values))
+                    elem.clear()
+        
+        return rows
+
+    def read_cell_value(self, cell):
+        """Преобразует значение ячейки XML так же, как это делает openpyxl"""
+        cell_type = cell.get('t', 'n')
+        if cell_type == 'inlineStr':
+            return ''.join(t.text or '' for t in cell.iter(f'{{{SHEET_MAIN_NS}}}t'))
+        
+        value_elem = cell.find(f'{{{SHEET_MAIN_NS}}}v')
+        if value_elem is None or value_elem.text is None:
+            return None
+        value = value_elem.text
+        
+        if cell_type == 's':
+            return self.shared_strings[int(value)]
+        if cell_type == 'b':
+            return value == '1'
+        if cell_type == 'n':
+            if '.' in value or 'E' in value or 'e' in value:
+                return float(value)
+            return int(value)
+        return value
+
+    def read_cells(self, archive, sheet_name, wb):
+        """Возвращает все непустые ячейки листа из открытого пакета: (строка, колонка) -> значение
+
+        Ячейки разбираются парсером openpyxl (формулы - текстом с '=', даты - датами),
+        но модель листа не строится. Метаданные должны быть прочитаны из того же пакета.
+        """
+        part = self.sheet_parts.get(sheet_name)
+        if not part or part not in archive.NameToInfo:
+            return {}
+
+        cells = {}
+        with archive.open(part) as src:
+            parser = WorkSheetParser(src, self.shared_strings, epoch=wb.epoch, date_formats=wb._date_formats)
+            for row_number, row in parser.parse():
+                for cell in row:
+                    if cell['value'] is not None:
+                        cells[(cell['row'], cell['column'])] = cell['value']
+        return cells
+
+
+def collect_entry_rows(rows, start_row):
+    """Отбирает записи месячного листа из прочитанных строк
+
+    Записи идут подряд с start_row до первой пустой ячейки в колонке числа;
+    строки, где вместо числа записано что-то другое, пропускаются.
+    """
+    entries = []
+    expected_row = start_row
+    for row in rows:
+        if row[0] != expected_row or row[1] is None:
+            break
+        expected_row += 1
+        if isinstance(row[1], (int, float)):
+            entries.append(row)
+    return entries
+
+
+def read_file_stat(filename):
+    """Возвращает дешевую часть отпечатка файла: размер и время изменения"""
+    stat = os.stat(filename)
+    return stat.st_size, stat.st_mtime_ns
+
+
+def build_formula_evaluator(wb, filename, sheet_names):
+    """Строит вычислитель формул листов sheet_names по файлу книги, не разбирая ее отложенные листы
+
+    Весь файл читается из одного открытого пакета, чтобы листы и общие строки были
+    из одной его версии, даже если файл тем временем подменит сохранение.
+    """
+    reader = StreamingSheetReader(filename)
+    with zipfile.ZipFile(filename) as archive:
+        reader.read_metadata(archive)
+        return FormulaEvaluator(wb, sheet_names, lambda sheet_name: reader.read_cells(archive, sheet_name, wb))
+
+
+def compute_file_hash(filename, chunk_size=1024 * 1024):
+    """Считает хеш содержимого файла блоками"""
+    digest = hashlib.blake2b(digest_size=16)
+    with open(filename, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class WorkbookSession:
+    """Держит рабочую книгу в памяти между операциями и следит за изменениями файла на диске"""
+
+    def __init__(self):
+        self.filename = None
+        self.wb = None
+        self.file_stat = None
+        self.content_hash = None
+        # Листы, измененные с момента последнего сохранения
+        self.dirty_sheets = set()
+        # Поколение книги растет при каждой (пере)загрузке, поколение листа - при каждой записи в него
+        self.generation = 0
+        self.sheet_generations = {}
+        # Номер последней операции журнала операций, примененной к книге в памяти
+        self.applied_seq = 0
+        # Листы, значения формул которых вычисляются при сохранении, и их вычислитель
+        self.formula_sheets = []
+        self.formulas = None
+        # Защищает книгу от изменений, пока фоновое сохранение ее сериализует
+        self.lock = threading.RLock()
+
+    def attach(self, filename, wb):
+        """Запоминает загруженную книгу и отпечаток файла, из которого она прочитана"""
+        self.filename = filename
+        self.wb = wb
+        self.dirty_sheets = set()
+        self.generation += 1
+        self.sheet_generations = {}
+        self.formulas = None
+        self.remember_fingerprint()
+
+    def close(self):
+        """Закрывает книгу и забывает отпечаток файла"""
+        if self.wb:
+            self.wb.close()
+        self.wb = None
+        self.file_stat = None
+        self.content_hash = None
+        self.generation += 1
+        self.sheet_generations = {}
+        self.formulas = None
+
+    def mark_dirty(self, sheet_name, first_row=None, last_row=None):
+        """Отмечает лист как измененный, чтобы перезаписать его при сохранении
+
+        first_row..last_row - измененные строки: зависящие от них формулы будут пересчитаны.
+        Без них пересчитываются формулы, зависящие от любой ячейки листа.
+        """
+        with self.lock:
+            self.dirty_sheets.add(sheet_name)
+            self.sheet_generations[sheet_name] = self.sheet_generations.get(sheet_name, 0) + 1
+            if self.formulas:
+                if first_row is None:
+                    self.formulas.invalidate_sheet(sheet_name)
+                else:
+                    self.formulas.invalidate_rows(sheet_name, first_row, last_row)
+
+    def attach_formulas(self, formulas, generation):
+        """Подключает вычислитель, построенный в фоне по файлу книги поколения generation
+
+        Файл мог отстать от книги в памяти, поэтому формулы листов, измененных после
+        загрузки, пересчитываются. Возвращает False, если книгу с тех пор перезагрузили.
+        """
+        with self.lock:
+            if generation != self.generation:
+                return False
+            for sheet_name in self.sheet_generations:
+                formulas.invalidate_sheet(sheet_name)
+            formulas.use_workbook = True
+            self.formulas = formulas
+            return True
+
+    def prepare_formulas(self):
+        """Досчитывает значения формул перед сохранением; при ошибке книга сохраняется без них
+
+        Пока вычислитель строится в фоне, книга тоже сохраняется без значений формул.
+        """
+        with self.lock:
+            if self.formulas is None:
+                return None
+            try:
+                self.formulas.evaluate_all()
+            except Exception as e:
+                print(f"Ошибка вычисления формул: {e}")
+                self.formulas = None
+            return self.formulas
+
+    def sheet_generation(self, sheet_name):
+        """Возвращает пару (поколение книги, поколение листа) для проверки кэшей"""
+        return self.generation, self.sheet_generations.get(sheet_name, 0)
+
+    def take_dirty_sheets(self):
+        """Забирает набор измененных листов для очередного сохранения"""
+        with self.lock:
+            dirty_sheets = self.dirty_sheets
+            self.dirty_sheets = set()
+            return dirty_sheets
+
+    def restore_dirty_sheets(self, sheet_names):
+        """Возвращает листы в набор измененных после неудачного сохранения"""
+        with self.lock:
+            self.dirty_sheets.update(sheet_names)
+
+    def remember_fingerprint(self):
+        """Обновляет отпечаток после загрузки или сохранения файла"""
+        try:
+            self.file_stat = read_file_stat(self.filename)
+            self.content_hash = compute_file_hash(self.filename)
+        except OSError as e:
+            print(f"Ошибка чтения отпечатка файла: {e}")
+            self.file_stat = None
+            self.content_hash = None
+
+    def is_changed_on_disk(self):
+        """Проверяет, изменился ли файл вне приложения с момента загрузки или сохранения"""
+        if not self.wb or not self.filename:
+            return True
+
+        try:
+            file_stat = read_file_stat(self.filename)
+        except OSError:
+            return True
+
+        if file_stat == self.file_stat:
+            return False
+
+        # Размер или время изменились - сверяем содержимое, чтобы не перечитывать файл,
+        # который только "потрогали" (копирование, синхронизация облака и т.п.)
+        try:
+            content_hash = compute_file_hash(self.filename)
+        except OSError:
+            return True
+
+        if content_hash == self.content_hash:
+            self.file_stat = file_stat
+            return False
+        return True
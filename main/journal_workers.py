@@ -0,0 +1,221 @@
+import os
+import time
+from PySide6.QtCore import QObject, QRunnable, Signal
+from journal_workbook import (LoadCancelled, PackageChanges, PatchSaveUnsupported, build_formula_evaluator,
+                              load_workbook_with_progress, read_style_counts, write_full_package,
+                              write_workbook_to_temp, remove_temp_file)
+from journal_cache import SidecarCache, build_snapshot
+
+
+class WorkbookLoadSignals(QObject):
+    """Сигналы фоновой загрузки книги"""
+    progress = Signal(int, int, str)
+    finished = Signal(str, object)
+    failed = Signal(str)
+    cancelled = Signal()
+
+
+class WorkbookLoadWorker(QRunnable):
+    """Загружает рабочую книгу в пуле потоков, не блокируя окно"""
+
+    MAX_RETRIES = 3
+    RETRY_DELAY = 0.5
+
+    def __init__(self, filename):
+        super().__init__()
+        self.filename = filename
+        self.signals = WorkbookLoadSignals()
+        self.cancel_requested = False
+
+    def cancel(self):
+        """Просит прервать загрузку перед разбором следующего листа"""
+        self.cancel_requested = True
+
+    def is_cancelled(self):
+        return self.cancel_requested
+
+    def run(self):
+        for attempt in range(self.MAX_RETRIES):
+            try:
+                if not os.path.exists(self.filename):
+                    self.signals.failed.emit(f"Файл {self.filename} не найден")
+                    return
+                wb = load_workbook_with_progress(self.filename, self.signals.progress.emit, self.is_cancelled)
+                self.signals.finished.emit(self.filename, wb)
+                return
+            except LoadCancelled:
+                self.signals.cancelled.emit()
+                return
+            except PermissionError:
+                if attempt < self.MAX_RETRIES - 1 and not self.cancel_requested:
+                    time.sleep(self.RETRY_DELAY)
+                    continue
+                self.signals.failed.emit(
+                    f"Нет доступа к файлу {self.filename}!\n"
+                    f"Убедитесь, что файл не открыт в другой программе.")
+                return
+            except Exception as e:
+                self.signals.failed.emit(f"Ошибка загрузки файла: {e}")
+                return
+
+
+class WorkbookSaveSignals(QObject):
+    """Сигналы фонового сохранения книги"""
+    started = Signal()
+    retrying = Signal(int, float)
+    finished = Signal()
+    failed = Signal(str)
+
+
+class WorkbookSaveWorker(QRunnable):
+    """Сохраняет книгу во временный файл и атомарно подменяет им журнал"""
+
+    MAX_RETRIES = 6
+    FIRST_RETRY_DELAY = 0.5
+
+    def __init__(self, session, oplog=None):
+        super().__init__()
+        self.session = session
+        self.oplog = oplog
+        self.filename = session.filename
+        self.wb = session.wb
+        self.signals = WorkbookSaveSignals()
+        self.is_started = False
+        # Номер последней операции журнала операций, вошедшей в это сохранение
+        self.saved_seq = 0
+
+    def run(self):
+        self.is_started = True
+        self.signals.started.emit()
+        
+        dirty_sheets = set()
+        formulas = None
+        stale_sheets = set()
+        try:
+            # Файл меняет только очередь сохранений, поэтому стили файла можно посчитать до блокировки
+            style_counts = read_style_counts(self.filename)
+            # Под блокировкой только снимаем изменения; пакет пишется, пока книгу уже можно менять
+            with self.session.lock:
+                dirty_sheets = self.session.take_dirty_sheets()
+                self.saved_seq = self.session.applied_seq
+                formulas = self.session.prepare_formulas()
+                # Значения пересчитанных формул войдут во временный файл
+                stale_sheets = formulas.take_stale_sheets() if formulas else set()
+                changes = self.capture_changes(dirty_sheets, formulas, stale_sheets, style_counts)
+            temp_path = write_workbook_to_temp(self.filename, changes, self.write_full_package)
+            if self.oplog and self.saved_seq:
+                self.oplog.mark_saving(self.saved_seq, temp_path)
+        except Exception as e:
+            self.restore(dirty_sheets, formulas, stale_sheets)
+            self.signals.failed.emit(f"Ошибка сохранения файла: {e}")
+            return
+        
+        # Журнал может быть занят другой программой - ждем с нарастающей паузой
+        delay = self.FIRST_RETRY_DELAY
+        for attempt in range(self.MAX_RETRIES):
+            try:
+                os.replace(temp_path, self.filename)
+                # Чистим журнал операций здесь, а не в обработчике сигнала: при выходе из
+                # программы сигнал до окна уже не дойдет
+                if self.oplog:
+                    self.oplog.discard_through(self.saved_seq)
+                self.signals.finished.emit()
+                return
+            except PermissionError:
+                if attempt < self.MAX_RETRIES - 1:
+                    self.signals.retrying.emit(attempt + 1, delay)
+                    time.sleep(delay)
+                    delay *= 2
+                    continue
+                remove_temp_file(temp_path)
+                self.restore(dirty_sheets, formulas, stale_sheets)
+                self.signals.failed.emit(
+                    f"Нет доступа к файлу {self.filename}!\n"
+                    f"Убедитесь, что файл не открыт в другой программе.")
+                return
+            except Exception as e:
+                remove_temp_file(temp_path)
+                self.restore(dirty_sheets, formulas, stale_sheets)
+                self.signals.failed.emit(f"Ошибка сохранения файла: {e}")
+                return
+
+    def capture_changes(self, dirty_sheets, formulas, stale_sheets, style_counts):
+        """Снимает изменения книги для частичного сохранения; None - сохранить книгу целиком"""
+        # Перегенерированным листам нужны все значения формул, остальным - только пересчитанные
+        formula_values = formulas.sheet_values(dirty_sheets | stale_sheets) if formulas else {}
+        try:
+            return PackageChanges(self.wb, dirty_sheets, formula_values, style_counts)
+        except PatchSaveUnsupported as e:
+            print(f"Частичное сохранение невозможно, сохраняем книгу целиком: {e}")
+            return None
+
+    def write_full_package(self, out_file):
+        """Полное сохранение: книга сериализуется целиком, поэтому блокировка держится до конца записи"""
+        with self.session.lock:
+            # В файл попадет и все, что изменили после снятия изменений
+            self.saved_seq = self.session.applied_seq
+            formulas = self.session.prepare_formulas()
+            write_full_package(self.wb, out_file, formulas.sheet_values(formulas.sheet_names) if formulas else None)
+
+    def restore(self, dirty_sheets, formulas, stale_sheets):
+        """Возвращает несохраненные листы и значения формул в очередь следующего сохранения"""
+        self.session.restore_dirty_sheets(dirty_sheets)
+        if formulas:
+            with self.session.lock:
+                formulas.restore_stale_sheets(stale_sheets)
+
+
+class SnapshotBuildSignals(QObject):
+    """Сигналы фонового построения кэша журнала"""
+    finished = Signal(object)
+
+
+class SnapshotBuildWorker(QRunnable):
+    """Потоково читает журнал и записывает его снимок в кэш рядом с файлом"""
+
+    def __init__(self, filename, **layout):
+        super().__init__()
+        self.filename = filename
+        self.layout = layout
+        self.signals = SnapshotBuildSignals()
+        self.is_started = False
+
+    def run(self):
+        self.is_started = True
+        try:
+            snapshot = build_snapshot(self.filename, **self.layout)
+        except Exception as e:
+            print(f"Ошибка построения кэша журнала: {e}")
+            return
+        
+        if snapshot and SidecarCache(self.filename).store(snapshot):
+            self.signals.finished.emit(snapshot)
+
+
+class FormulaBuildSignals(QObject):
+    """Сигналы фонового построения вычислителя формул"""
+    finished = Signal(object)
+
+
+class FormulaBuildWorker(QRunnable):
+    """Строит граф зависимостей формул и вычисляет их по файлу журнала, не блокируя окно и сохранения
+
+    Книга в памяти не читается и не разбирается: вычислитель подключается к ней
+    уже в потоке окна, под блокировкой сессии.
+    """
+
+    def __init__(self, wb, filename, sheet_names):
+        super().__init__()
+        self.wb = wb
+        self.filename = filename
+        self.sheet_names = list(sheet_names)
+        self.signals = FormulaBuildSignals()
+
+    def run(self):
+        try:
+            formulas = build_formula_evaluator(self.wb, self.filename, self.sheet_names)
+            formulas.evaluate_all()
+        except Exception as e:
+            print(f"Ошибка вычисления формул: {e}")
+            return
+        self.signals.finished.emit(formulas)
@@ -0,0 +1,27 @@
+import os
+import shutil
+import sys
+
+import pytest
+
+os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Шаблон журнала в том виде, в каком его сохраняет Excel (с настройками печати у листов)
+TEMPLATE = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'test', 'JournalApp',
+                        'Тетрадь_ППС_2025_2026_каф_NN_Фамилия_ИО_оч_заоч.xltx')
+
+
+@pytest.fixture(scope='session')
+def qapp():
+    from PySide6.QtWidgets import QApplication
+    return QApplication.instance() or QApplication([])
+
+
+@pytest.fixture
+def journal_file(tmp_path, monkeypatch):
+    """Копия шаблона журнала во временной папке; конфигурация программы пишется туда же"""
+    monkeypatch.chdir(tmp_path)
+    path = tmp_path / 'journal.xltx'
+    shutil.copy(TEMPLATE, path)
+    return str(path)
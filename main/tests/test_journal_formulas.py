@@ -0,0 +1,33 @@
+import time
+
+import openpyxl
+from PySide6.QtCore import QCoreApplication
+
+from journal_logic import JournalLogic
+
+
+def wait_until(condition, timeout=60):
+    deadline = time.time() + timeout
+    while not condition():
+        assert time.time() < deadline, "Фоновая задача не завершилась"
+        QCoreApplication.processEvents()
+        time.sleep(0.01)
+
+
+def test_saved_file_has_formula_values(qapp, journal_file):
+    logic = JournalLogic()
+    logic.load_workbook(journal_file)
+    wait_until(lambda: logic.load_worker is None and logic.wb is not None)
+    logic.wait_for_formulas()
+    assert logic.session.formulas is not None
+
+    with logic.session.lock:
+        logic.wb['10']['D7'] = 'Запись'
+        logic.session.mark_dirty('10', 7, 7)
+    logic.safe_save_workbook()
+    wait_until(lambda: not logic.pending_saves)
+    logic.wait_for_snapshot()
+
+    wb = openpyxl.load_workbook(journal_file, data_only=True)
+    assert wb['10']['L2'].value is not None
+    assert wb['09']['L2'].value is not None
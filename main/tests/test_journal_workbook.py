@@ -0,0 +1,39 @@
+import re
+import zipfile
+
+from openpyxl.packaging.relationship import get_rels_path
+
+from journal_workbook import (PackageChanges, load_workbook_with_progress, read_sheet_parts,
+                              read_style_counts, write_workbook_to_temp)
+
+
+def fail_full_save(out_file):
+    raise AssertionError("Книга сохранена целиком вместо частичного сохранения")
+
+
+def test_patch_save_keeps_printer_settings(journal_file):
+    with zipfile.ZipFile(journal_file) as source:
+        sheet_parts = read_sheet_parts(source)
+        original = {name: source.read(name) for name in source.namelist()}
+    assert get_rels_path(sheet_parts['10']) in original
+
+    wb = load_workbook_with_progress(journal_file)
+    wb['10']['D7'] = 'Запись'
+    changes = PackageChanges(wb, {'10'}, {}, read_style_counts(journal_file))
+    temp_path = write_workbook_to_temp(journal_file, changes, fail_full_save)
+
+    with zipfile.ZipFile(temp_path) as saved:
+        assert set(saved.namelist()) == set(original)
+        for title, part in sheet_parts.items():
+            if title != '10':
+                assert saved.read(part) == original[part], title
+        for name, data in original.items():
+            if '/printerSettings/' in name or name.startswith('xl/worksheets/_rels/'):
+                assert saved.read(name) == data, name
+
+        sheet_xml = saved.read(sheet_parts['10']).decode('utf-8')
+    assert 'Запись' in sheet_xml
+    assert re.search(r'<pageSetup\b[^>]*\br:id="rId1"', sheet_xml)
+
+    reloaded = load_workbook_with_progress(temp_path)
+    assert reloaded['10']['D7'].value == 'Запись'
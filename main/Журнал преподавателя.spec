@@ -5,7 +5,7 @@ a = Analysis(
     ['main.py'],
     pathex=[],
     binaries=[],
-    datas=[('journal_ui.py', '.'), ('journal_logic.py', '.')],
+    datas=[('journal_ui.py', '.'), ('journal_logic.py', '.'), ('journal_workbook.py', '.'), ('journal_workers.py', '.'), ('journal_cache.py', '.'), ('journal_oplog.py', '.'), ('journal_model.py', '.'), ('journal_totals.py', '.'), ('journal_formulas.py', '.'), ('journal_catalog.py', '.'), ('journal_calendar.py', '.'), ('journal_timetable.py', '.'), ('journal_dates.py', '.'), ('journal_import.py', '.')],
     hiddenimports=[],
     hookspath=[],
     hooksconfig={},